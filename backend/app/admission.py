@@ -0,0 +1,144 @@
+"""Admission control for CPU-heavy endpoints.
+
+Endpoints are grouped into classes that share a concurrency limit:
+
+    ocr           receipt upload (PDF parsing)
+    aggregation   UStVA calculation, aging, dashboard, search, bank import
+    export        file downloads and preview rendering
+    offboarding   customer deletion (long-running, chunked)
+
+Each class admits at most ``concurrency`` requests at a time and lets at
+most ``queue_size`` further requests wait for a slot.  A request that
+finds the queue full, or that waits longer than ``max_wait`` seconds,
+is rejected immediately with ``429 Too Many Requests``.  Its
+``Retry-After`` header is estimated from the observed service time of
+the class (an exponentially weighted moving average) and the current
+queue length, so clients back off about as long as the backlog needs to
+drain.  Under overload the worker therefore keeps completing requests
+at full speed instead of letting every request slow down until all of
+them time out.
+
+Limits are configured per class through environment variables, e.g.
+``ADMISSION_OCR_CONCURRENCY``, ``ADMISSION_OCR_QUEUE`` and
+``ADMISSION_OCR_MAX_WAIT``.  The limits apply per worker process.
+
+Usage as a FastAPI dependency::
+
+    @router.post("/receipts/upload", dependencies=[Depends(limiters["ocr"])])
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import time
+from typing import AsyncIterator, Dict, List
+
+from fastapi import HTTPException
+
+CPU_COUNT = os.cpu_count() or 2
+# smoothing factor of the service-time average
+EWMA_ALPHA = 0.2
+
+
+class AdmissionLimiter:
+    """Concurrency limit with a bounded wait queue for one endpoint class."""
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        queue_size: int,
+        max_wait: float = 30.0,
+        initial_service_time: float = 1.0,
+    ) -> None:
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.max_wait = max_wait
+        self.service_time = initial_service_time
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    def retry_after(self) -> int:
+        """Seconds until a new request could expect a free slot."""
+        backlog = self.waiting + 1
+        return max(1, math.ceil(backlog * self.service_time / self.concurrency))
+
+    def _reject(self, detail: str) -> HTTPException:
+        self.rejected += 1
+        return HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    async def __call__(self) -> AsyncIterator[None]:
+        # fast path: a slot is free and nobody is queued ahead of us
+        if self.waiting or self._semaphore.locked():
+            if self.waiting >= self.queue_size:
+                raise self._reject(f"Zu viele gleichzeitige Anfragen ({self.name})")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise self._reject(f"Wartezeit überschritten ({self.name})") from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.service_time += EWMA_ALPHA * (elapsed - self.service_time)
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "service_time_seconds": round(self.service_time, 4),
+            "retry_after_seconds": self.retry_after(),
+        }
+
+
+def _from_env(name: str, concurrency: int, queue_size: int, max_wait: float) -> AdmissionLimiter:
+    prefix = f"ADMISSION_{name.upper()}_"
+    return AdmissionLimiter(
+        name,
+        concurrency=int(os.getenv(prefix + "CONCURRENCY", concurrency)),
+        queue_size=int(os.getenv(prefix + "QUEUE", queue_size)),
+        max_wait=float(os.getenv(prefix + "MAX_WAIT", max_wait)),
+    )
+
+
+limiters: Dict[str, AdmissionLimiter] = {
+    "ocr": _from_env("ocr", CPU_COUNT, 2 * CPU_COUNT, 30.0),
+    "aggregation": _from_env("aggregation", 2 * CPU_COUNT, 8 * CPU_COUNT, 10.0),
+    "export": _from_env("export", 4 * CPU_COUNT, 16 * CPU_COUNT, 10.0),
+    # own class: its long runtime must not skew the Retry-After of the others
+    "offboarding": _from_env("offboarding", 1, 4, 5.0),
+}
+
+
+def admission_stats() -> Dict[str, Dict[str, float]]:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+__all__: List[str] = ["AdmissionLimiter", "limiters", "admission_stats"]
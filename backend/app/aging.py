@@ -0,0 +1,166 @@
+"""Receivables aging of open items.
+
+Unpaid open items are grouped into the usual aging buckets by days
+overdue at a reference date::
+
+    current   not yet due
+    1-30      1 to 30 days overdue
+    31-60     31 to 60 days overdue
+    61-90     61 to 90 days overdue
+    90+       more than 90 days overdue
+
+The buckets are computed in the database with a single ``CASE``
+expression inside a ``GROUP BY``.  The bucket boundaries are passed as
+date parameters, so the query is portable and the filter on
+``(customer_id, paid, due_date)`` is served by
+``ix_open_items_customer_paid_due``.
+
+Results are kept in a short-lived in-process cache
+(``AGING_CACHE_TTL`` seconds, default 60).  Every write to open items
+must call :func:`invalidate_aging` so that a cached report never
+outlives a change made through this worker.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Hashable, List, Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from .models import OpenItem
+
+BUCKETS = ("current", "1-30", "31-60", "61-90", "90+")
+ZERO = Decimal("0.00")
+CACHE_TTL = float(os.getenv("AGING_CACHE_TTL", "60"))
+
+
+class _TTLCache:
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._entries: Dict[Hashable, tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, predicate) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+
+_cache = _TTLCache(CACHE_TTL)
+
+
+def invalidate_aging(customer_id: Optional[int] = None) -> None:
+    """Drop cached reports of ``customer_id`` and all portfolio reports.
+
+    Without ``customer_id`` the whole cache is cleared.
+    """
+    if customer_id is None:
+        _cache.invalidate(lambda key: True)
+    else:
+        _cache.invalidate(lambda key: key[0] == "portfolio" or key[1] == customer_id)
+
+
+def _bucket(as_of: date):
+    return case(
+        (OpenItem.due_date >= as_of, BUCKETS[0]),
+        (OpenItem.due_date >= as_of - timedelta(days=30), BUCKETS[1]),
+        (OpenItem.due_date >= as_of - timedelta(days=60), BUCKETS[2]),
+        (OpenItem.due_date >= as_of - timedelta(days=90), BUCKETS[3]),
+        else_=BUCKETS[4],
+    ).label("bucket")
+
+
+def _empty_report(customer_id: Optional[int], as_of: date) -> Dict[str, Any]:
+    return {
+        "customer_id": customer_id,
+        "as_of": as_of,
+        "buckets": {name: {"count": 0, "amount": ZERO} for name in BUCKETS},
+        "total": {"count": 0, "amount": ZERO},
+    }
+
+
+def _add(report: Dict[str, Any], bucket: str, count: int, amount) -> None:
+    amount = Decimal(amount or 0).quantize(ZERO)
+    report["buckets"][bucket] = {"count": count, "amount": amount}
+    report["total"]["count"] += count
+    report["total"]["amount"] += amount
+
+
+def customer_aging(db: Session, customer_id: int, as_of: Optional[date] = None) -> Dict[str, Any]:
+    """Aging buckets of one customer's unpaid open items."""
+    as_of = as_of or date.today()
+    key = ("customer", customer_id, as_of)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    bucket = _bucket(as_of)
+    stmt = (
+        select(bucket, func.count(), func.sum(OpenItem.amount))
+        .where(OpenItem.customer_id == customer_id, OpenItem.paid.is_(False))
+        .group_by(bucket)
+    )
+    report = _empty_report(customer_id, as_of)
+    for name, count, amount in db.execute(stmt):
+        _add(report, name, count, amount)
+    _cache.set(key, report)
+    return report
+
+
+def portfolio_aging(
+    db: Session, as_of: Optional[date] = None, by_customer: bool = False
+) -> Dict[str, Any]:
+    """Aging buckets across all customers.
+
+    With ``by_customer`` the report additionally lists one row per
+    customer with unpaid items, computed in the same ``GROUP BY``
+    statement.
+    """
+    as_of = as_of or date.today()
+    key = ("portfolio", by_customer, as_of)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    bucket = _bucket(as_of)
+    columns = [bucket, func.count(), func.sum(OpenItem.amount)]
+    if by_customer:
+        columns.insert(0, OpenItem.customer_id)
+    stmt = select(*columns).where(OpenItem.paid.is_(False)).group_by(*columns[: len(columns) - 2])
+    report = _empty_report(None, as_of)
+    customers: Dict[int, Dict[str, Any]] = {}
+    for row in db.execute(stmt):
+        if by_customer:
+            customer_id, name, count, amount = row
+            _add(customers.setdefault(customer_id, _empty_report(customer_id, as_of)), name, count, amount)
+        else:
+            name, count, amount = row
+        # portfolio totals are accumulated from the same rows
+        current = report["buckets"][name]
+        amount_dec = Decimal(amount or 0).quantize(ZERO)
+        report["buckets"][name] = {"count": current["count"] + count, "amount": current["amount"] + amount_dec}
+        report["total"]["count"] += count
+        report["total"]["amount"] += amount_dec
+    if by_customer:
+        report["customers"] = sorted(customers.values(), key=lambda r: r["customer_id"])
+    _cache.set(key, report)
+    return report
+
+
+__all__: List[str] = ["BUCKETS", "customer_aging", "portfolio_aging", "invalidate_aging"]
@@ -0,0 +1,521 @@
+"""Columnar analytics over all receipts.
+
+Multi-year trends and what-if simulations touch millions of receipts,
+far too many to walk as ORM objects with one ``Decimal`` per amount.
+This module loads the receipts once into compact NumPy columns and
+answers reports with vectorized group-bys::
+
+    id            int64   receipt id
+    customer_id   int32
+    day           int32   date as proleptic ordinal (date.toordinal())
+    month         int32   months since 1970-01 (derived from day)
+    incoming      int8    1 = Eingangsrechnung (Vorsteuer), 0 = Ausgangsrechnung
+    tax_rate      int16   percent, -1 if unknown
+    net, tax, gross int64 amounts in cents (NULL = 0)
+
+Amounts are converted to cents in the database (``ROUND(x * 100)``, the
+same expression :func:`app.ustva_engine.calculate_ustva_bulk` sums), so
+integer sums over the arrays are exact and :func:`ustva` returns exactly
+what :func:`~app.ustva_engine.calculate_ustva` returns.  Like there,
+receipts flagged as possible duplicates are left out.  ``Decimal``
+values are only created for the final, aggregated numbers.
+
+Snapshots
+---------
+The columns are streamed from the database in id order with
+``yield_per`` straight into ``.npy`` files below ``ANALYTICS_DIR``
+(default ``/tmp/analytics``), one directory per snapshot, and are then
+memory-mapped read-only; building needs no more memory than one fetch
+batch.  Worker processes share the page cache of the same files, and a
+restarted worker reuses the newest snapshot on disk.
+
+A snapshot carries a fingerprint of the receipts table (count, highest
+id and the sums of all cent columns, tax rates, incoming receipts,
+customer ids and dates, one aggregate query), so moving a receipt to
+another date or customer is noticed as well.  At most every ``ANALYTICS_CHECK_SECONDS``
+(default 60) the fingerprint is compared with the database and the
+snapshot is rebuilt if it differs; ``refresh=True`` rebuilds
+immediately.  Only one thread checks or rebuilds at a time; the others
+keep answering from the current snapshot meanwhile.  Reports may
+therefore lag behind writes by up to that interval plus one rebuild.
+
+NumPy is an optional dependency; without it :data:`np` is ``None`` and
+the API answers ``503``.
+
+CLI::
+
+    python -m app.analytics build
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import BigInteger, Integer, case, cast, extract, func, select
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .models import Receipt
+from .ustva_engine import INCOMING, OUTGOING, _euros, results_from_groups
+
+# NumPy is only needed for the analytics endpoints; import it lazily so
+# that the rest of the backend works without it (same pattern as boto3
+# in :mod:`app.storage`).
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None  # type: ignore
+
+SNAPSHOT_DIR = os.getenv("ANALYTICS_DIR", "/tmp/analytics")
+CHECK_SECONDS = float(os.getenv("ANALYTICS_CHECK_SECONDS", "60"))
+FETCH_SIZE = int(os.getenv("ANALYTICS_FETCH_SIZE", "50000"))
+KEEP_SNAPSHOTS = 2
+
+COLUMNS = {
+    "id": "int64",
+    "customer_id": "int32",
+    "day": "int32",
+    "month": "int32",
+    "incoming": "int8",
+    "tax_rate": "int16",
+    "net": "int64",
+    "tax": "int64",
+    "gross": "int64",
+}
+# date(1970, 1, 1).toordinal()
+EPOCH_ORDINAL = 719163
+NO_RATE = -1
+
+
+def _cents(column):
+    return func.coalesce(cast(func.round(column * 100), BigInteger), 0)
+
+
+def _month_index(year: int, month: int) -> int:
+    return (year - 1970) * 12 + month - 1
+
+
+def _date_key(column):
+    # YYYYMMDD as an integer; portable unlike date arithmetic
+    return (
+        cast(extract("year", column), Integer) * 10000
+        + cast(extract("month", column), Integer) * 100
+        + cast(extract("day", column), Integer)
+    )
+
+
+def _fingerprint(db: Session) -> List[int]:
+    row = db.execute(
+        select(
+            func.count(),
+            func.coalesce(func.max(Receipt.id), 0),
+            func.coalesce(func.sum(_cents(Receipt.net_amount)), 0),
+            func.coalesce(func.sum(_cents(Receipt.tax_amount)), 0),
+            func.coalesce(func.sum(_cents(Receipt.gross_amount)), 0),
+            func.coalesce(func.sum(func.coalesce(Receipt.tax_rate, 0)), 0),
+            func.coalesce(func.sum(case((Receipt.direction == INCOMING, 1), else_=0)), 0),
+            func.coalesce(func.sum(Receipt.customer_id), 0),
+            func.coalesce(func.sum(_date_key(Receipt.date)), 0),
+        ).where(Receipt.date.is_not(None), Receipt.duplicate_of_id.is_(None))
+    ).one()
+    return [int(value) for value in row]
+
+
+@dataclass
+class Snapshot:
+    """Memory-mapped receipt columns of one point in time."""
+
+    path: str
+    created_at: float
+    fingerprint: List[int]
+    columns: Dict[str, Any] = field(repr=False)
+    checked_at: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        return len(self.columns["id"])
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    def meta(self) -> Dict[str, Any]:
+        return {
+            "name": os.path.basename(self.path),
+            "rows": self.rows,
+            "created_at": self.created_at,
+            "bytes": sum(int(column.nbytes) for column in self.columns.values()),
+        }
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("NumPy ist nicht installiert; Analytics nicht verfügbar")
+
+
+def build_snapshot(db: Session, root: str = SNAPSHOT_DIR, fetch_size: int = FETCH_SIZE) -> Snapshot:
+    """Stream all dated receipts into a new snapshot directory."""
+    _require_numpy()
+    os.makedirs(root, exist_ok=True)
+    fingerprint = _fingerprint(db)
+    count, max_id = fingerprint[0], fingerprint[1]
+    build_dir = tempfile.mkdtemp(prefix=".build-", dir=root)
+    try:
+        arrays = {
+            name: np.lib.format.open_memmap(os.path.join(build_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=(count,))
+            for name, dtype in COLUMNS.items()
+        }
+        stmt = (
+            select(
+                Receipt.id,
+                Receipt.customer_id,
+                Receipt.date,
+                Receipt.direction,
+                Receipt.tax_rate,
+                _cents(Receipt.net_amount),
+                _cents(Receipt.tax_amount),
+                _cents(Receipt.gross_amount),
+            )
+            .where(Receipt.date.is_not(None), Receipt.duplicate_of_id.is_(None), Receipt.id <= max_id)
+            .order_by(Receipt.id)
+            .execution_options(yield_per=fetch_size)
+        )
+        pos = 0
+        for part in db.execute(stmt).partitions():
+            part = part[: count - pos]
+            if not part:
+                break
+            ids, customers, dates, directions, rates, net, tax, gross = zip(*part)
+            end = pos + len(part)
+            arrays["id"][pos:end] = ids
+            arrays["customer_id"][pos:end] = customers
+            arrays["day"][pos:end] = [d.toordinal() for d in dates]
+            arrays["incoming"][pos:end] = [d == INCOMING for d in directions]
+            arrays["tax_rate"][pos:end] = [NO_RATE if r is None else r for r in rates]
+            arrays["net"][pos:end] = net
+            arrays["tax"][pos:end] = tax
+            arrays["gross"][pos:end] = gross
+            pos = end
+        days = np.asarray(arrays["day"][:pos], dtype="int64") - EPOCH_ORDINAL
+        arrays["month"][:pos] = days.astype("datetime64[D]").astype("datetime64[M]").astype("int64")
+        for array in arrays.values():
+            array.flush()
+        del arrays
+        created_at = time.time()
+        with open(os.path.join(build_dir, "meta.json"), "w") as f:
+            json.dump({"rows": pos, "created_at": created_at, "fingerprint": fingerprint}, f)
+        name = f"snapshot-{int(created_at * 1000)}-{max_id}"
+        path = os.path.join(root, name)
+        os.replace(build_dir, path)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    logging.info("Analytics-Snapshot %s: %d Belege", name, pos)
+    _prune(root, keep=name)
+    return load_snapshot(path)
+
+
+def load_snapshot(path: str) -> Snapshot:
+    _require_numpy()
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    rows = meta["rows"]
+    columns = {}
+    for name, dtype in COLUMNS.items():
+        file = os.path.join(path, f"{name}.npy")
+        # an empty array cannot be memory-mapped
+        array = np.load(file, mmap_mode="r") if os.path.getsize(file) > 128 else np.load(file)
+        columns[name] = array[:rows]
+    return Snapshot(path, meta["created_at"], meta["fingerprint"], columns)
+
+
+def _snapshot_names(root: str) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    names = [n for n in os.listdir(root) if n.startswith("snapshot-")]
+    return sorted(names, key=lambda n: int(n.split("-")[1]))
+
+
+def _prune(root: str, keep: str) -> None:
+    # mapped files of removed snapshots stay readable until unmapped
+    for name in _snapshot_names(root)[:-KEEP_SNAPSHOTS]:
+        if name != keep:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+_current: Optional[Snapshot] = None
+_lock = threading.Lock()
+# held while checking the fingerprint or rebuilding, never by plain readers
+_build_lock = threading.Lock()
+
+
+def _fresh(snapshot: Optional[Snapshot]) -> bool:
+    return snapshot is not None and time.time() - snapshot.checked_at < CHECK_SECONDS
+
+
+def get_snapshot(db: Session, refresh: bool = False, root: str = SNAPSHOT_DIR) -> Snapshot:
+    """Return an up-to-date snapshot, reusing or rebuilding as needed.
+
+    While another thread checks or rebuilds, callers get the current
+    snapshot instead of waiting; only the first call of a process and
+    ``refresh`` wait for the build.
+    """
+    global _current
+    _require_numpy()
+    with _lock:
+        current = _current
+    if not refresh and _fresh(current):
+        return current
+    if not _build_lock.acquire(blocking=refresh or current is None):
+        return current
+    try:
+        with _lock:
+            candidate = _current
+        if not refresh and _fresh(candidate):
+            # rebuilt by another thread while we waited
+            return candidate
+        if candidate is None and not refresh:
+            names = _snapshot_names(root)
+            if names:
+                try:
+                    candidate = load_snapshot(os.path.join(root, names[-1]))
+                except (OSError, ValueError, KeyError) as exc:
+                    logging.warning("Analytics-Snapshot %s unlesbar: %s", names[-1], exc)
+        now = time.time()
+        if refresh or candidate is None or candidate.fingerprint != _fingerprint(db):
+            candidate = build_snapshot(db, root)
+        candidate.checked_at = now
+        with _lock:
+            _current = candidate
+        return candidate
+    finally:
+        _build_lock.release()
+
+
+# -- vectorized group-by ------------------------------------------------
+def _group_sums(keys: Sequence[Any], values: Sequence[Any]) -> Tuple[List[Any], Any, List[Any]]:
+    """Sum ``values`` per distinct combination of ``keys``.
+
+    Rows are sorted by the keys and every group is reduced with
+    ``np.add.reduceat`` on int64, so the sums stay exact.  Returns the
+    key columns of the groups, the row count and the sums per group.
+    """
+    n = len(keys[0])
+    if n == 0:
+        return [k[:0] for k in keys], np.zeros(0, dtype="int64"), [v[:0] for v in values]
+    order = np.lexsort(tuple(reversed(keys)))
+    sorted_keys = [np.asarray(k)[order] for k in keys]
+    boundary = np.zeros(n, dtype=bool)
+    boundary[0] = True
+    for k in sorted_keys:
+        boundary[1:] |= k[1:] != k[:-1]
+    starts = np.flatnonzero(boundary)
+    counts = np.diff(np.append(starts, n))
+    sums = [np.add.reduceat(np.asarray(v, dtype="int64")[order], starts) for v in values]
+    return [k[starts] for k in sorted_keys], counts, sums
+
+
+def _select(
+    snapshot: Snapshot,
+    start: Tuple[int, int],
+    end: Tuple[int, int],
+    customer_ids: Optional[Iterable[int]] = None,
+):
+    month = snapshot["month"]
+    mask = (month >= _month_index(*start)) & (month <= _month_index(*end))
+    if customer_ids is not None:
+        mask &= np.isin(snapshot["customer_id"], np.fromiter(customer_ids, dtype="int64"))
+    return mask
+
+
+def _ustva_groups(customer, month, incoming, rate, net, tax, gross):
+    (customer, month, incoming, rate), counts, (net, tax, gross) = _group_sums(
+        [customer, month, incoming, rate], [net, tax, gross]
+    )
+    for c, m, i, r, n, nc, tc, gc in zip(
+        customer.tolist(), month.tolist(), incoming.tolist(), rate.tolist(),
+        counts.tolist(), net.tolist(), tax.tolist(), gross.tolist(),
+    ):
+        yield (
+            c, 1970 + m // 12, m % 12 + 1,
+            INCOMING if i else OUTGOING, None if r == NO_RATE else r,
+            n, nc, tc, gc,
+        )
+
+
+def ustva(
+    snapshot: Snapshot,
+    start: Tuple[int, int],
+    end: Tuple[int, int],
+    customer_ids: Optional[Iterable[int]] = None,
+) -> Dict[Tuple[int, str], Dict[str, Any]]:
+    """Same result as :func:`app.ustva_engine.calculate_ustva_bulk`."""
+    mask = _select(snapshot, start, end, customer_ids)
+    columns = [snapshot[name][mask] for name in ("customer_id", "month", "incoming", "tax_rate", "net", "tax", "gross")]
+    return results_from_groups(_ustva_groups(*columns))
+
+
+def _change(current: int, previous: Optional[int]) -> Optional[Decimal]:
+    if not previous:
+        return None
+    return (Decimal(current - previous) * 100 / abs(Decimal(previous))).quantize(Decimal("0.1"), ROUND_HALF_UP)
+
+
+def trends(
+    snapshot: Snapshot,
+    year_from: int,
+    year_to: int,
+    customer_ids: Optional[Iterable[int]] = None,
+    by_customer: bool = False,
+) -> List[Dict[str, Any]]:
+    """Yearly revenue and VAT with the change against the previous year.
+
+    One row per year (per customer with ``by_customer``).  Revenue is
+    the net amount of outgoing receipts; ``veraenderung_*`` is the
+    change in percent against the previous year of the same series.
+    """
+    mask = _select(snapshot, (year_from, 1), (year_to, 12), customer_ids)
+    year = snapshot["month"][mask] // 12 + 1970
+    incoming = snapshot["incoming"][mask]
+    customer = snapshot["customer_id"][mask] if by_customer else np.zeros(len(year), dtype="int32")
+    (customer, year, incoming), counts, (net, tax) = _group_sums(
+        [customer, year, incoming], [snapshot["net"][mask], snapshot["tax"][mask]]
+    )
+    series: Dict[Tuple[int, int], Dict[str, int]] = {}
+    for c, y, i, n, nc, tc in zip(customer.tolist(), year.tolist(), incoming.tolist(), counts.tolist(), net.tolist(), tax.tolist()):
+        entry = series.setdefault((c, y), {"count": 0, "revenue": 0, "vat": 0, "input_vat": 0})
+        entry["count"] += n
+        if i:
+            entry["input_vat"] += tc
+        else:
+            entry["revenue"] += nc
+            entry["vat"] += tc
+    rows = []
+    for (c, y), entry in sorted(series.items()):
+        previous = series.get((c, y - 1))
+        row = {
+            "jahr": y,
+            "anzahl": entry["count"],
+            "umsatz_netto": _euros(entry["revenue"]),
+            "umsatzsteuer": _euros(entry["vat"]),
+            "vorsteuer": _euros(entry["input_vat"]),
+            "zahllast": _euros(entry["vat"] - entry["input_vat"]),
+            "veraenderung_umsatz": _change(entry["revenue"], previous and previous["revenue"]),
+            "veraenderung_zahllast": _change(
+                entry["vat"] - entry["input_vat"], previous and previous["vat"] - previous["input_vat"]
+            ),
+        }
+        if by_customer:
+            row = {"customer_id": c, **row}
+        rows.append(row)
+    return rows
+
+
+def _round_div(numerator, denominator: int):
+    # round half away from zero to whole cents, like Decimal ROUND_HALF_UP
+    return np.sign(numerator) * ((np.abs(numerator) * 2 + denominator) // (2 * denominator))
+
+
+def simulate_rate(
+    snapshot: Snapshot,
+    start: Tuple[int, int],
+    end: Tuple[int, int],
+    from_rate: int,
+    to_rate: int,
+    basis: str = "net",
+    customer_ids: Optional[Iterable[int]] = None,
+    receipt_ids: Optional[Iterable[int]] = None,
+    direction: Optional[str] = None,
+) -> Dict[str, Any]:
+    """What-if: recompute the UStVA with receipts taxed at ``to_rate``.
+
+    Affected are the receipts at ``from_rate`` in the period (optionally
+    only the given ``receipt_ids`` or one ``direction``).  With
+    ``basis="net"`` the net amount stays and the tax is recalculated;
+    with ``basis="gross"`` the price including VAT stays and is split
+    again into net and tax.  Returns actual and simulated figures per
+    customer and in total.
+    """
+    mask = _select(snapshot, start, end, customer_ids)
+    customer = snapshot["customer_id"][mask]
+    incoming = snapshot["incoming"][mask]
+    rate = np.array(snapshot["tax_rate"][mask])
+    net = np.array(snapshot["net"][mask])
+    tax = np.array(snapshot["tax"][mask])
+    affected = rate == from_rate
+    if receipt_ids is not None:
+        affected &= np.isin(snapshot["id"][mask], np.fromiter(receipt_ids, dtype="int64"))
+    if direction is not None:
+        affected &= incoming == (1 if direction == INCOMING else 0)
+    new_net, new_tax = net.copy(), tax.copy()
+    if basis == "gross":
+        gross = snapshot["gross"][mask][affected]
+        new_net[affected] = _round_div(gross * 100, 100 + to_rate)
+        new_tax[affected] = gross - new_net[affected]
+    else:
+        new_tax[affected] = _round_div(net[affected] * to_rate, 100)
+
+    (cust, inc), _, (actual, simulated) = _group_sums([customer, incoming], [tax, new_tax])
+    totals: Dict[int, Dict[str, int]] = {}
+    for c, i, a, s in zip(cust.tolist(), inc.tolist(), actual.tolist(), simulated.tolist()):
+        entry = totals.setdefault(c, {"ust": 0, "ust_sim": 0, "vst": 0, "vst_sim": 0})
+        if i:
+            entry["vst"] += a
+            entry["vst_sim"] += s
+        else:
+            entry["ust"] += a
+            entry["ust_sim"] += s
+
+    def figures(entry: Dict[str, int]) -> Dict[str, Decimal]:
+        actual_liability = entry["ust"] - entry["vst"]
+        simulated_liability = entry["ust_sim"] - entry["vst_sim"]
+        return {
+            "umsatzsteuer_ist": _euros(entry["ust"]),
+            "umsatzsteuer_simuliert": _euros(entry["ust_sim"]),
+            "vorsteuer_ist": _euros(entry["vst"]),
+            "vorsteuer_simuliert": _euros(entry["vst_sim"]),
+            "zahllast_ist": _euros(actual_liability),
+            "zahllast_simuliert": _euros(simulated_liability),
+            "differenz": _euros(simulated_liability - actual_liability),
+        }
+
+    total = {key: sum(entry[key] for entry in totals.values()) for key in ("ust", "ust_sim", "vst", "vst_sim")}
+    return {
+        "von_steuersatz": from_rate,
+        "auf_steuersatz": to_rate,
+        "basis": basis,
+        "betroffene_belege": int(affected.sum()),
+        "netto_betroffen": _euros(int(net[affected].sum())),
+        "kunden": [{"customer_id": c, **figures(entry)} for c, entry in sorted(totals.items())],
+        "summe": figures(total),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Columnar receipt analytics.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="build a fresh snapshot")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.command == "build":
+        session = SessionLocal()
+        try:
+            snapshot = get_snapshot(session, refresh=True)
+        finally:
+            session.close()
+        for name, value in snapshot.meta().items():
+            print(f"{name:<11} {value}")
+
+
+if __name__ == "__main__":
+    main()
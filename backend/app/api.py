@@ -6,15 +6,29 @@ und in der Datenbank gespeichert.  UStVA‑Berechnungen summieren die
 Netto‑ und Steuerbeträge der Belege eines Zeitraums.
 """
 
+import mimetypes
 import os
-from datetime import date
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse
+from datetime import date, datetime
+from decimal import Decimal
+from email.utils import parsedate_to_datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, UploadFile, File
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
 
-from .database import get_db
-from . import models, schemas, ocr
-from .ustva_engine import calculate_ustva
+from .database import SessionLocal, get_db
+from . import models, schemas, ocr, storage
+from . import analytics, banking, dedup, offboarding
+from .admission import admission_stats, limiters
+from .aging import customer_aging, invalidate_aging, portfolio_aging
+from .archive import PackArchive
+from .dashboard import load_dashboard
+from .events import broker
+from . import profiling
+from .search import search_receipts
+from .thumbnails import content_key, thumbnail_cache
+from .ustva_engine import INCOMING, OUTGOING, calculate_ustva, calculate_ustva_bulk, ustva_sums
 
 router = APIRouter()
 
@@ -36,38 +50,154 @@ def list_customers(db: Session = Depends(get_db)):
     return db.query(models.Customer).all()
 
 
-@router.post("/receipts/upload", response_model=schemas.ReceiptRead)
+@router.delete(
+    "/customers/{customer_id}",
+    response_model=schemas.OffboardingReport,
+    dependencies=[Depends(limiters["offboarding"])],
+)
+async def delete_customer(customer_id: int, batch_size: int = Query(offboarding.BATCH_SIZE, ge=1, le=10000)):
+    """Kunden mit allen Belegen, UStVA und offenen Posten löschen.
+
+    Gelöscht wird in kurzen Transaktionen zu je ``batch_size`` Zeilen
+    (siehe :mod:`app.offboarding`); ein abgebrochener Aufruf kann einfach
+    wiederholt werden.  Die gespeicherten Dateien werden anschließend im
+    Hintergrund entfernt, sofern kein anderer Beleg sie noch verwendet.
+    """
+    report = await run_in_threadpool(offboarding.offboard_customer, customer_id, batch_size)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    return report.as_dict()
+
+
+@router.post(
+    "/receipts/upload",
+    response_model=schemas.ReceiptRead,
+    dependencies=[Depends(limiters["ocr"])],
+)
 async def upload_receipt(
     customer_id: int,
     file: UploadFile = File(...),
+    direction: str = "outgoing",
+    on_duplicate: str | None = None,
+    force: bool = False,
     db: Session = Depends(get_db),
 ):
+    """Beleg hochladen; ``direction`` ist ``outgoing`` (Ausgangsrechnung)
+    oder ``incoming`` (Eingangsrechnung, Vorsteuer).
+
+    Mögliche Mehrfacherfassungen werden vor dem Speichern erkannt (siehe
+    :mod:`app.dedup`).  ``on_duplicate`` überschreibt ``DUPLICATE_POLICY``:
+    ``flag`` speichert und markiert den Beleg, ``hold`` lehnt ihn mit 409
+    ab, bis er mit ``force=true`` erneut gesendet wird.
+    """
+    if direction not in (INCOMING, OUTGOING):
+        raise HTTPException(status_code=400, detail="direction must be incoming or outgoing")
+    policy = on_duplicate or dedup.POLICY
+    if policy not in dedup.POLICIES:
+        raise HTTPException(status_code=400, detail="on_duplicate must be flag, hold or off")
     # Ensure that the customer exists
     customer = db.query(models.Customer).get(customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    # Create a temporary upload directory
-    uploads_dir = os.getenv("UPLOADS_DIR", "/tmp/uploads")
-    os.makedirs(uploads_dir, exist_ok=True)
-    file_path = os.path.join(uploads_dir, file.filename)
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    # OCR analyse
-    parsed = ocr.parse_receipt_pdf(file_path)
+    if customer.offboarding_started_at is not None:
+        raise HTTPException(status_code=409, detail="Customer is being deleted")
+    # Datei gestreamt in eine Staging-Datei schreiben und dabei hashen
+    staged = await storage.stage_upload(file)
+    try:
+        # OCR analyse (CPU‑lastig, daher nicht im Event‑Loop)
+        parsed = await run_in_threadpool(ocr.parse_receipt_pdf, staged.path)
+        fields = ocr.receipt_fields(parsed)
+        duplicates = []
+        if policy != "off":
+            fingerprint = dedup.Fingerprint(
+                None, staged.sha256, fields["date"], fields["gross_amount"],
+                fields["net_amount"], fields["tax_amount"], dedup.supplier_tokens(fields["supplier"]),
+            )
+            duplicates = await run_in_threadpool(dedup.find_duplicates, db, customer_id, fingerprint)
+            if duplicates and policy == "hold" and not force:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "Possible duplicate receipt", "candidates": jsonable_encoder(duplicates)},
+                )
+        # Datei im konfigurierten Storage ablegen (lokal oder S3)
+        file_uri = await run_in_threadpool(
+            storage.get_storage().put_file, staged.path, staged.key, file.content_type
+        )
+    finally:
+        staged.discard()
     # Save receipt in database
     receipt = models.Receipt(
         customer_id=customer_id,
-        file_path=file_path,
-        date=date.fromisoformat(parsed["date"]) if parsed["date"] else None,
-        net_amount=parsed["net_amount"],
-        tax_amount=parsed["tax_amount"],
-        gross_amount=parsed["gross_amount"],
-        supplier=parsed["supplier"],
+        file_path=file_uri,
+        content_hash=staged.sha256,
+        direction=direction,
+        **fields,
     )
+    if duplicates:
+        receipt.duplicate_of_id = duplicates[0]["id"]
+        receipt.duplicate_score = duplicates[0]["score"]
     db.add(receipt)
     db.commit()
     db.refresh(receipt)
+    broker.publish(
+        customer_id,
+        "receipt.stored",
+        {
+            "id": receipt.id,
+            "date": receipt.date,
+            "supplier": receipt.supplier,
+            "gross_amount": receipt.gross_amount,
+            "duplicate_of_id": receipt.duplicate_of_id,
+        },
+    )
+    return receipt
+
+
+@router.get("/receipts/duplicates", response_model=list[schemas.ReceiptRead])
+def list_duplicate_receipts(customer_id: int | None = None, db: Session = Depends(get_db)):
+    """Als mögliche Mehrfacherfassung markierte Belege."""
+    query = db.query(models.Receipt).filter(models.Receipt.duplicate_of_id.is_not(None))
+    if customer_id:
+        query = query.filter(models.Receipt.customer_id == customer_id)
+    return query.order_by(models.Receipt.id).all()
+
+
+@router.post(
+    "/receipts/duplicates/scan/{customer_id}",
+    response_model=schemas.DuplicateScanReport,
+    dependencies=[Depends(limiters["aggregation"])],
+)
+def scan_duplicate_receipts(customer_id: int, apply: bool = False, db: Session = Depends(get_db)):
+    """Vorhandene Belege eines Kunden auf Mehrfacherfassungen prüfen.
+
+    Ohne ``apply=true`` wird nur berichtet; mit ``apply`` werden die
+    gefundenen Duplikate markiert.
+    """
+    if db.get(models.Customer, customer_id) is None:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    return dedup.scan_customer(db, customer_id, apply=apply)
+
+
+@router.post("/receipts/{receipt_id}/duplicate/resolve", response_model=schemas.ReceiptRead)
+def resolve_duplicate_receipt(receipt_id: int, db: Session = Depends(get_db)):
+    """Markierung als mögliche Mehrfacherfassung aufheben.
+
+    Markierte Belege zählen weder in der UStVA noch in Auswertungen und
+    Dashboard.  Ist der Beleg doch kein Duplikat, wird er hiermit wieder
+    mitgezählt; ein bestätigtes Duplikat bleibt einfach markiert.  Die
+    Entscheidung wird gespeichert, spätere Scans markieren den Beleg
+    nicht erneut.
+    """
+    receipt = db.get(models.Receipt, receipt_id)
+    if receipt is None:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    if receipt.duplicate_of_id is not None or receipt.duplicate_resolved_at is None:
+        receipt.duplicate_of_id = None
+        receipt.duplicate_score = None
+        receipt.duplicate_resolved_at = datetime.utcnow()
+        db.commit()
+        db.refresh(receipt)
+        broker.publish(receipt.customer_id, "receipt.duplicate_resolved", {"id": receipt.id})
     return receipt
 
 
@@ -79,9 +209,181 @@ def list_receipts(customer_id: int | None = None, db: Session = Depends(get_db))
     return query.all()
 
 
-@router.post("/ustva/generate/{customer_id}/{period}", response_model=schemas.UstvaRead)
+@router.get(
+    "/receipts/search",
+    response_model=list[schemas.ReceiptSearchHit],
+    dependencies=[Depends(limiters["aggregation"])],
+)
+def search_receipts_endpoint(
+    q: str,
+    customer_id: int | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    min_amount: Decimal | None = None,
+    max_amount: Decimal | None = None,
+    limit: int = 20,
+    offset: int = 0,
+    db: Session = Depends(get_db),
+):
+    """Volltextsuche über Lieferant und OCR‑Text der Belege.
+
+    Jedes Wort wird als Präfix gesucht; Lieferantennamen werden zusätzlich
+    unscharf verglichen.  Die Treffer sind nach Relevanz sortiert und
+    lassen sich nach Kunde, Belegdatum und Bruttobetrag filtern.
+    """
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    try:
+        hits = search_receipts(
+            db, q, customer_id, date_from, date_to, min_amount, max_amount, limit, max(offset, 0)
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    for receipt, rank in hits:
+        receipt.rank = rank
+    return [receipt for receipt, _ in hits]
+
+
+def _get_receipt_or_404(db: Session, receipt_id: int) -> models.Receipt:
+    receipt = db.get(models.Receipt, receipt_id)
+    if not receipt:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return receipt
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Prüfe ``If-None-Match`` bzw. ``If-Modified-Since`` (RFC 9110)."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _serve_file(request: Request, path: str, etag: str, media_type: str | None = None, filename: str | None = None) -> Response:
+    """Liefere eine lokale Datei mit ETag, Conditional‑ und Range‑Support aus.
+
+    ``FileResponse`` übernimmt Range‑Requests (206/416) und nutzt
+    ``sendfile`` bzw. die ASGI‑``pathsend``‑Erweiterung, wenn der
+    Server sie anbietet.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=filename,
+        headers=headers,
+        stat_result=stat,
+        content_disposition_type="inline",
+    )
+
+
+def _serve_archived(request: Request, archive: PackArchive, key: str, etag: str) -> Response:
+    """Liefere einen Archiveintrag aus (ohne Range‑Support)."""
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    try:
+        if _not_modified(request, etag, archive.mtime(key)):
+            return Response(status_code=304, headers=headers)
+        content = archive.read(key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    filename = os.path.basename(key)
+    headers["Content-Disposition"] = f'inline; filename="{filename}"'
+    return Response(content, media_type=mimetypes.guess_type(filename)[0], headers=headers)
+
+
+@router.get(
+    "/receipts/{receipt_id}/download",
+    response_class=FileResponse,
+    dependencies=[Depends(limiters["export"])],
+)
+def download_receipt(receipt_id: int, request: Request, db: Session = Depends(get_db)):
+    """Originaldatei eines Belegs herunterladen.
+
+    Bei lokalem Storage wird die Datei direkt (zero‑copy) mit
+    Range‑ und Conditional‑Support ausgeliefert; bei S3 leitet der
+    Endpunkt auf eine kurzlebige presigned URL weiter.  Archivierte
+    Belege werden aus ihrem Pack gelesen (siehe :mod:`app.archive`).
+    """
+    receipt = _get_receipt_or_404(db, receipt_id)
+    backend, key = storage.resolve(receipt.file_path)
+    if isinstance(backend, storage.S3Storage):
+        return RedirectResponse(backend.presigned_url(key), status_code=307)
+    etag = f'"{content_key(receipt.content_hash, receipt.file_path)}"'
+    if isinstance(backend, PackArchive):
+        return _serve_archived(request, backend, key, etag)
+    path = key if backend is None else backend.path(key)
+    return _serve_file(request, path, etag, filename=os.path.basename(path))
+
+
+@router.get(
+    "/receipts/{receipt_id}/preview",
+    response_class=FileResponse,
+    dependencies=[Depends(limiters["export"])],
+)
+def preview_receipt(
+    receipt_id: int,
+    request: Request,
+    width: int = 320,
+    db: Session = Depends(get_db),
+):
+    """Vorschaubild (PNG) der ersten Seite eines Belegs.
+
+    Das Bild wird beim ersten Abruf gerendert und anschließend aus dem
+    Thumbnail‑Cache ausgeliefert (siehe :mod:`app.thumbnails`).
+    """
+    if not 32 <= width <= 1024:
+        raise HTTPException(status_code=400, detail="width must be between 32 and 1024")
+    receipt = _get_receipt_or_404(db, receipt_id)
+    key = content_key(receipt.content_hash, receipt.file_path)
+    etag = f'"{key}-{width}"'
+    cached = thumbnail_cache.path(key, width)
+    if os.path.exists(cached) and _not_modified(request, etag, os.stat(cached).st_mtime):
+        return Response(status_code=304, headers={"ETag": etag})
+    try:
+        path = thumbnail_cache.get_or_render(key, receipt.file_path, width)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    except Exception as exc:
+        raise HTTPException(status_code=422, detail=f"Preview could not be rendered: {exc}") from exc
+    return _serve_file(request, path, etag, media_type="image/png")
+
+
+def _parse_period(value: str) -> tuple[int, int]:
+    try:
+        year, month = map(int, value.split("-"))
+        date(year, month, 1)
+    except Exception:
+        raise HTTPException(status_code=400, detail=f"Invalid period format: {value}")
+    return year, month
+
+
+@router.post(
+    "/ustva/generate/{customer_id}/{period}",
+    response_model=schemas.UstvaRead,
+    dependencies=[Depends(limiters["aggregation"])],
+)
 def generate_ustva(customer_id: int, period: str, db: Session = Depends(get_db)):
-    """Berechne Summen für die UStVA eines Monats (YYYY-MM)."""
+    """Berechne Summen für die UStVA eines Monats (YYYY-MM).
+
+    ``net_sum``/``tax_sum``/``gross_sum`` summieren alle Belege des Monats;
+    ``umsatzsteuer``, ``vorsteuer`` und ``zahllast`` (Kz 83) sind
+    identisch mit ``/ustva/calc``.
+    """
+    year, month = _parse_period(period)
+    period = f"{year:04d}-{month:02d}"
     # Prüfen, ob UStVA für Zeitraum bereits existiert
     existing = (
         db.query(models.Ustva)
@@ -90,42 +392,127 @@ def generate_ustva(customer_id: int, period: str, db: Session = Depends(get_db))
     )
     if existing:
         return existing
-    # Zeitraum bestimmen
-    try:
-        year, month = map(int, period.split("-"))
-        start_date = date(year, month, 1)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid period format")
-    # Ende des Monats berechnen
-    if month == 12:
-        end_date = date(year + 1, 1, 1) - date.resolution
-    else:
-        end_date = date(year, month + 1, 1) - date.resolution
-    receipts = (
-        db.query(models.Receipt)
-        .filter(
-            models.Receipt.customer_id == customer_id,
-            models.Receipt.date >= start_date,
-            models.Receipt.date <= end_date,
-        )
-        .all()
-    )
-    net_sum = sum((r.net_amount or 0) for r in receipts)
-    tax_sum = sum((r.tax_amount or 0) for r in receipts)
-    gross_sum = sum((r.gross_amount or 0) for r in receipts)
-    ustva_entry = models.Ustva(
-        customer_id=customer_id,
-        period=period,
-        net_sum=net_sum,
-        tax_sum=tax_sum,
-        gross_sum=gross_sum,
-    )
+    sums = ustva_sums(calculate_ustva(customer_id, year, month, db=db))
+    ustva_entry = models.Ustva(customer_id=customer_id, period=period, **sums)
     db.add(ustva_entry)
     db.commit()
     db.refresh(ustva_entry)
+    broker.publish(
+        customer_id,
+        "ustva.generated",
+        {"id": ustva_entry.id, "period": period, "tax_sum": ustva_entry.tax_sum, "zahllast": ustva_entry.zahllast},
+    )
     return ustva_entry
 
 
+@router.get(
+    "/ustva/kennzahlen",
+    summary="UStVA‑Kennzahlen für mehrere Kunden und Zeiträume",
+    dependencies=[Depends(limiters["aggregation"])],
+)
+def ustva_kennzahlen(
+    period_from: str,
+    period_to: str | None = None,
+    customer_id: list[int] | None = Query(None),
+    db: Session = Depends(get_db),
+):
+    """ELSTER‑Kennzahlen (81, 86, 35/36, 66, 83) je Kunde und Monat.
+
+    Alle Kunden (oder die per ``customer_id`` gewählten) und alle Monate
+    von ``period_from`` bis ``period_to`` (YYYY-MM) werden mit einer
+    einzigen gruppierten Abfrage berechnet.  Kunden ohne Belege in einem
+    Monat fehlen in der Antwort.
+    """
+    start = _parse_period(period_from)
+    end = _parse_period(period_to) if period_to else start
+    if end < start:
+        raise HTTPException(status_code=400, detail="period_to must not be before period_from")
+    results = calculate_ustva_bulk(db, start, end, customer_id)
+    return JSONResponse(content=jsonable_encoder([results[key] for key in sorted(results)]))
+
+
+def _analytics_snapshot(db: Session, refresh: bool = False) -> "analytics.Snapshot":
+    if analytics.np is None:
+        raise HTTPException(status_code=503, detail="Analytics not available (numpy is not installed)")
+    return analytics.get_snapshot(db, refresh=refresh)
+
+
+@router.get("/analytics/snapshot", dependencies=[Depends(limiters["aggregation"])])
+def analytics_snapshot(refresh: bool = False, db: Session = Depends(get_db)):
+    """Stand des spaltenorientierten Analyse‑Snapshots; ``refresh=true`` baut ihn neu auf."""
+    return _analytics_snapshot(db, refresh).meta()
+
+
+@router.get("/analytics/ustva", dependencies=[Depends(limiters["aggregation"])])
+def analytics_ustva(
+    period_from: str,
+    period_to: str | None = None,
+    customer_id: list[int] | None = Query(None),
+    db: Session = Depends(get_db),
+):
+    """UStVA‑Kennzahlen je Kunde und Monat aus dem Analyse‑Snapshot.
+
+    Liefert dieselben Zahlen wie ``/ustva/kennzahlen``, rechnet aber auf
+    den Spalten im Speicher statt in der Datenbank (siehe
+    :mod:`app.analytics`); geeignet für viele Kunden über mehrere Jahre.
+    """
+    start = _parse_period(period_from)
+    end = _parse_period(period_to) if period_to else start
+    if end < start:
+        raise HTTPException(status_code=400, detail="period_to must not be before period_from")
+    results = analytics.ustva(_analytics_snapshot(db), start, end, customer_id)
+    return JSONResponse(content=jsonable_encoder([results[key] for key in sorted(results)]))
+
+
+@router.get("/analytics/trends", dependencies=[Depends(limiters["aggregation"])])
+def analytics_trends(
+    year_from: int,
+    year_to: int | None = None,
+    customer_id: list[int] | None = Query(None),
+    by_customer: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Umsatz, Umsatzsteuer, Vorsteuer und Zahllast je Jahr mit Veränderung zum Vorjahr.
+
+    Ohne ``by_customer`` über alle (bzw. die gewählten) Kunden summiert.
+    Für die Veränderung im ersten Jahr wird das Vorjahr mitgeladen.
+    """
+    year_to = year_to or year_from
+    if year_to < year_from:
+        raise HTTPException(status_code=400, detail="year_to must not be before year_from")
+    rows = analytics.trends(_analytics_snapshot(db), year_from - 1, year_to, customer_id, by_customer)
+    return JSONResponse(content=jsonable_encoder([row for row in rows if row["jahr"] >= year_from]))
+
+
+@router.post("/analytics/simulate", dependencies=[Depends(limiters["aggregation"])])
+def analytics_simulate(simulation: schemas.RateSimulation, db: Session = Depends(get_db)):
+    """Was‑wäre‑wenn: Belege mit ``from_rate`` zu ``to_rate`` versteuern.
+
+    Vergleicht Umsatzsteuer, Vorsteuer und Zahllast je Kunde mit und ohne
+    Umstellung, z. B. 19 % → 7 % für ausgewählte Belege.
+    """
+    if simulation.basis not in ("net", "gross"):
+        raise HTTPException(status_code=400, detail="basis must be net or gross")
+    if simulation.direction not in (None, INCOMING, OUTGOING):
+        raise HTTPException(status_code=400, detail="direction must be incoming or outgoing")
+    start = _parse_period(simulation.period_from)
+    end = _parse_period(simulation.period_to) if simulation.period_to else start
+    if end < start:
+        raise HTTPException(status_code=400, detail="period_to must not be before period_from")
+    result = analytics.simulate_rate(
+        _analytics_snapshot(db),
+        start,
+        end,
+        simulation.from_rate,
+        simulation.to_rate,
+        basis=simulation.basis,
+        customer_ids=simulation.customer_ids,
+        receipt_ids=simulation.receipt_ids,
+        direction=simulation.direction,
+    )
+    return JSONResponse(content=jsonable_encoder(result))
+
+
 @router.get("/ustva/{customer_id}", response_model=list[schemas.UstvaRead])
 def list_ustva(customer_id: int, db: Session = Depends(get_db)):
     return db.query(models.Ustva).filter(models.Ustva.customer_id == customer_id).all()
@@ -146,6 +533,7 @@ def list_ustva(customer_id: int, db: Session = Depends(get_db)):
     "/ustva/calc/{customer_id}/{year}/{month}",
     response_model=dict,
     summary="Berechne UStVA für einen Kunden und Zeitraum",
+    dependencies=[Depends(limiters["aggregation"])],
 )
 def calc_ustva(
     customer_id: int,
@@ -176,7 +564,8 @@ def calc_ustva(
     except Exception as exc:
         # Bei Fehlern eine aussagekräftige Antwort generieren
         raise HTTPException(status_code=400, detail=str(exc)) from exc
-    return JSONResponse(content=result)
+    return JSONResponse(content=jsonable_encoder(result))
+
 
 
 @router.post("/open-items", response_model=schemas.OpenItemRead)
@@ -185,6 +574,12 @@ def create_open_item(item: schemas.OpenItemCreate, db: Session = Depends(get_db)
     db.add(new_item)
     db.commit()
     db.refresh(new_item)
+    invalidate_aging(new_item.customer_id)
+    broker.publish(
+        new_item.customer_id,
+        "open_item.created",
+        {"id": new_item.id, "amount": new_item.amount, "due_date": new_item.due_date, "paid": new_item.paid},
+    )
     return new_item
 
 
@@ -193,4 +588,228 @@ def list_open_items(customer_id: int | None = None, db: Session = Depends(get_db
     query = db.query(models.OpenItem)
     if customer_id:
         query = query.filter(models.OpenItem.customer_id == customer_id)
-    return query.all()
\ No newline at end of file
+    return query.all()
+
+
+
+@router.get(
+    "/open-items/aging",
+    response_model=schemas.PortfolioAgingReport,
+    dependencies=[Depends(limiters["aggregation"])],
+)
+def open_items_aging(
+    as_of: date | None = None,
+    by_customer: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Altersstruktur der offenen Posten über alle Kunden.
+
+    Mit ``by_customer=true`` enthält die Antwort zusätzlich eine Zeile
+    je Kunde mit unbezahlten Posten.
+    """
+    return portfolio_aging(db, as_of, by_customer)
+
+
+@router.get(
+    "/open-items/aging/{customer_id}",
+    response_model=schemas.AgingReport,
+    dependencies=[Depends(limiters["aggregation"])],
+)
+def open_items_aging_for_customer(
+    customer_id: int,
+    as_of: date | None = None,
+    db: Session = Depends(get_db),
+):
+    """Altersstruktur der unbezahlten offenen Posten eines Kunden."""
+    return customer_aging(db, customer_id, as_of)
+
+
+def _import_bank_statement(path: str, fmt: str, customer_id: int, dry_run: bool) -> dict:
+    db = SessionLocal()
+    try:
+        report = banking.reconcile(
+            db, banking.read_statement(path, fmt), customer_id=customer_id, apply=not dry_run
+        )
+    finally:
+        db.close()
+    if not dry_run:
+        paid: dict[int, list[int]] = {}
+        for match in report.matched:
+            paid.setdefault(match.customer_id, []).append(match.open_item_id)
+        for cust_id, item_ids in paid.items():
+            invalidate_aging(cust_id)
+            broker.publish(cust_id, "open_item.paid", {"count": len(item_ids), "ids": item_ids[:100]})
+    return report.as_dict()
+
+
+@router.post(
+    "/bank/import",
+    response_model=schemas.BankImportReport,
+    dependencies=[Depends(limiters["aggregation"])],
+)
+async def import_bank_statement(
+    customer_id: int,
+    file: UploadFile = File(...),
+    format: str | None = None,
+    dry_run: bool = False,
+):
+    """Kontoauszug (CAMT.053, MT940 oder CSV) eines Kunden importieren und abgleichen.
+
+    Die Gutschriften werden gestreamt gelesen und über Hash‑Indizes
+    (Betrag in Cent, Referenz‑Token) den unbezahlten offenen Posten des
+    Kunden ``customer_id`` zugeordnet; Treffer werden gesammelt als
+    bezahlt markiert.  Stimmt nur der Betrag überein, wird der Posten
+    unter ``review`` vorgeschlagen, aber nicht bezahlt gesetzt.  Mit
+    ``dry_run=true`` wird nur der Abgleichsbericht erstellt.
+    """
+    if format is not None and format not in ("camt053", "mt940", "csv"):
+        raise HTTPException(status_code=400, detail="format must be camt053, mt940 or csv")
+    staged = await storage.stage_upload(file)
+    try:
+        with open(staged.path, "rb") as f:
+            head = f.read(4096)
+        fmt = format or banking.detect_format(file.filename or "", head)
+        result = await run_in_threadpool(_import_bank_statement, staged.path, fmt, customer_id, dry_run)
+    except (ValueError, SyntaxError) as exc:
+        # SyntaxError covers xml.etree.ElementTree.ParseError
+        raise HTTPException(status_code=400, detail=f"Kontoauszug nicht lesbar: {exc}") from exc
+    finally:
+        staged.discard()
+    return {"format": fmt, "dry_run": dry_run, **result}
+
+@router.get(
+    "/dashboard/{customer_id}",
+    response_model=schemas.DashboardRead,
+    dependencies=[Depends(limiters["aggregation"])],
+)
+async def get_dashboard(
+    customer_id: int,
+    period: str | None = None,
+    receipts_limit: int = 10,
+    periods: int = 6,
+):
+    """Alle Dashboard‑Daten eines Kunden in einer Antwort.
+
+    Liefert die neuesten Belege, die Summen des aktuellen und des
+    Vormonats (getrennt nach Ausgangs- und Eingangsrechnungen), den UStVA‑Status der letzten ``periods`` Monate und die
+    offenen Posten nach Status.  Alle Teilabfragen laufen über eine
+    Datenbankverbindung; die Antwortgröße ist durch ``receipts_limit`` und ``periods`` begrenzt.
+    """
+    if not 1 <= receipts_limit <= 50:
+        raise HTTPException(status_code=400, detail="receipts_limit must be between 1 and 50")
+    if not 1 <= periods <= 24:
+        raise HTTPException(status_code=400, detail="periods must be between 1 and 24")
+    today = date.today()
+    year, month = today.year, today.month
+    if period:
+        try:
+            year, month = map(int, period.split("-"))
+            date(year, month, 1)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid period format")
+    dashboard = await load_dashboard(customer_id, year, month, receipts_limit, periods, today)
+    if dashboard is None:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    return dashboard
+
+
+
+@router.get("/events/{customer_id}", response_class=StreamingResponse)
+async def stream_events(
+    customer_id: int,
+    request: Request,
+    last_event_id: int | None = None,
+):
+    """Server‑Sent‑Events‑Stream mit Live‑Updates eines Kunden.
+
+    Ereignisse: ``receipt.stored``, ``ustva.generated``,
+    ``open_item.created``.  Nach einem Verbindungsabbruch sendet der
+    Browser ``Last-Event-ID``; verpasste Ereignisse werden nachgeliefert.
+    Da ``EventSource`` beim ersten Verbindungsaufbau keine Header setzen
+    kann, wird die ID alternativ als Query‑Parameter akzeptiert.
+    """
+    header = request.headers.get("last-event-id")
+    if header:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    return StreamingResponse(
+        broker.stream(customer_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/admission/stats")
+def get_admission_stats():
+    """Auslastung der Admission‑Klassen (``ocr``, ``aggregation``, ``export``).
+
+    Je Klasse: laufende Anfragen, Warteschlangentiefe, Zähler für
+    zugelassene und abgewiesene Anfragen sowie die geglättete
+    Bearbeitungszeit, aus der ``Retry-After`` abgeleitet wird.
+    """
+    return admission_stats()
+
+
+# ------------------------------------------------------------
+#  Profiling (nur mit PROFILING_TOKEN, siehe app/profiling.py)
+
+def _require_profiling_token(x_profile_token: str | None = Header(None)) -> None:
+    if not profiling.ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiling.check_token(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+@router.get(
+    "/profiling/config",
+    response_model=schemas.ProfilingConfig,
+    dependencies=[Depends(_require_profiling_token)],
+)
+def get_profiling_config():
+    return profiling.profiler.config
+
+
+@router.put(
+    "/profiling/config",
+    response_model=schemas.ProfilingConfig,
+    dependencies=[Depends(_require_profiling_token)],
+)
+def set_profiling_config(config: schemas.ProfilingConfig):
+    """Stichprobenrate für Requests (optional je Pfadpräfix) und Jobs setzen.
+
+    Einzelne Requests lassen sich unabhängig davon mit dem Header
+    ``X-Profile: <PROFILING_TOKEN>`` profilieren.
+    """
+    profiling.profiler.config = profiling.ProfilingConfig(**config.dict())
+    return profiling.profiler.config
+
+
+@router.get("/profiling/profiles", dependencies=[Depends(_require_profiling_token)])
+def list_profiles():
+    """Zusammenfassung der gespeicherten Profile, neuestes zuerst."""
+    return [profile.summary() for profile in reversed(profiling.profiler.finished)]
+
+
+def _get_profile_or_404(profile_id: int) -> profiling.Profile:
+    profile = profiling.profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+
+@router.get("/profiling/profiles/{profile_id}", dependencies=[Depends(_require_profiling_token)])
+def get_profile(profile_id: int):
+    """Heißeste Frames und alle SQL‑Anweisungen mit Laufzeit."""
+    return _get_profile_or_404(profile_id).details()
+
+
+@router.get("/profiling/profiles/{profile_id}/speedscope", dependencies=[Depends(_require_profiling_token)])
+def download_profile(profile_id: int):
+    """Profil im speedscope‑Format (https://www.speedscope.app)."""
+    profile = _get_profile_or_404(profile_id)
+    return JSONResponse(
+        content=profile.to_speedscope(),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.speedscope.json"'},
+    )
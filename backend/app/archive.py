@@ -0,0 +1,586 @@
+"""Cold archive for receipt files of closed periods.
+
+Receipts have to be kept for ten years (GoBD), but files older than the
+current tax year are hardly ever read again.  The archival job packs
+them into a few large files instead of keeping one file or object per
+receipt::
+
+    python -m app.archive pack --before 2025-01-01
+    python -m app.archive verify
+
+Packs are stored in the configured blob storage (``STORAGE_BACKEND``),
+the same backend that holds the original files::
+
+    archive/pack-<timestamp>-<random>.pack   entries, append-only
+    archive/pack-<timestamp>-<random>.idx    sorted offset index of the pack
+
+``ARCHIVE_DIR`` (default ``/tmp/archive``) is only a local working
+directory: packs are built in ``staging/`` and indexes are cached there
+after the first download.  It may be lost at any time.
+
+A pack starts with a magic header followed by entries.  Every entry has
+a fixed header (flags, key length, stored and raw length, CRC-32 of the
+stored bytes), the key (``<sha256>.<ext>``) and the zlib-compressed
+content; files that do not shrink are stored uncompressed.  A pack is
+built locally, uploaded once complete (pack first, index last, so a
+listed index always has its pack) and never modified afterwards; every
+run of the job appends new packs.
+
+The index holds one fixed-size record per entry, sorted by the SHA-256
+digest.  It is memory-mapped and searched binary, so reading a single
+receipt costs one index lookup and one ranged read of the entry
+(``Range`` GET on S3), independent of the pack size.
+
+Archived receipts get a ``Receipt.file_path`` of the form
+``archive://<pack>/<sha256>.<ext>``.  :func:`app.storage.resolve`
+routes such URIs to :class:`PackArchive`, so downloads, previews and
+the OCR backfill read archived files transparently.
+
+``verify`` re-reads every entry from the storage, checks CRC-32 and
+the SHA-256 of the decompressed content against the key and compares
+the pack with its index.  The job runs the same check on every new pack
+before pointing receipts at it.  Originals in the same backend as the
+pack are handed to the ``file_cleanup`` queue of
+:mod:`app.offboarding`, which deletes them once no receipt refers to
+them (drained by the API's background worker or
+``python -m app.offboarding drain``); others are kept.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import hashlib
+import io
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, insert, select, update
+
+from .database import SessionLocal
+from .models import FileCleanup, Receipt
+from .storage import BlobStorage, get_storage, open_blob, resolve
+
+PACK_MAGIC = b"RPACK001"
+INDEX_MAGIC = b"RIDX0001"
+ENTRY_MAGIC = b"RENT"
+# magic, flags, key length, stored length, raw length, crc32 of the stored bytes
+ENTRY_HEADER = struct.Struct("<4sBHQQI")
+# sha256 digest, data offset, stored length, raw length, crc32, flags
+INDEX_RECORD = struct.Struct("<32sQQQIB3x")
+INDEX_HEADER = struct.Struct("<8sQ")
+FLAG_ZLIB = 1
+PACK_SIZE = int(os.getenv("ARCHIVE_PACK_SIZE", str(1024 * 1024 * 1024)))
+OPEN_INDEXES = 64
+
+
+@dataclass(frozen=True)
+class IndexRecord:
+    digest: bytes
+    offset: int
+    stored_length: int
+    raw_length: int
+    crc32: int
+    flags: int
+
+
+class PackIndex:
+    """Memory-mapped, digest-sorted index of one pack."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._file.close()
+            raise ValueError(f"Leerer Index: {path}")
+        magic, self.count = INDEX_HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC or len(self._map) != INDEX_HEADER.size + self.count * INDEX_RECORD.size:
+            self.close()
+            raise ValueError(f"Ungültiger Index: {path}")
+
+    def _digest_at(self, i: int) -> bytes:
+        start = INDEX_HEADER.size + i * INDEX_RECORD.size
+        return self._map[start : start + 32]
+
+    def record(self, i: int) -> IndexRecord:
+        return IndexRecord(*INDEX_RECORD.unpack_from(self._map, INDEX_HEADER.size + i * INDEX_RECORD.size))
+
+    def lookup(self, digest: bytes) -> Optional[IndexRecord]:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._digest_at(mid) < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._digest_at(lo) == digest:
+            return self.record(lo)
+        return None
+
+    def __iter__(self) -> Iterator[IndexRecord]:
+        for i in range(self.count):
+            yield self.record(i)
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+
+class PackWriter:
+    """Write one pack and its index; nothing is visible before :meth:`seal`."""
+
+    def __init__(self, root: str) -> None:
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.name = f"pack-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        fd, self._tmp = tempfile.mkstemp(dir=root, prefix=f"{self.name}.", suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+        self._file.write(PACK_MAGIC)
+        self.size = len(PACK_MAGIC)
+        self.records: Dict[bytes, IndexRecord] = {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def add(self, key: str, data: bytes) -> str:
+        """Append ``data`` under ``key`` (``<sha256>.<ext>``) and return the key."""
+        digest = bytes.fromhex(key.split(".", 1)[0])
+        if digest in self.records:
+            return key
+        stored, flags = zlib.compress(data, 6), FLAG_ZLIB
+        if len(stored) >= len(data):
+            stored, flags = data, 0
+        crc = zlib.crc32(stored)
+        encoded_key = key.encode("ascii")
+        self._file.write(ENTRY_HEADER.pack(ENTRY_MAGIC, flags, len(encoded_key), len(stored), len(data), crc))
+        self._file.write(encoded_key)
+        offset = self.size + ENTRY_HEADER.size + len(encoded_key)
+        self._file.write(stored)
+        self.size = offset + len(stored)
+        self.records[digest] = IndexRecord(digest, offset, len(stored), len(data), crc, flags)
+        return key
+
+    def seal(self) -> str:
+        """Flush, write the index and publish both files atomically."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        index_tmp = f"{self._tmp}.idx"
+        with open(index_tmp, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(self.records)))
+            for digest in sorted(self.records):
+                r = self.records[digest]
+                f.write(INDEX_RECORD.pack(r.digest, r.offset, r.stored_length, r.raw_length, r.crc32, r.flags))
+            f.flush()
+            os.fsync(f.fileno())
+        # the pack becomes visible first; a pack without index is ignored by readers
+        os.replace(self._tmp, os.path.join(self.root, f"{self.name}.pack"))
+        os.replace(index_tmp, os.path.join(self.root, f"{self.name}.idx"))
+        with contextlib.suppress(AttributeError, OSError):
+            dir_fd = os.open(self.root, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        return self.name
+
+    def abort(self) -> None:
+        self._file.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._tmp)
+
+
+class PackArchive(BlobStorage):
+    """Packs stored in a :class:`BlobStorage`; keys are ``<pack>/<sha256>.<ext>``.
+
+    The packs live next to the original receipts in the configured
+    storage backend (below ``archive/``), so they are exactly as durable
+    as the files they replace.  Indexes are downloaded once into
+    ``cache_dir`` and memory-mapped; entries are fetched with ranged
+    reads.
+    """
+
+    scheme = "archive"
+    prefix = "archive/"
+
+    def __init__(self, storage: BlobStorage, cache_dir: str) -> None:
+        self.storage = storage
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.staging_dir = os.path.join(self.cache_dir, "staging")
+        self._indexes: "OrderedDict[str, PackIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def uri(self, key: str) -> str:
+        return f"archive://{key}"
+
+    @staticmethod
+    def _check_name(pack: str) -> None:
+        if not pack.startswith("pack-") or "/" in pack or ".." in pack:
+            raise ValueError(f"Invalid pack name: {pack}")
+
+    def pack_key(self, pack: str) -> str:
+        self._check_name(pack)
+        return f"{self.prefix}{pack}.pack"
+
+    def index_key(self, pack: str) -> str:
+        self._check_name(pack)
+        return f"{self.prefix}{pack}.idx"
+
+    def pack_names(self) -> List[str]:
+        # the index is uploaded after the pack, so it marks a complete pack
+        keys = self.storage.list_keys(self.prefix)
+        return sorted(key[len(self.prefix) : -4] for key in keys if key.endswith(".idx"))
+
+    def publish(self, writer: "PackWriter") -> str:
+        """Seal ``writer`` and upload pack and index to the storage."""
+        name = writer.seal()
+        pack_path = os.path.join(writer.root, f"{name}.pack")
+        index_path = os.path.join(writer.root, f"{name}.idx")
+        try:
+            self.storage.put_file(pack_path, self.pack_key(name), "application/octet-stream")
+            os.makedirs(self.cache_dir, exist_ok=True)
+            shutil.copyfile(index_path, os.path.join(self.cache_dir, f"{name}.idx"))
+            self.storage.put_file(index_path, self.index_key(name), "application/octet-stream")
+        finally:
+            # the local copies are only a staging area (moved away by local storage)
+            for path in (pack_path, index_path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+        return name
+
+    def _index(self, pack: str) -> PackIndex:
+        with self._lock:
+            index = self._indexes.get(pack)
+            if index is not None:
+                self._indexes.move_to_end(pack)
+                return index
+            key = self.index_key(pack)
+            path = os.path.join(self.cache_dir, f"{pack}.idx")
+            if not os.path.exists(path):
+                if not self.storage.exists(key):
+                    raise FileNotFoundError(self.storage.uri(key))
+                os.makedirs(self.cache_dir, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=f"{pack}.", suffix=".part")
+                try:
+                    with os.fdopen(fd, "wb") as out, self.storage.open(key) as src:
+                        shutil.copyfileobj(src, out)
+                    os.replace(tmp, path)
+                except BaseException:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(tmp)
+                    raise
+            index = self._indexes[pack] = PackIndex(path)
+            if len(self._indexes) > OPEN_INDEXES:
+                # not closed explicitly: another thread may still be reading it
+                self._indexes.popitem(last=False)
+            return index
+
+    def _locate(self, key: str) -> Tuple[str, IndexRecord]:
+        pack, _, name = key.partition("/")
+        try:
+            digest = bytes.fromhex(name.split(".", 1)[0])
+        except ValueError:
+            raise FileNotFoundError(self.uri(key)) from None
+        record = self._index(pack).lookup(digest)
+        if record is None:
+            raise FileNotFoundError(self.uri(key))
+        return pack, record
+
+    def read(self, key: str) -> bytes:
+        """Return the content of one entry, checked against its CRC-32."""
+        pack, record = self._locate(key)
+        stored = self.storage.read_range(self.pack_key(pack), record.offset, record.stored_length)
+        if len(stored) != record.stored_length or zlib.crc32(stored) != record.crc32:
+            raise IOError(f"Prüfsumme stimmt nicht: {self.uri(key)}")
+        return zlib.decompress(stored) if record.flags & FLAG_ZLIB else stored
+
+    def put_file(self, src_path: str, key: str, content_type: Optional[str] = None) -> str:
+        raise NotImplementedError("Das Archiv wird nur von `python -m app.archive pack` beschrieben")
+
+    def open(self, key: str) -> BinaryIO:
+        return io.BytesIO(self.read(key))
+
+    @contextlib.contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        fd, path = tempfile.mkstemp(prefix="blob-", suffix=os.path.splitext(key)[1])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.read(key))
+            yield path
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._locate(key)
+        except (FileNotFoundError, ValueError):
+            return False
+        return True
+
+    def size(self, key: str) -> int:
+        return self._locate(key)[1].raw_length
+
+    def mtime(self, key: str) -> float:
+        # packs are immutable; their name carries the creation time
+        stamp = key.partition("/")[0].split("-")[1]
+        return time.mktime(time.strptime(stamp, "%Y%m%dT%H%M%S"))
+
+    def delete(self, key: str) -> None:
+        # packs are append-only; entries stay until the whole pack is retired
+        logging.info("Archiveintrag %s bleibt bis zum Ablauf der Aufbewahrungsfrist erhalten", key)
+
+    # -- integrity -------------------------------------------------------
+    def verify_pack(self, pack: str) -> Dict[str, object]:
+        """Re-read a whole pack and compare it with its index."""
+        index = self._index(pack)
+        indexed = {record.digest: record for record in index}
+        errors: List[str] = []
+        seen = 0
+        # one sequential read through the storage, i.e. exactly what was uploaded
+        with self.storage.open(self.pack_key(pack)) as f:
+            if f.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                return {"pack": pack, "entries": 0, "errors": ["ungültiger Header"]}
+            offset = len(PACK_MAGIC)
+            while True:
+                header = f.read(ENTRY_HEADER.size)
+                if not header:
+                    break
+                if len(header) < ENTRY_HEADER.size:
+                    errors.append(f"abgeschnittener Eintrag bei Offset {offset}")
+                    break
+                magic, flags, key_length, stored_length, raw_length, crc = ENTRY_HEADER.unpack(header)
+                if magic != ENTRY_MAGIC:
+                    errors.append(f"ungültiger Eintrag bei Offset {offset}")
+                    break
+                key = f.read(key_length).decode("ascii", "replace")
+                data_offset = offset + ENTRY_HEADER.size + key_length
+                stored = f.read(stored_length)
+                offset = data_offset + stored_length
+                seen += 1
+                try:
+                    expected = bytes.fromhex(key.split(".", 1)[0])
+                except ValueError:
+                    errors.append(f"ungültiger Schlüssel {key!r} bei Offset {offset}")
+                    continue
+                record = indexed.pop(expected, None)
+                if record is None or record.offset != data_offset or record.crc32 != crc:
+                    errors.append(f"{key}: fehlt im Index oder Offset falsch")
+                if len(stored) != stored_length or zlib.crc32(stored) != crc:
+                    errors.append(f"{key}: CRC-32 falsch")
+                    continue
+                try:
+                    raw = zlib.decompress(stored) if flags & FLAG_ZLIB else stored
+                except zlib.error as exc:
+                    errors.append(f"{key}: {exc}")
+                    continue
+                if len(raw) != raw_length or hashlib.sha256(raw).digest() != expected:
+                    errors.append(f"{key}: SHA-256 stimmt nicht")
+        errors.extend(f"{digest.hex()}: im Index, aber nicht im Pack" for digest in indexed)
+        return {"pack": pack, "entries": seen, "errors": errors}
+
+    def verify_all(self) -> List[Dict[str, object]]:
+        return [self.verify_pack(pack) for pack in self.pack_names()]
+
+
+_archive: Optional[PackArchive] = None
+
+
+def get_archive() -> PackArchive:
+    global _archive
+    if _archive is None:
+        _archive = PackArchive(get_storage(), os.getenv("ARCHIVE_DIR", "/tmp/archive"))
+    return _archive
+
+
+# -- archival job --------------------------------------------------------
+@dataclass
+class ArchiveReport:
+    receipts: int = 0
+    files: int = 0
+    raw_bytes: int = 0
+    stored_bytes: int = 0
+    missing: int = 0
+    hash_mismatch: int = 0
+    queued_originals: int = 0
+    kept_originals: int = 0
+    packs: List[str] = field(default_factory=list)
+
+    def as_dict(self) -> Dict[str, object]:
+        return dict(self.__dict__)
+
+
+def _same_storage(uri: str, archive: PackArchive) -> bool:
+    try:
+        storage, _ = resolve(uri)
+    except ValueError:
+        return False
+    return storage is archive.storage
+
+
+def archive_receipts(
+    before: date,
+    pack_size: int = PACK_SIZE,
+    batch_size: int = 500,
+    keep_originals: bool = False,
+) -> ArchiveReport:
+    """Move the files of all receipts dated before ``before`` into packs.
+
+    Receipts sharing a file (same content hash) share one entry.  The
+    database is only updated after a pack has been uploaded and verified
+    from the storage.  Originals that live in the same storage backend
+    as the pack are not deleted here but queued in ``file_cleanup``
+    (see :mod:`app.offboarding`), in the same transaction as the new
+    URIs: the cleanup worker deletes a file only if no receipt refers
+    to it any more and it was not rewritten by a concurrent upload of
+    the same content within the grace period.  Legacy filesystem paths
+    and files of another backend are kept and counted in
+    ``kept_originals``.
+    """
+    archive = get_archive()
+    report = ArchiveReport()
+    session = SessionLocal()
+    writer: Optional[PackWriter] = None
+    moved: Dict[str, str] = {}  # old uri -> archive key in the open pack
+
+    def flush() -> None:
+        nonlocal writer
+        if writer is None or not moved:
+            return
+        name = archive.publish(writer)
+        writer = None
+        # read back from the storage before any receipt points at the pack
+        result = archive.verify_pack(name)
+        if result["errors"]:
+            raise IOError(f"Pack {name} fehlerhaft: {result['errors'][:5]}")
+        report.packs.append(name)
+        stmt = (
+            update(Receipt)
+            .where(Receipt.file_path == bindparam("old_uri"), Receipt.date < before)
+            .values(file_path=bindparam("new_uri"))
+        )
+        session.connection().execute(
+            stmt, [{"old_uri": old, "new_uri": archive.uri(f"{name}/{key}")} for old, key in moved.items()]
+        )
+        if not keep_originals:
+            still_used = set(session.scalars(select(Receipt.file_path).where(Receipt.file_path.in_(list(moved)))))
+            queued = []
+            for old, key in moved.items():
+                if old in still_used:
+                    continue
+                if not _same_storage(old, archive):
+                    # the pack is not in the backend holding this file
+                    report.kept_originals += 1
+                    continue
+                queued.append({"file_path": old, "content_hash": key.split(".", 1)[0]})
+            if queued:
+                # committed together with the new URIs; the cleanup worker
+                # re-checks references and skips recently written files
+                session.execute(insert(FileCleanup), queued)
+                report.queued_originals += len(queued)
+        session.commit()
+        logging.info("Pack %s: %d Dateien archiviert", name, len(moved))
+        moved.clear()
+
+    last_id = 0
+    try:
+        while True:
+            rows = session.execute(
+                select(Receipt.id, Receipt.file_path, Receipt.content_hash)
+                .where(
+                    Receipt.id > last_id,
+                    Receipt.date < before,
+                    Receipt.file_path.not_like("archive://%"),
+                )
+                .order_by(Receipt.id)
+                .limit(batch_size)
+            ).all()
+            session.rollback()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            for row in rows:
+                report.receipts += 1
+                if row.file_path in moved:
+                    continue
+                try:
+                    with open_blob(row.file_path) as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    report.missing += 1
+                    logging.warning("Datei fehlt, nicht archiviert: %s", row.file_path)
+                    continue
+                digest = hashlib.sha256(data).hexdigest()
+                if row.content_hash and row.content_hash != digest:
+                    report.hash_mismatch += 1
+                    logging.warning("SHA-256 weicht ab, nicht archiviert: %s", row.file_path)
+                    continue
+                if writer is None:
+                    writer = PackWriter(archive.staging_dir)
+                before_size = writer.size
+                extension = os.path.splitext(row.file_path)[1].lower()
+                moved[row.file_path] = writer.add(f"{digest}{extension}", data)
+                if writer.size > before_size:
+                    report.files += 1
+                    report.raw_bytes += len(data)
+                    report.stored_bytes += writer.size - before_size
+                if writer.size >= pack_size:
+                    flush()
+        flush()
+    finally:
+        if writer is not None:
+            writer.abort()
+        session.close()
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Cold archive for receipt files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="archive receipts of closed periods")
+    pack.add_argument(
+        "--before",
+        type=date.fromisoformat,
+        default=date(date.today().year, 1, 1),
+        help="archive receipts dated before this day (default: start of the current year)",
+    )
+    pack.add_argument("--pack-size", type=int, default=PACK_SIZE, help="target pack size in bytes")
+    pack.add_argument("--keep-originals", action="store_true")
+    verify = commands.add_parser("verify", help="check checksums of all packs")
+    verify.add_argument("--pack", action="append", help="only these packs")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.command == "pack":
+        report = archive_receipts(args.before, args.pack_size, keep_originals=args.keep_originals)
+        for name, value in report.as_dict().items():
+            print(f"{name:<18} {value}")
+        return
+    archive = get_archive()
+    failed = 0
+    for pack_name in args.pack or archive.pack_names():
+        result = archive.verify_pack(pack_name)
+        status = "OK" if not result["errors"] else "FEHLER"
+        print(f"{pack_name}  {result['entries']:>8} Einträge  {status}")
+        for error in result["errors"]:
+            print(f"    {error}")
+        failed += bool(result["errors"])
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Re-OCR backfill for stored receipts.
+
+When the heuristics in :mod:`app.ocr` improve, :data:`app.ocr.PARSER_VERSION`
+is increased.  This job re-parses every receipt whose ``parser_version``
+is below the target version and writes the new values back::
+
+    python -m app.backfill --workers 4 --batch-size 200 --max-rate 20
+
+How it works:
+
+* receipts are read in keyset-paginated batches (``id > last_id``), so
+  each batch is a cheap index range scan no matter how far the job got;
+* the files are parsed in a process pool whose workers run with a lower
+  CPU priority (``nice``); ``--max-rate`` caps receipts per second so
+  the job does not starve live traffic;
+* each batch is written with one executemany ``UPDATE`` by primary key;
+* after every batch the position is saved to a JSON checkpoint
+  (``--checkpoint``); an interrupted run resumes from there;
+* every applied field-level change is appended to a JSON-lines report
+  (``--report``) and summarised per field at the end.
+
+Receipts whose file cannot be parsed keep their old version and are
+listed in the report; they are retried by the next run with a fresh
+checkpoint.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, select, update
+
+from . import ocr
+from .database import SessionLocal
+from .models import Receipt
+from .storage import blob_local_path
+
+# Receipt columns written by the backfill (see ocr.receipt_fields)
+FIELDS = ("date", "net_amount", "tax_amount", "gross_amount", "supplier", "tax_rate", "text_content")
+
+
+def _lower_priority() -> None:
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def _reparse(file_uri: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Worker: parse one stored file; returns ``(fields, error)``."""
+    try:
+        with blob_local_path(file_uri) as path:
+            return ocr.receipt_fields(ocr.parse_receipt_pdf(path)), None
+    except Exception as exc:
+        return None, f"{type(exc).__name__}: {exc}"
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return value.quantize(Decimal("0.01"))
+    return value
+
+
+def _jsonable(value: Any) -> Any:
+    return value if value is None or isinstance(value, (int, float, str)) else str(value)
+
+
+@dataclass
+class Checkpoint:
+    path: str
+    target_version: int
+    last_id: int = 0
+    processed: int = 0
+    updated: int = 0
+    failed: int = 0
+    changed_fields: Counter = field(default_factory=Counter)
+
+    @classmethod
+    def load(cls, path: str, target_version: int) -> "Checkpoint":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return cls(path, target_version)
+        if raw.get("target_version") != target_version:
+            logging.info("Checkpoint gehört zu Version %s, starte neu", raw.get("target_version"))
+            return cls(path, target_version)
+        return cls(
+            path,
+            target_version,
+            raw["last_id"],
+            raw["processed"],
+            raw["updated"],
+            raw["failed"],
+            Counter(raw.get("changed_fields", {})),
+        )
+
+    def save(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "target_version": self.target_version,
+                    "last_id": self.last_id,
+                    "processed": self.processed,
+                    "updated": self.updated,
+                    "failed": self.failed,
+                    "changed_fields": dict(self.changed_fields),
+                },
+                f,
+            )
+        os.replace(tmp, self.path)
+
+
+def run_backfill(
+    target_version: int = ocr.PARSER_VERSION,
+    workers: int = 2,
+    batch_size: int = 200,
+    max_rate: Optional[float] = None,
+    checkpoint_path: str = "backfill-checkpoint.json",
+    report_path: Optional[str] = "backfill-report.jsonl",
+    dry_run: bool = False,
+    limit: Optional[int] = None,
+) -> Checkpoint:
+    """Re-parse all receipts below ``target_version``; see module docstring."""
+    if target_version > ocr.PARSER_VERSION:
+        raise ValueError(f"Zielversion {target_version} > ocr.PARSER_VERSION {ocr.PARSER_VERSION}")
+    checkpoint = Checkpoint.load(checkpoint_path, target_version)
+    report = open(report_path, "a", encoding="utf-8") if report_path else None
+    session = SessionLocal()
+    started = time.monotonic()
+    handled_this_run = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_lower_priority) as pool:
+            while limit is None or handled_this_run < limit:
+                size = batch_size if limit is None else min(batch_size, limit - handled_this_run)
+                stmt = (
+                    select(Receipt.id, Receipt.file_path, *(getattr(Receipt, f) for f in FIELDS))
+                    .where(
+                        Receipt.id > checkpoint.last_id,
+                        or_(Receipt.parser_version.is_(None), Receipt.parser_version < target_version),
+                    )
+                    .order_by(Receipt.id)
+                    .limit(size)
+                )
+                rows = session.execute(stmt).all()
+                session.rollback()  # do not hold a read transaction while parsing
+                if not rows:
+                    break
+                results = pool.map(_reparse, [row.file_path for row in rows], chunksize=max(1, len(rows) // (workers * 4)))
+                updates: List[Dict[str, Any]] = []
+                for row, (fields, error) in zip(rows, results):
+                    if fields is None:
+                        checkpoint.failed += 1
+                        if report:
+                            report.write(json.dumps({"id": row.id, "error": error}) + "\n")
+                        continue
+                    changes = {
+                        name: [_jsonable(getattr(row, name)), _jsonable(fields[name])]
+                        for name in FIELDS
+                        if _normalize(getattr(row, name)) != _normalize(fields[name])
+                        and name != "text_content"
+                    }
+                    if fields["text_content"] != row.text_content:
+                        changes["text_content"] = ["…", "…"]  # too long for the report
+                    checkpoint.changed_fields.update(changes.keys())
+                    if changes:
+                        checkpoint.updated += 1
+                        if report:
+                            report.write(json.dumps({"id": row.id, "changes": changes}) + "\n")
+                    updates.append({"id": row.id, **fields, "parser_version": target_version})
+                if updates and not dry_run:
+                    session.execute(update(Receipt), updates)
+                    session.commit()
+                checkpoint.processed += len(rows)
+                checkpoint.last_id = rows[-1].id
+                handled_this_run += len(rows)
+                if not dry_run:
+                    checkpoint.save()
+                if report:
+                    report.flush()
+                logging.info(
+                    "Backfill: %d verarbeitet, %d geändert, %d Fehler (bis id %d)",
+                    checkpoint.processed, checkpoint.updated, checkpoint.failed, checkpoint.last_id,
+                )
+                if max_rate:
+                    # throttle: sleep until the average rate is at most max_rate
+                    ahead = handled_this_run / max_rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+    finally:
+        session.close()
+        if report:
+            report.close()
+    return checkpoint
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Re-parse stored receipts with the current OCR heuristics.")
+    parser.add_argument("--target-version", type=int, default=ocr.PARSER_VERSION)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--max-rate", type=float, help="maximum receipts per second")
+    parser.add_argument("--checkpoint", default="backfill-checkpoint.json")
+    parser.add_argument("--report", default="backfill-report.jsonl", help="JSON lines with field-level diffs")
+    parser.add_argument("--limit", type=int, help="stop after this many receipts")
+    parser.add_argument("--dry-run", action="store_true", help="report diffs without writing")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    checkpoint = run_backfill(
+        target_version=args.target_version,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        max_rate=args.max_rate,
+        checkpoint_path=args.checkpoint,
+        report_path=args.report,
+        dry_run=args.dry_run,
+        limit=args.limit,
+    )
+    print(f"verarbeitet: {checkpoint.processed}, geändert: {checkpoint.updated}, Fehler: {checkpoint.failed}")
+    for name, count in checkpoint.changed_fields.most_common():
+        print(f"  {name:<14} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""Bank statement import and automatic matching to open items.
+
+Statements are read as a stream of :class:`BankTransaction` objects from
+one of three formats:
+
+* **CAMT.053** (ISO 20022 XML) – parsed incrementally with
+  ``iterparse``; every ``<Ntry>`` element is released after use.
+* **MT940** (SWIFT) – ``:61:`` statement lines with their ``:86:``
+  details, including the German ``?20``–``?29`` remittance subfields.
+* **CSV** – semicolon or comma separated exports of German online
+  banking (``Buchungstag``, ``Betrag``, ``Verwendungszweck``, …) or
+  English headers (``date``, ``amount``, ``reference``, …).
+
+:class:`OpenItemIndex` holds the unpaid open items in two hash maps:
+amount in cents → items, and normalized reference token → item ids.  A
+transaction is resolved with a handful of dictionary lookups instead of
+a comparison against every open item:
+
+1. **exact** – same amount and at least one shared reference token,
+   found by intersecting the token postings with the amount bucket;
+2. **amount** – same amount and exactly one candidate with that amount;
+3. **reference** – a shared, selective token (e.g. an invoice number)
+   and an amount within the cash discount tolerance (up to 3 % less).
+
+Only credits (incoming payments) are matched; a debit never settles a
+receivable.  An **amount** match shares no token with the item, so it
+is only proposed for review and never settled automatically.
+
+Settled items are removed from the index, so each item is settled at
+most once.  A proposed item stays in it: a later transaction of the
+same statement that names it still settles it, and the proposal is
+dropped again (its transaction is reported as unmatched).
+:func:`reconcile` marks the exact and reference matches as paid with
+chunked ``UPDATE … WHERE id IN (…)`` statements and returns a report
+including the proposals and every unmatched transaction.  A statement belongs to the account of one customer, so
+the API always restricts the index to that customer.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import logging
+import re
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Set
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from .models import OpenItem
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+REFERENCE_RE = re.compile(r"[a-z0-9]+(?:[-/._][a-z0-9]+)+")
+MT940_61_RE = re.compile(r"^(\d{6})(\d{4})?(R?[CD])[A-Z]?([\d,]+)")
+MT940_SUBFIELD_RE = re.compile(r"\?\d{2}")
+STOPWORDS = {
+    "und", "der", "die", "das", "für", "fuer", "von", "vom", "zum", "zur", "mit", "the", "and",
+    "rechnung", "rg", "re", "nr", "invoice", "eur", "euro", "gmbh", "zahlung", "ueberweisung",
+    "svwz", "eref", "kref", "mref", "cred", "abwa", "sepa", "gutschrift",
+}
+# tokens shared by more open items than this do not identify a single item
+MAX_POSTINGS = 50
+# cash discount (Skonto) tolerance for reference matches
+MAX_DISCOUNT = Decimal("0.03")
+UPDATE_CHUNK = 1000
+
+
+@dataclass
+class BankTransaction:
+    booking_date: Optional[date]
+    amount_cents: int  # positive = credit, negative = debit
+    reference: str = ""
+    counterparty: str = ""
+    line: int = 0
+
+
+@dataclass
+class Match:
+    transaction: BankTransaction
+    open_item_id: int
+    customer_id: int
+    method: str  # "exact", "amount" or "reference"
+
+
+@dataclass
+class ReconcileReport:
+    transactions: int = 0
+    matched: List[Match] = field(default_factory=list)
+    review: List[Match] = field(default_factory=list)  # amount-only, not settled
+    unmatched: List[BankTransaction] = field(default_factory=list)
+
+    def as_dict(self) -> Dict[str, object]:
+        by_method: Dict[str, int] = defaultdict(int)
+        for m in self.matched:
+            by_method[m.method] += 1
+        return {
+            "transactions": self.transactions,
+            "matched_count": len(self.matched),
+            "review_count": len(self.review),
+            "unmatched_count": len(self.unmatched),
+            "matched_by_method": dict(by_method),
+            "matched": [
+                {"open_item_id": m.open_item_id, "customer_id": m.customer_id, "method": m.method, **asdict(m.transaction)}
+                for m in self.matched
+            ],
+            "review": [
+                {"open_item_id": m.open_item_id, "customer_id": m.customer_id, "method": m.method, **asdict(m.transaction)}
+                for m in self.review
+            ],
+            "unmatched": [asdict(t) for t in self.unmatched],
+        }
+
+
+# --------------------------------------------------------------------
+# Parsing
+# --------------------------------------------------------------------
+def to_cents(value: str) -> int:
+    """Convert ``1.234,56``, ``-12,00``, ``1234.56`` or ``12`` to cents."""
+    value = value.strip().replace(" ", "").replace("\u00a0", "").replace("EUR", "").replace("€", "")
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+    try:
+        return int((Decimal(value) * 100).quantize(Decimal("1")))
+    except InvalidOperation as exc:
+        raise ValueError(f"Ungültiger Betrag: {value!r}") from exc
+
+
+def _parse_date(value: str) -> Optional[date]:
+    value = value.strip()
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d.%m.%y", "%y%m%d", "%Y%m%d"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find_text(elem: ET.Element, path: List[str]) -> List[str]:
+    """Collect the text of all descendants along a namespace-agnostic path."""
+    nodes = [elem]
+    for name in path:
+        nodes = [child for node in nodes for child in node if _local(child.tag) == name]
+    return [n.text.strip() for n in nodes if n.text and n.text.strip()]
+
+
+def parse_camt053(stream: IO[bytes]) -> Iterator[BankTransaction]:
+    line = 0
+    for _, elem in ET.iterparse(stream, events=("end",)):
+        if _local(elem.tag) != "Ntry":
+            continue
+        line += 1
+        amount = _find_text(elem, ["Amt"])
+        if not amount:
+            elem.clear()
+            continue
+        cents = to_cents(amount[0])
+        if _find_text(elem, ["CdtDbtInd"]) == ["DBIT"]:
+            cents = -cents
+        booked = _find_text(elem, ["BookgDt", "Dt"]) or _find_text(elem, ["BookgDt", "DtTm"])
+        details = ["NtryDtls", "TxDtls"]
+        reference = _find_text(elem, details + ["RmtInf", "Ustrd"]) + _find_text(
+            elem, details + ["RmtInf", "Strd", "CdtrRefInf", "Ref"]
+        )
+        party = ("Dbtr" if cents > 0 else "Cdtr")
+        counterparty = _find_text(elem, details + ["RltdPties", party, "Nm"]) or _find_text(
+            elem, details + ["RltdPties", party, "Pty", "Nm"]
+        )
+        yield BankTransaction(
+            booking_date=_parse_date(booked[0][:10]) if booked else None,
+            amount_cents=cents,
+            reference=" ".join(reference + _find_text(elem, ["AddtlNtryInf"])),
+            counterparty=counterparty[0] if counterparty else "",
+            line=line,
+        )
+        elem.clear()
+
+
+def parse_mt940(lines: Iterable[str]) -> Iterator[BankTransaction]:
+    pending: Optional[BankTransaction] = None
+    tag = ""
+    details: List[str] = []
+
+    def finish() -> Optional[BankTransaction]:
+        if pending is None:
+            return None
+        text = "".join(details)
+        if "?" in text:
+            # German structured :86: – ?20-?29 remittance, ?32/?33 counterparty
+            parts = MT940_SUBFIELD_RE.split(text)
+            codes = [m.group(0)[1:] for m in MT940_SUBFIELD_RE.finditer(text)]
+            fields = dict(zip(codes, parts[1:]))
+            pending.reference = " ".join(v for k, v in sorted(fields.items()) if "20" <= k <= "29" or "60" <= k <= "63")
+            pending.counterparty = "".join(fields.get(k, "") for k in ("32", "33"))
+        else:
+            pending.reference = text
+        return pending
+
+    for number, raw in enumerate(lines, start=1):
+        line = raw.rstrip("\r\n")
+        if line.startswith(":"):
+            tag = line[1 : line.index(":", 1)] if line.count(":") >= 2 else ""
+            body = line[len(tag) + 2 :]
+            if tag == "61":
+                done = finish()
+                if done is not None:
+                    yield done
+                details = []
+                m = MT940_61_RE.match(body)
+                if not m:
+                    logging.warning("MT940: Umsatzzeile %d nicht lesbar: %s", number, line)
+                    pending = None
+                    continue
+                cents = to_cents(m.group(4))
+                if m.group(3) in ("D", "RC"):
+                    cents = -cents
+                pending = BankTransaction(_parse_date(m.group(1)), cents, line=number)
+            elif tag == "86":
+                details = [body]
+            elif tag == "62F":
+                done = finish()
+                if done is not None:
+                    yield done
+                pending, details = None, []
+        elif tag == "86" and line not in ("-", ""):
+            details.append(line)
+    done = finish()
+    if done is not None:
+        yield done
+
+
+_CSV_COLUMNS = {
+    "date": ("buchungstag", "buchungsdatum", "datum", "valuta", "valutadatum", "date", "booking date"),
+    "amount": ("betrag", "betrag (eur)", "umsatz", "amount"),
+    "reference": ("verwendungszweck", "buchungstext", "reference", "purpose", "description"),
+    "counterparty": (
+        "beguenstigter/zahlungspflichtiger", "begünstigter/zahlungspflichtiger",
+        "name zahlungsbeteiligter", "auftraggeber/empfänger", "name", "counterparty",
+    ),
+}
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[BankTransaction]:
+    iterator = iter(lines)
+    header_line = next(iterator, "")
+    delimiter = ";" if header_line.count(";") >= header_line.count(",") else ","
+    header = [h.strip().strip('"').lower() for h in next(csv.reader([header_line], delimiter=delimiter))]
+    index = {}
+    for key, names in _CSV_COLUMNS.items():
+        for name in names:
+            if name in header:
+                index[key] = header.index(name)
+                break
+    if "amount" not in index:
+        raise ValueError("CSV ohne Betragsspalte")
+    for number, row in enumerate(csv.reader(iterator, delimiter=delimiter), start=2):
+        if not row or len(row) <= index["amount"] or not row[index["amount"]].strip():
+            continue
+        get = lambda key: row[index[key]].strip() if key in index and len(row) > index[key] else ""  # noqa: E731
+        yield BankTransaction(
+            booking_date=_parse_date(get("date")),
+            amount_cents=to_cents(get("amount")),
+            reference=get("reference"),
+            counterparty=get("counterparty"),
+            line=number,
+        )
+
+
+def detect_format(filename: str, head: bytes) -> str:
+    name = filename.lower()
+    if name.endswith(".xml") or head.lstrip().startswith(b"<"):
+        return "camt053"
+    if name.endswith((".sta", ".mt940", ".940")) or b":20:" in head or b":61:" in head:
+        return "mt940"
+    return "csv"
+
+
+def read_statement(path: str, fmt: str) -> Iterator[BankTransaction]:
+    """Stream the transactions of a statement file in the given format."""
+    if fmt == "camt053":
+        with open(path, "rb") as stream:
+            yield from parse_camt053(stream)
+        return
+    with open(path, "rb") as raw:
+        head = raw.read(4096)
+    encoding = "utf-8" if _is_utf8(head) else "latin-1"
+    with io.open(path, "r", encoding=encoding, errors="replace", newline="") as stream:
+        if fmt == "mt940":
+            yield from parse_mt940(stream)
+        elif fmt == "csv":
+            yield from parse_csv(stream)
+        else:
+            raise ValueError(f"Unbekanntes Format: {fmt}")
+
+
+def _is_utf8(data: bytes) -> bool:
+    try:
+        data.decode("utf-8")
+        return True
+    except UnicodeDecodeError as exc:
+        # a multi-byte sequence may be cut at the end of the sample
+        return exc.start >= len(data) - 3
+
+
+# --------------------------------------------------------------------
+# Matching
+# --------------------------------------------------------------------
+def tokens(text: str) -> Set[str]:
+    """Normalized, discriminative tokens of a reference or description."""
+    text = text.lower()
+    result = {t for t in TOKEN_RE.findall(text) if t not in STOPWORDS and (len(t) >= 4 or (t.isdigit() and len(t) >= 3))}
+    # keep composite references like "RE-2024-0815" as one token as well
+    result.update(re.sub(r"[-/._]", "", ref) for ref in REFERENCE_RE.findall(text))
+    return result
+
+
+@dataclass
+class _Item:
+    id: int
+    customer_id: int
+    cents: int
+    tokens: Set[str]
+
+
+class OpenItemIndex:
+    """Hash indexes over unpaid open items by amount and reference token."""
+
+    def __init__(self) -> None:
+        self.by_amount: Dict[int, Dict[int, _Item]] = defaultdict(dict)
+        self.by_token: Dict[str, Set[int]] = defaultdict(set)
+        self.items: Dict[int, _Item] = {}
+
+    @classmethod
+    def load(cls, db: Session, customer_id: Optional[int] = None) -> "OpenItemIndex":
+        index = cls()
+        stmt = select(OpenItem.id, OpenItem.customer_id, OpenItem.amount, OpenItem.description).where(
+            OpenItem.paid.is_(False)
+        )
+        if customer_id is not None:
+            stmt = stmt.where(OpenItem.customer_id == customer_id)
+        for item_id, cust_id, amount, description in db.execute(stmt.execution_options(yield_per=10000)):
+            index.add(item_id, cust_id, int((Decimal(amount) * 100).quantize(Decimal("1"))), description)
+        return index
+
+    def add(self, item_id: int, customer_id: int, cents: int, description: str) -> None:
+        item = _Item(item_id, customer_id, cents, tokens(description or ""))
+        self.items[item_id] = item
+        self.by_amount[cents][item_id] = item
+        for token in item.tokens:
+            self.by_token[token].add(item_id)
+
+    def remove(self, item: _Item) -> None:
+        del self.items[item.id]
+        bucket = self.by_amount[item.cents]
+        del bucket[item.id]
+        if not bucket:
+            del self.by_amount[item.cents]
+        for token in item.tokens:
+            postings = self.by_token[token]
+            postings.discard(item.id)
+            if not postings:
+                del self.by_token[token]
+
+    def match(self, tx: BankTransaction) -> Optional[Match]:
+        if tx.amount_cents <= 0:
+            # debits are our own payments, not settlements of receivables
+            return None
+        cents = tx.amount_cents
+        tx_tokens = tokens(f"{tx.reference} {tx.counterparty}")
+        candidates = self.by_amount.get(cents)
+        if candidates:
+            # intersect the token postings with the amount bucket, walking the
+            # smaller side; a token common in a large bucket identifies nothing
+            exact: Dict[int, int] = defaultdict(int)
+            for token in tx_tokens:
+                postings = self.by_token.get(token)
+                if not postings or min(len(postings), len(candidates)) > MAX_POSTINGS:
+                    continue
+                if len(postings) <= len(candidates):
+                    shared = (item_id for item_id in postings if item_id in candidates)
+                else:
+                    shared = (item_id for item_id in candidates if item_id in postings)
+                for item_id in shared:
+                    exact[item_id] += 1
+            if exact:
+                best_id = max(exact, key=lambda item_id: (exact[item_id], -item_id))
+                return self._take(tx, candidates[best_id], "exact")
+            if len(candidates) == 1:
+                # only a suggestion for review: the item stays available for
+                # a later transaction of the statement that names it
+                item = next(iter(candidates.values()))
+                return Match(tx, item.id, item.customer_id, "amount")
+        # reference match with cash discount tolerance
+        hits: Dict[int, int] = defaultdict(int)
+        for token in tx_tokens:
+            postings = self.by_token.get(token)
+            if postings and len(postings) <= MAX_POSTINGS:
+                for item_id in postings:
+                    hits[item_id] += 1
+        best_item, best_score = None, 0
+        for item_id, score in hits.items():
+            item = self.items[item_id]
+            if item.cents and Decimal(item.cents - cents) / item.cents <= MAX_DISCOUNT and cents <= item.cents:
+                if score > best_score or (score == best_score and best_item is not None and item.id < best_item.id):
+                    best_item, best_score = item, score
+        if best_item is not None:
+            return self._take(tx, best_item, "reference")
+        return None
+
+    def _take(self, tx: BankTransaction, item: _Item, method: str) -> Match:
+        self.remove(item)
+        return Match(tx, item.id, item.customer_id, method)
+
+
+def reconcile(
+    db: Session,
+    transactions: Iterable[BankTransaction],
+    customer_id: Optional[int] = None,
+    apply: bool = True,
+) -> ReconcileReport:
+    """Match transactions against unpaid open items and mark matches paid."""
+    index = OpenItemIndex.load(db, customer_id)
+    report = ReconcileReport()
+    for tx in transactions:
+        report.transactions += 1
+        match = index.match(tx)
+        if match is None:
+            report.unmatched.append(tx)
+        elif match.method == "amount":
+            report.review.append(match)
+        else:
+            report.matched.append(match)
+    # review suggestions whose item a later transaction settled by reference
+    settled = {m.open_item_id for m in report.matched}
+    review, report.review = report.review, []
+    for match in review:
+        if match.open_item_id in settled:
+            report.unmatched.append(match.transaction)
+        else:
+            report.review.append(match)
+    if apply and report.matched:
+        ids = [m.open_item_id for m in report.matched]
+        for start in range(0, len(ids), UPDATE_CHUNK):
+            db.execute(
+                update(OpenItem)
+                .where(OpenItem.id.in_(ids[start : start + UPDATE_CHUNK]))
+                .values(paid=True)
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+    return report
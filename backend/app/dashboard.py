@@ -0,0 +1,182 @@
+"""Aggregates for the customer dashboard.
+
+The dashboard needs the latest receipts, the totals of the current and
+the previous month, the UStVA status of the recent months and a
+summary of the open items.  Each part is a single aggregate query that
+is served by one of the composite indexes on ``customer_id`` (see
+:mod:`app.models`), so the cost of a dashboard load depends on the
+size of the response, not on the length of the customer's history.
+
+:func:`load_dashboard` runs the queries one after another on a single
+session in the threadpool, so a dashboard request holds exactly one
+pooled connection however many users load it at once; the queries are
+small enough that running them concurrently would gain little and
+would multiply the connections per request.
+"""
+
+from __future__ import annotations
+
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .models import Customer, OpenItem, Receipt, Ustva
+from .ustva_engine import INCOMING, OUTGOING, _get_date_range
+
+ZERO = Decimal("0.00")
+
+
+def _shift_month(year: int, month: int, delta: int) -> tuple[int, int]:
+    index = year * 12 + month - 1 + delta
+    return index // 12, index % 12 + 1
+
+
+def customer_exists(db: Session, customer_id: int) -> bool:
+    return db.scalar(select(Customer.id).where(Customer.id == customer_id)) is not None
+
+
+def latest_receipts(db: Session, customer_id: int, limit: int) -> List[Receipt]:
+    """Return the ``limit`` most recently uploaded receipts."""
+    stmt = (
+        select(Receipt)
+        .where(Receipt.customer_id == customer_id)
+        .order_by(Receipt.id.desc())
+        .limit(limit)
+    )
+    return list(db.scalars(stmt))
+
+
+def _direction_totals() -> Dict[str, Any]:
+    return {"count": 0, "net_sum": ZERO, "tax_sum": ZERO, "gross_sum": ZERO}
+
+
+def period_totals(db: Session, customer_id: int, year: int, month: int) -> Dict[str, Dict[str, Any]]:
+    """Sum net, tax and gross amounts of the given and the previous month.
+
+    Outgoing invoices (revenue, Umsatzsteuer) and incoming invoices
+    (costs, Vorsteuer) are summed separately; ``zahllast`` is the
+    Umsatzsteuer minus the Vorsteuer.
+    """
+    prev_year, prev_month = _shift_month(year, month, -1)
+    current_start, current_end = _get_date_range(year, month)
+    previous_start, _ = _get_date_range(prev_year, prev_month)
+    bucket = case((Receipt.date >= current_start, "current"), else_="previous").label("bucket")
+    stmt = (
+        select(
+            bucket,
+            Receipt.direction,
+            func.count(),
+            func.coalesce(func.sum(Receipt.net_amount), 0),
+            func.coalesce(func.sum(Receipt.tax_amount), 0),
+            func.coalesce(func.sum(Receipt.gross_amount), 0),
+        )
+        .where(
+            Receipt.customer_id == customer_id,
+            Receipt.date >= previous_start,
+            Receipt.date <= current_end,
+            Receipt.duplicate_of_id.is_(None),
+        )
+        .group_by(bucket, Receipt.direction)
+    )
+    periods = {
+        "current": f"{year:04d}-{month:02d}",
+        "previous": f"{prev_year:04d}-{prev_month:02d}",
+    }
+    totals = {
+        name: {"period": period, OUTGOING: _direction_totals(), INCOMING: _direction_totals()}
+        for name, period in periods.items()
+    }
+    for name, direction, count, net, tax, gross in db.execute(stmt):
+        totals[name][INCOMING if direction == INCOMING else OUTGOING] = {
+            "count": count,
+            "net_sum": Decimal(net).quantize(ZERO),
+            "tax_sum": Decimal(tax).quantize(ZERO),
+            "gross_sum": Decimal(gross).quantize(ZERO),
+        }
+    for entry in totals.values():
+        entry["zahllast"] = entry[OUTGOING]["tax_sum"] - entry[INCOMING]["tax_sum"]
+    return totals
+
+
+def ustva_status(db: Session, customer_id: int, year: int, month: int, periods: int) -> List[Dict[str, Any]]:
+    """Return one status row per month, newest first, for the last ``periods`` months."""
+    names = [
+        "%04d-%02d" % _shift_month(year, month, -offset) for offset in range(periods)
+    ]
+    stmt = (
+        select(Ustva.period, func.max(Ustva.generated_at), func.max(Ustva.tax_sum), func.max(Ustva.zahllast))
+        .where(Ustva.customer_id == customer_id, Ustva.period.in_(names))
+        .group_by(Ustva.period)
+    )
+    found = {period: values for period, *values in db.execute(stmt)}
+    rows = []
+    for name in names:
+        generated_at, tax_sum, zahllast = found.get(name, (None, None, None))
+        rows.append(
+            {
+                "period": name,
+                "generated": generated_at is not None,
+                "generated_at": generated_at,
+                "tax_sum": tax_sum,
+                "zahllast": zahllast,
+            }
+        )
+    return rows
+
+
+def open_item_summary(db: Session, customer_id: int, today: date) -> Dict[str, Dict[str, Any]]:
+    """Count and sum open items by status (``open``, ``overdue``, ``paid``)."""
+    status = case(
+        (OpenItem.paid.is_(True), "paid"),
+        (OpenItem.due_date < today, "overdue"),
+        else_="open",
+    ).label("status")
+    stmt = (
+        select(status, func.count(), func.coalesce(func.sum(OpenItem.amount), 0))
+        .where(OpenItem.customer_id == customer_id)
+        .group_by(status)
+    )
+    summary = {name: {"count": 0, "amount": ZERO} for name in ("open", "overdue", "paid")}
+    for name, count, amount in db.execute(stmt):
+        summary[name] = {"count": count, "amount": Decimal(amount).quantize(ZERO)}
+    return summary
+
+
+def _load(customer_id: int, year: int, month: int, receipts_limit: int, periods: int, today: date):
+    db = SessionLocal()
+    try:
+        if not customer_exists(db, customer_id):
+            return None
+        result = {
+            "customer_id": customer_id,
+            "latest_receipts": latest_receipts(db, customer_id, receipts_limit),
+            "totals": period_totals(db, customer_id, year, month),
+            "ustva": ustva_status(db, customer_id, year, month, periods),
+            "open_items": open_item_summary(db, customer_id, today),
+        }
+        # detach loaded receipts so they can be serialised after the session closes
+        db.expunge_all()
+        return result
+    finally:
+        db.close()
+
+
+async def load_dashboard(
+    customer_id: int,
+    year: int,
+    month: int,
+    receipts_limit: int = 10,
+    periods: int = 6,
+    today: date | None = None,
+) -> Optional[Dict[str, Any]]:
+    """Run all dashboard queries on one connection and assemble the response.
+
+    Returns ``None`` when the customer does not exist.
+    """
+    today = today or date.today()
+    return await run_in_threadpool(_load, customer_id, year, month, receipts_limit, periods, today)
@@ -9,7 +9,7 @@ stoppt das Programm mit einer klaren Fehlermeldung.
 """
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # --------------------------------------------------------------------
@@ -32,6 +32,14 @@ engine = create_engine(
     future=True,
 )
 
+if engine.dialect.name == "sqlite":
+    # SQLite wertet ON DELETE CASCADE / SET NULL nur mit diesem Pragma aus
+    @event.listens_for(engine, "connect")
+    def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
 # --------------------------------------------------------------------
 # 3. Configure SessionFactory
 # --------------------------------------------------------------------
@@ -0,0 +1,262 @@
+"""Near-duplicate detection for receipts.
+
+The same invoice often arrives twice as different files (scan and
+original, re-export), so the content hash alone does not catch it and
+the copy would be counted twice in the UStVA.  Every new receipt is
+therefore compared with a small candidate set taken from a blocking
+index instead of with the whole history:
+
+* receipts of the same customer with the same gross amount dated
+  within ``DUPLICATE_WINDOW_DAYS`` (default 3) days – an index range
+  scan on ``ix_receipts_customer_gross_date``;
+* receipts of the same customer with the identical file
+  (``content_hash``).
+
+Candidates are scored cheaply from the date distance, the overlap of
+the normalized supplier tokens and the VAT split; identical files score
+1.0.  A score of at least ``DUPLICATE_THRESHOLD`` (default
+0.8) counts as duplicate.  What happens then is decided by
+``DUPLICATE_POLICY`` (or the ``on_duplicate`` parameter of the upload):
+
+``flag``  store the receipt and mark it (``duplicate_of_id``)
+``hold``  reject the upload with ``409`` until it is re-sent with ``force``
+``off``   no check
+
+A flagged receipt is left out of the UStVA, the analytics and the
+dashboard totals.  ``POST /receipts/{id}/duplicate/resolve`` clears the
+flag if it is not a duplicate after all and records that decision
+(``duplicate_resolved_at``), so neither the upload check nor
+:func:`scan_customer` flags the receipt again; a confirmed duplicate
+simply stays flagged.
+
+:func:`scan_customer` finds duplicates in a customer's existing
+receipts in one pass over the same index order.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Deque, Dict, FrozenSet, List, Optional
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from .models import Receipt
+
+WINDOW_DAYS = int(os.getenv("DUPLICATE_WINDOW_DAYS", "3"))
+THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))
+POLICY = os.getenv("DUPLICATE_POLICY", "flag")
+POLICIES = ("flag", "hold", "off")
+MAX_CANDIDATES = 20
+
+SUPPLIER_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# legal forms and filler words carry no information about the supplier
+SUPPLIER_STOPWORDS = {
+    "gmbh", "mbh", "ag", "kg", "ohg", "ug", "gbr", "ek", "e", "k", "co", "und", "the",
+    "ltd", "inc", "llc", "se", "haftungsbeschrankt", "rechnung", "invoice",
+}
+
+
+def supplier_tokens(name: Optional[str]) -> FrozenSet[str]:
+    """Lower-case ASCII tokens of a supplier name without legal forms."""
+    if not name:
+        return frozenset()
+    folded = unicodedata.normalize("NFKD", name.lower().replace("ß", "ss"))
+    folded = folded.encode("ascii", "ignore").decode("ascii")
+    return frozenset(t for t in SUPPLIER_TOKEN_RE.findall(folded) if t not in SUPPLIER_STOPWORDS)
+
+
+@dataclass
+class Fingerprint:
+    """The fields of a receipt that take part in the comparison."""
+
+    id: Optional[int]
+    content_hash: Optional[str]
+    date: Optional[date]
+    gross_amount: Optional[Decimal]
+    net_amount: Optional[Decimal]
+    tax_amount: Optional[Decimal]
+    tokens: FrozenSet[str]
+    # confirmed as "not a duplicate", never flagged again
+    resolved: bool = False
+
+    @classmethod
+    def of(cls, receipt: Any) -> "Fingerprint":
+        return cls(
+            getattr(receipt, "id", None),
+            receipt.content_hash,
+            receipt.date,
+            receipt.gross_amount,
+            receipt.net_amount,
+            receipt.tax_amount,
+            supplier_tokens(receipt.supplier),
+            getattr(receipt, "duplicate_resolved_at", None) is not None,
+        )
+
+
+def score(new: Fingerprint, old: Fingerprint, window_days: int = WINDOW_DAYS) -> float:
+    """Similarity in ``[0, 1]`` of two receipts of the same customer."""
+    if new.content_hash and new.content_hash == old.content_hash:
+        return 1.0
+    if new.gross_amount is None or new.gross_amount != old.gross_amount:
+        return 0.0
+    if new.date is None or old.date is None:
+        return 0.0
+    days = abs((new.date - old.date).days)
+    if days > window_days:
+        return 0.0
+    # same gross amount and date window: the blocking key itself
+    value = 0.4 + 0.2 * (1 - days / (window_days + 1))
+    if new.tokens and old.tokens:
+        value += 0.4 * len(new.tokens & old.tokens) / len(new.tokens | old.tokens)
+    if new.tax_amount is not None and old.tax_amount is not None and new.tax_amount != old.tax_amount:
+        # same gross but a different VAT split is a different invoice
+        value -= 0.2
+    return round(max(min(value, 1.0), 0.0), 3)
+
+
+def find_duplicates(
+    db: Session,
+    customer_id: int,
+    fingerprint: Fingerprint,
+    threshold: float = THRESHOLD,
+    window_days: int = WINDOW_DAYS,
+) -> List[Dict[str, Any]]:
+    """Return stored receipts that look like ``fingerprint``, best first."""
+    if fingerprint.resolved:
+        return []
+    blocks = []
+    if fingerprint.content_hash:
+        blocks.append(Receipt.content_hash == fingerprint.content_hash)
+    if fingerprint.gross_amount is not None and fingerprint.date is not None:
+        window = timedelta(days=window_days)
+        blocks.append(
+            (Receipt.gross_amount == fingerprint.gross_amount)
+            & (Receipt.date >= fingerprint.date - window)
+            & (Receipt.date <= fingerprint.date + window)
+        )
+    if not blocks:
+        return []
+    stmt = (
+        select(Receipt)
+        .where(Receipt.customer_id == customer_id, or_(*blocks))
+        .limit(MAX_CANDIDATES)
+    )
+    if fingerprint.id is not None:
+        stmt = stmt.where(Receipt.id != fingerprint.id)
+    matches = []
+    for candidate in db.scalars(stmt):
+        value = score(fingerprint, Fingerprint.of(candidate), window_days)
+        if value >= threshold:
+            matches.append(
+                {
+                    "id": candidate.id,
+                    "score": value,
+                    "date": candidate.date,
+                    "supplier": candidate.supplier,
+                    "gross_amount": candidate.gross_amount,
+                }
+            )
+    matches.sort(key=lambda m: (-m["score"], m["id"]))
+    return matches
+
+
+def scan_customer(
+    db: Session,
+    customer_id: int,
+    apply: bool = False,
+    threshold: float = THRESHOLD,
+    window_days: int = WINDOW_DAYS,
+) -> Dict[str, Any]:
+    """Find duplicates among all receipts of one customer.
+
+    Receipts are streamed ordered by ``(gross_amount, date)`` – the order
+    of the blocking index – and each one is compared with the receipts
+    of the same amount in a sliding window of ``window_days``.  Exact
+    file copies are matched through a hash map.  The later receipt (by
+    id) of a pair is reported as duplicate of the earlier one; with
+    ``apply`` it is flagged in the database.  Receipts resolved as "not
+    a duplicate" are never reported as copies.
+    """
+    stmt = (
+        select(
+            Receipt.id,
+            Receipt.content_hash,
+            Receipt.date,
+            Receipt.gross_amount,
+            Receipt.net_amount,
+            Receipt.tax_amount,
+            Receipt.supplier,
+            Receipt.duplicate_resolved_at,
+        )
+        .where(Receipt.customer_id == customer_id)
+        .order_by(Receipt.gross_amount, Receipt.date, Receipt.id)
+        .execution_options(yield_per=2000)
+    )
+    best: Dict[int, tuple[float, int]] = {}
+    by_hash: Dict[str, Fingerprint] = {}
+    window: Deque[Fingerprint] = deque()
+    scanned = 0
+
+    def pair(a: Fingerprint, b: Fingerprint, value: float) -> None:
+        original, copy = (a, b) if a.id < b.id else (b, a)
+        if copy.resolved:
+            return
+        if value > best.get(copy.id, (0.0, 0))[0]:
+            best[copy.id] = (value, original.id)
+
+    for row in db.execute(stmt):
+        scanned += 1
+        current = Fingerprint(
+            row.id, row.content_hash, row.date, row.gross_amount, row.net_amount, row.tax_amount,
+            supplier_tokens(row.supplier), row.duplicate_resolved_at is not None,
+        )
+        if current.content_hash:
+            previous = by_hash.setdefault(current.content_hash, current)
+            if previous is not current:
+                pair(previous, current, 1.0)
+        while window and (
+            window[0].gross_amount != current.gross_amount
+            or current.date is None
+            or window[0].date is None
+            or (current.date - window[0].date).days > window_days
+        ):
+            window.popleft()
+        for other in window:
+            value = score(current, other, window_days)
+            if value >= threshold:
+                pair(other, current, value)
+        if current.gross_amount is not None and current.date is not None:
+            window.append(current)
+
+    duplicates = [
+        {"id": copy_id, "duplicate_of_id": original_id, "score": value}
+        for copy_id, (value, original_id) in sorted(best.items())
+    ]
+    if apply and duplicates:
+        db.execute(
+            update(Receipt),
+            [
+                {"id": d["id"], "duplicate_of_id": d["duplicate_of_id"], "duplicate_score": d["score"]}
+                for d in duplicates
+            ],
+        )
+        db.commit()
+    return {"customer_id": customer_id, "scanned": scanned, "applied": apply, "duplicates": duplicates}
+
+
+__all__ = [
+    "POLICIES",
+    "POLICY",
+    "Fingerprint",
+    "find_duplicates",
+    "scan_customer",
+    "score",
+    "supplier_tokens",
+]
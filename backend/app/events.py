@@ -0,0 +1,277 @@
+"""Live events for the dashboard (Server-Sent Events).
+
+Endpoints publish small events whenever a receipt is stored, a UStVA is
+generated or an open item changes.  :class:`EventBroker` fans them out
+to the SSE connections of the affected customer inside the worker
+process.  Every subscriber is just an ``asyncio.Queue`` and a suspended
+generator, so a single worker can hold thousands of idle connections.
+
+Each event carries a numeric id.  The broker keeps the last
+``EVENTS_HISTORY`` events per customer so that a client reconnecting
+with ``Last-Event-ID`` receives what it missed.  Slow subscribers whose
+queue overflows are disconnected and resume the same way.
+
+With several uvicorn workers each process has its own broker.  Setting
+``EVENTS_PG_BRIDGE=1`` on PostgreSQL routes all events through
+``NOTIFY``/``LISTEN`` (:class:`PostgresBridge`), so every worker sees
+every event.  Without the bridge events are dispatched locally.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+HISTORY_SIZE = int(os.getenv("EVENTS_HISTORY", "100"))
+QUEUE_SIZE = 256
+MAX_TRACKED_CUSTOMERS = 10000
+PG_CHANNEL = "accounting_events"
+# reconnect delay suggested to EventSource clients
+RETRY_FRAME = b"retry: 3000\n\n"
+
+
+@dataclass
+class Event:
+    id: int
+    customer_id: int
+    type: str
+    data: Dict[str, Any] = field(default_factory=dict)
+
+    def encode(self) -> bytes:
+        payload = json.dumps(self.data, default=str, separators=(",", ":"))
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n".encode("utf-8")
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"id": self.id, "customer_id": self.customer_id, "type": self.type, "data": self.data},
+            default=str,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_json(cls, payload: str) -> "Event":
+        raw = json.loads(payload)
+        return cls(id=raw["id"], customer_id=raw["customer_id"], type=raw["type"], data=raw["data"])
+
+
+_CLOSED = object()
+
+
+class EventBroker:
+    """In-process publish/subscribe hub keyed by customer."""
+
+    def __init__(self, history_size: int = HISTORY_SIZE, queue_size: int = QUEUE_SIZE) -> None:
+        self.history_size = history_size
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._history: "OrderedDict[int, Deque[Event]]" = OrderedDict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._bridge: Optional["PostgresBridge"] = None
+        self._notifier: Optional[ThreadPoolExecutor] = None
+        self._id_lock = threading.Lock()
+        self._last_id = 0
+
+    # -- lifecycle -------------------------------------------------------
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def attach_bridge(self, bridge: "PostgresBridge") -> None:
+        self._notifier = ThreadPoolExecutor(max_workers=1, thread_name_prefix="events-notify")
+        self._bridge = bridge
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    # -- publishing ------------------------------------------------------
+    def _next_id(self) -> int:
+        # microsecond timestamps keep ids roughly ordered across workers
+        with self._id_lock:
+            self._last_id = max(self._last_id + 1, time.time_ns() // 1000)
+            return self._last_id
+
+    def publish(self, customer_id: int, type: str, data: Optional[Dict[str, Any]] = None) -> None:
+        """Publish an event; safe to call from any thread.
+
+        Failures are logged and never propagate into the caller, so a
+        broken event channel cannot fail a business request.
+        """
+        event = Event(id=self._next_id(), customer_id=customer_id, type=type, data=data or {})
+        try:
+            if self._bridge is not None:
+                # NOTIFY is a database round-trip; never block the caller
+                # (possibly the event loop) on it.  One thread keeps the order.
+                self._notifier.submit(self._notify, event)
+            else:
+                self.dispatch_threadsafe(event)
+        except Exception as exc:
+            logging.warning("Event %s für Kunde %s konnte nicht veröffentlicht werden: %s", type, customer_id, exc)
+
+    def _notify(self, event: Event) -> None:
+        try:
+            self._bridge.notify(event)
+        except Exception as exc:
+            logging.warning(
+                "Event %s für Kunde %s konnte nicht veröffentlicht werden: %s", event.type, event.customer_id, exc
+            )
+
+    def dispatch_threadsafe(self, event: Event) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event: Event) -> None:
+        history = self._history.get(event.customer_id)
+        if history is None:
+            history = self._history[event.customer_id] = deque(maxlen=self.history_size)
+            if len(self._history) > MAX_TRACKED_CUSTOMERS:
+                self._history.popitem(last=False)
+        else:
+            self._history.move_to_end(event.customer_id)
+        history.append(event)
+        for queue in list(self._subscribers.get(event.customer_id, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # too slow: disconnect, the client resumes via Last-Event-ID
+                self._unsubscribe(event.customer_id, queue)
+                queue.get_nowait()
+                queue.put_nowait(_CLOSED)
+
+    # -- subscribing -----------------------------------------------------
+    def _unsubscribe(self, customer_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(customer_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[customer_id]
+
+    async def stream(
+        self,
+        customer_id: int,
+        last_event_id: Optional[int] = None,
+        heartbeat: float = HEARTBEAT_SECONDS,
+    ) -> AsyncIterator[bytes]:
+        """Yield encoded SSE frames for one customer until the client leaves."""
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(customer_id, set()).add(queue)
+        try:
+            yield RETRY_FRAME
+            if last_event_id is not None:
+                for event in list(self._history.get(customer_id, ())):
+                    if event.id > last_event_id:
+                        yield event.encode()
+                        # events published since subscribing are also queued
+                        last_event_id = event.id
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": heartbeat\n\n"
+                    continue
+                if event is _CLOSED:
+                    return
+                if last_event_id is not None and event.id <= last_event_id:
+                    continue
+                yield event.encode()
+        finally:
+            self._unsubscribe(customer_id, queue)
+
+
+class PostgresBridge:
+    """Relay events between workers through PostgreSQL ``NOTIFY``/``LISTEN``.
+
+    Publishing sends ``pg_notify`` on a pooled connection from one
+    background thread of the broker; a daemon
+    thread keeps one dedicated connection in ``LISTEN`` mode and hands
+    incoming notifications to the local broker.  Payloads are limited to
+    8000 bytes by PostgreSQL, so events should stay small.
+    """
+
+    def __init__(self, engine: Engine, broker: EventBroker, channel: str = PG_CHANNEL) -> None:
+        self.engine = engine
+        self.broker = broker
+        self.channel = channel
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def notify(self, event: Event) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": event.to_json()})
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="events-pg-listen", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._listen()
+                backoff = 1.0
+            except Exception as exc:
+                logging.warning("LISTEN-Verbindung verloren (%s); neuer Versuch in %.0fs", exc, backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def _listen(self) -> None:
+        raw = self.engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+            while not self._stop.is_set():
+                if select.select([conn], [], [], 5.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notification = conn.notifies.pop(0)
+                    try:
+                        self.broker.dispatch_threadsafe(Event.from_json(notification.payload))
+                    except (ValueError, KeyError) as exc:
+                        logging.warning("Ungültige Event-Nachricht verworfen: %s", exc)
+        finally:
+            raw.invalidate()
+
+
+broker = EventBroker()
+_bridge: Optional[PostgresBridge] = None
+
+
+def start_events(engine: Engine) -> None:
+    """Bind the broker to the running loop and start the optional bridge."""
+    global _bridge
+    broker.bind(asyncio.get_running_loop())
+    if os.getenv("EVENTS_PG_BRIDGE", "0") == "1" and engine.dialect.name == "postgresql":
+        _bridge = PostgresBridge(engine, broker)
+        broker.attach_bridge(_bridge)
+        _bridge.start()
+        logging.info("Event-Bridge über PostgreSQL LISTEN/NOTIFY gestartet")
+
+
+def stop_events() -> None:
+    if _bridge is not None:
+        _bridge.stop()
+    if broker._notifier is not None:
+        broker._notifier.shutdown(wait=True)
+
+
+__all__ = ["Event", "EventBroker", "PostgresBridge", "broker", "start_events", "stop_events"]
@@ -4,8 +4,11 @@ backend/app/main.py
 
 FastAPI‑Anwendung inkl.:
 * CORS‑Middleware für Frontend bei Render + lokales Dev‑Frontend
-* Datenbanktabellen anlegen (SQLAlchemy)
+* Datenbanktabellen anlegen und bestehende Tabellen aktualisieren (app/migrations.py)
 * APScheduler‑Startup
+* Event‑Broker für Server‑Sent Events
+* Hintergrund‑Bereinigung der Dateien gelöschter Kunden
+* optionales Request‑Profiling (PROFILING_TOKEN)
 * API‑Router einbinden
 """
 
@@ -15,7 +18,12 @@ from fastapi.middleware.cors import CORSMiddleware
 
 # -------------------------- Datenbank --------------------------
 from .database import Base, engine
-Base.metadata.create_all(bind=engine)  # produktiv via Alembic migrieren
+from . import models  # noqa: F401  (Modelle registrieren, bevor Tabellen angelegt werden)
+Base.metadata.create_all(bind=engine)  # legt nur fehlende Tabellen an
+from .migrations import upgrade_schema  # noqa: E402
+upgrade_schema(engine)  # fehlende Spalten/Indizes bestehender Tabellen ergänzen
+from .search import setup_search  # noqa: E402
+setup_search(engine)  # Volltextindex (tsvector/pg_trgm bzw. SQLite FTS5)
 
 # -------------------------- FastAPI ----------------------------
 app = FastAPI(
@@ -23,6 +31,10 @@ app = FastAPI(
     version="0.1.0",
 )
 
+# -------------------------- Profiling --------------------------
+from .profiling import setup_profiling  # noqa: E402
+setup_profiling(app, engine)  # nur aktiv, wenn PROFILING_TOKEN gesetzt ist
+
 # -------------------------- CORS -------------------------------
 origins = [
     "https://acct-frontend.onrender.com",  # Render-Frontend
@@ -54,4 +66,26 @@ async def start_scheduler() -> None:
 async def shutdown_scheduler() -> None:
     if scheduler.running:
         scheduler.shutdown()
-        logging.info("Scheduler gestoppt")
\ No newline at end of file
+        logging.info("Scheduler gestoppt")
+
+# -------------------------- Live-Events ------------------------
+from .events import start_events, stop_events  # noqa: E402
+
+@app.on_event("startup")
+async def start_event_broker() -> None:
+    start_events(engine)
+
+@app.on_event("shutdown")
+async def stop_event_broker() -> None:
+    stop_events()
+
+# -------------------------- Dateibereinigung -------------------
+from .offboarding import cleanup_worker  # noqa: E402
+
+@app.on_event("startup")
+async def start_file_cleanup() -> None:
+    cleanup_worker.start()
+
+@app.on_event("shutdown")
+async def stop_file_cleanup() -> None:
+    cleanup_worker.stop()
@@ -0,0 +1,159 @@
+"""Idempotent schema upgrade for existing databases.
+
+``Base.metadata.create_all`` only creates missing *tables*; it never
+changes a table that already exists.  Databases created by an earlier
+version therefore lack the columns and indexes added since then, and
+the first query touching them fails.  :func:`upgrade_schema` closes
+that gap and runs at startup right after ``create_all``::
+
+    python -m app.migrations   # same step, e.g. as a release command
+
+For every mapped table it
+
+* adds missing columns (``ALTER TABLE … ADD COLUMN``) including their
+  server default, so NOT NULL columns such as ``receipts.direction`` are
+  filled for existing rows (all existing receipts become ``outgoing``;
+  incoming invoices have to be corrected by hand or re-uploaded),
+* backfills ``receipts.tax_rate`` from ``tax_amount / net_amount`` in
+  the run that adds the column,
+* creates missing indexes,
+* on PostgreSQL replaces foreign keys whose ``ON DELETE`` action differs
+  from the model (e.g. ``receipts.customer_id`` created before it got
+  ``ON DELETE CASCADE``).  SQLite cannot alter a constraint; there a
+  warning names the table, which has to be rebuilt by hand.  The
+  application does not depend on the cascades (offboarding deletes
+  child rows itself), they only keep manual deletes consistent.
+
+Every step checks the live schema first, so running it again is a
+no-op.  On PostgreSQL the whole upgrade holds an advisory lock, so
+several workers starting at once do not race each other.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import List, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import Column, CreateColumn
+
+from .database import Base
+from .ocr import TAX_RATE_BANDS
+
+# arbitrary constant shared by all workers (pg_advisory_xact_lock key)
+ADVISORY_LOCK_ID = 720_150_027
+
+
+def _add_column_ddl(conn: Connection, column: Column) -> str:
+    ddl = str(CreateColumn(column).compile(dialect=conn.dialect))
+    if not column.nullable and column.server_default is None:
+        raise RuntimeError(
+            f"Spalte {column.table.name}.{column.name} ist NOT NULL ohne server_default "
+            "und kann nicht automatisch ergänzt werden"
+        )
+    for fk in column.foreign_keys:
+        target = fk.column
+        ddl += f" REFERENCES {target.table.name} ({target.name})"
+        if fk.ondelete:
+            ddl += f" ON DELETE {fk.ondelete}"
+    return f"ALTER TABLE {column.table.name} ADD COLUMN {ddl}"
+
+
+def _backfill_tax_rate(conn: Connection) -> None:
+    # same classification as app.ocr: tax / net in whole percent, mapped to 19/7
+    rounded = "CAST(ROUND(tax_amount * 100 / net_amount) AS INTEGER)"
+    bands = " ".join(
+        f"WHEN {rounded} BETWEEN {low} AND {high} THEN {rate}" for low, high, rate in TAX_RATE_BANDS
+    )
+    conn.execute(
+        text(
+            f"UPDATE receipts SET tax_rate = CASE {bands} ELSE {rounded} END "
+            "WHERE tax_rate IS NULL AND tax_amount IS NOT NULL AND net_amount IS NOT NULL AND net_amount <> 0"
+        )
+    )
+
+
+BACKFILLS = {("receipts", "tax_rate"): _backfill_tax_rate}
+
+
+def _ondelete(action: Optional[str]) -> str:
+    return (action or "NO ACTION").upper()
+
+
+def _foreign_key_steps(conn: Connection, inspector, table) -> List[str]:
+    """DDL replacing foreign keys whose ON DELETE action differs from the model."""
+    live = {tuple(fk["constrained_columns"]): fk for fk in inspector.get_foreign_keys(table.name)}
+    steps: List[str] = []
+    for constraint in table.foreign_key_constraints:
+        current = live.get(tuple(constraint.column_keys))
+        if current is None or _ondelete(current["options"].get("ondelete")) == _ondelete(constraint.ondelete):
+            continue
+        if conn.dialect.name != "postgresql" or not current.get("name"):
+            logging.warning(
+                "Schema-Upgrade: Fremdschlüssel %s(%s) hat ON DELETE %s statt %s; "
+                "die Tabelle muss neu aufgebaut werden",
+                table.name,
+                ", ".join(constraint.column_keys),
+                _ondelete(current["options"].get("ondelete")),
+                _ondelete(constraint.ondelete),
+            )
+            continue
+        name = current["name"]
+        steps.append(
+            f"ALTER TABLE {table.name} DROP CONSTRAINT {name}, "
+            f"ADD CONSTRAINT {name} FOREIGN KEY ({', '.join(constraint.column_keys)}) "
+            f"REFERENCES {constraint.referred_table.name} ({', '.join(e.column.name for e in constraint.elements)}) "
+            f"ON DELETE {_ondelete(constraint.ondelete)}"
+        )
+    return steps
+
+
+def upgrade_schema(engine: Engine, conn: Optional[Connection] = None) -> List[str]:
+    """Bring existing tables up to the models; returns the executed steps."""
+    if conn is None:
+        with engine.begin() as conn:
+            return upgrade_schema(engine, conn)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+    inspector = inspect(conn)
+    steps: List[str] = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = _add_column_ddl(conn, column)
+            conn.execute(text(ddl))
+            steps.append(ddl)
+            backfill = BACKFILLS.get((table.name, column.name))
+            if backfill is not None:
+                backfill(conn)
+                steps.append(f"backfill {table.name}.{column.name}")
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(conn)
+                steps.append(f"CREATE INDEX {index.name}")
+        for ddl in _foreign_key_steps(conn, inspector, table):
+            conn.execute(text(ddl))
+            steps.append(ddl)
+    for step in steps:
+        logging.info("Schema-Upgrade: %s", step)
+    return steps
+
+
+def main() -> None:
+    from .database import engine
+    from . import models  # noqa: F401  (Modelle registrieren)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    Base.metadata.create_all(bind=engine)
+    steps = upgrade_schema(engine)
+    print(f"{len(steps)} Schritte ausgeführt")
+
+
+if __name__ == "__main__":
+    main()
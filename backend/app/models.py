@@ -7,8 +7,8 @@ Default‑Werte und Constraints ergänzt werden.
 """
 
 from datetime import date, datetime
-from sqlalchemy import Column, Integer, String, Date, DateTime, Numeric, Boolean, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Numeric, Boolean, ForeignKey, Index
+from sqlalchemy.orm import deferred, relationship
 
 from .database import Base
 
@@ -19,47 +19,93 @@ class Customer(Base):
     name = Column(String(255), nullable=False)
     email = Column(String(255), nullable=False, unique=True)
     vat_id = Column(String(50), nullable=True)  # USt‑ID
+    # gesetzt, sobald die Löschung begonnen hat (siehe app/offboarding.py)
+    offboarding_started_at = Column(DateTime, nullable=True)
 
-    receipts = relationship("Receipt", back_populates="customer", cascade="all, delete-orphan")
-    ustva = relationship("Ustva", back_populates="customer", cascade="all, delete-orphan")
-    open_items = relationship("OpenItem", back_populates="customer", cascade="all, delete-orphan")
+    # Kindzeilen löscht die Datenbank (ON DELETE CASCADE); passive_deletes
+    # verhindert, dass SQLAlchemy sie vorher alle lädt
+    receipts = relationship("Receipt", back_populates="customer", cascade="all, delete-orphan", passive_deletes=True)
+    ustva = relationship("Ustva", back_populates="customer", cascade="all, delete-orphan", passive_deletes=True)
+    open_items = relationship("OpenItem", back_populates="customer", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Receipt(Base):
     __tablename__ = "receipts"
     id = Column(Integer, primary_key=True, index=True)
-    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
-    file_path = Column(String(512), nullable=False)  # Pfad in S3/Storage
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False)
+    file_path = Column(String(512), nullable=False)  # Storage-URI, siehe app/storage.py
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 der Datei
     date = Column(Date, nullable=True)
     net_amount = Column(Numeric(10, 2), nullable=True)
     tax_amount = Column(Numeric(10, 2), nullable=True)
     gross_amount = Column(Numeric(10, 2), nullable=True)
     supplier = Column(String(255), nullable=True)
+    tax_rate = Column(Integer, nullable=True)  # Steuersatz in Prozent (19, 7, …)
+    # "outgoing" = Ausgangsrechnung (Umsatzsteuer), "incoming" = Eingangsrechnung (Vorsteuer)
+    direction = Column(String(8), nullable=False, default="outgoing", server_default="outgoing")
+    # normalisierter OCR‑Text für die Volltextsuche; nur bei Bedarf laden
+    text_content = deferred(Column(Text, nullable=True))
+    parser_version = Column(Integer, nullable=True)  # ocr.PARSER_VERSION beim letzten Parsen
+    # Verdacht auf Mehrfacherfassung, siehe app/dedup.py
+    duplicate_of_id = Column(Integer, ForeignKey("receipts.id", ondelete="SET NULL"), nullable=True)
+    duplicate_score = Column(Numeric(4, 3), nullable=True)
+    # als "kein Duplikat" bestätigt; Prüfungen markieren den Beleg nicht erneut
+    duplicate_resolved_at = Column(DateTime, nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     customer = relationship("Customer", back_populates="receipts")
 
+    __table_args__ = (
+        Index("ix_receipts_customer_date", "customer_id", "date"),
+        Index("ix_receipts_customer_id_id", "customer_id", "id"),
+        # Blocking-Index der Duplikaterkennung
+        Index("ix_receipts_customer_gross_date", "customer_id", "gross_amount", "date"),
+        # ON DELETE SET NULL von duplicate_of_id ohne Tabellenscan je gelöschtem Beleg
+        Index("ix_receipts_duplicate_of_id", "duplicate_of_id"),
+    )
+
 
 class Ustva(Base):
     __tablename__ = "ustva"
     id = Column(Integer, primary_key=True, index=True)
-    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False)
     period = Column(String(7), nullable=False)  # Format: YYYY-MM
+    # Summen über alle Belege des Monats (beide Richtungen)
     net_sum = Column(Numeric(12, 2), nullable=False)
     tax_sum = Column(Numeric(12, 2), nullable=False)
     gross_sum = Column(Numeric(12, 2), nullable=False)
+    # Werte der Voranmeldung wie /ustva/calc; NULL bei älteren Einträgen
+    umsatzsteuer = Column(Numeric(12, 2), nullable=True)
+    vorsteuer = Column(Numeric(12, 2), nullable=True)  # Kz 66
+    zahllast = Column(Numeric(12, 2), nullable=True)  # Kz 83
     generated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     customer = relationship("Customer", back_populates="ustva")
 
+    __table_args__ = (Index("ix_ustva_customer_period", "customer_id", "period"),)
+
 
 class OpenItem(Base):
     __tablename__ = "open_items"
     id = Column(Integer, primary_key=True, index=True)
-    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False)
     description = Column(String(255), nullable=False)
     amount = Column(Numeric(10, 2), nullable=False)
     due_date = Column(Date, nullable=False)
     paid = Column(Boolean, default=False, nullable=False)
 
-    customer = relationship("Customer", back_populates="open_items")
\ No newline at end of file
+    customer = relationship("Customer", back_populates="open_items")
+
+    __table_args__ = (Index("ix_open_items_customer_paid_due", "customer_id", "paid", "due_date"),)
+
+class FileCleanup(Base):
+    """Warteschlange der Dateien gelöschter Belege (siehe app/offboarding.py)."""
+
+    __tablename__ = "file_cleanup"
+    id = Column(Integer, primary_key=True)
+    file_path = Column(String(512), nullable=False)  # Storage-URI
+    content_hash = Column(String(64), nullable=True)
+    enqueued_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (Index("ix_file_cleanup_enqueued", "enqueued_at"),)
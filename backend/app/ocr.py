@@ -14,6 +14,8 @@ VAT pre‑declaration:
 * ``brutto``       – the gross amount (Decimal)
 * ``steuersatz``   – the VAT rate in percent (int), ``None`` when
   the rate cannot be determined
+* ``text``         – the normalized extracted text (see
+  :func:`normalize_text`), used for full-text search
 
 The parsing strategy is intentionally simple and relies on regular
 expressions to find dates and monetary amounts.  For production
@@ -24,6 +26,8 @@ tax rates.【866104154231912†L300-L304】【946044698870348†L60-L110】
 
 import logging
 import re
+import unicodedata
+from datetime import datetime
 from decimal import Decimal, InvalidOperation
 from pathlib import Path
 from typing import Optional, Dict, Any
@@ -52,6 +56,34 @@ except ImportError:
 DATE_RE = re.compile(r"(\d{2}\.\d{2}\.\d{4})")
 # Regular expression for monetary amounts (e.g. 1.234,56)
 AMOUNT_RE = re.compile(r"([0-9]+(?:\.[0-9]{3})*,[0-9]{2})")
+# rounded tax/net percentages attributed to the German VAT rates; cent
+# rounding moves the ratio of small amounts by a point or so
+# (also used by app.migrations for the tax_rate backfill)
+TAX_RATE_BANDS = ((18, 20, 19), (6, 8, 7))
+# pdfplumber emits unmapped glyphs as "(cid:123)"
+CID_RE = re.compile(r"\(cid:\d+\)")
+WHITESPACE_RE = re.compile(r"\s+")
+# Upper bound for the stored text; long documents only need their head for search
+MAX_TEXT_LENGTH = 20000
+
+# Version of the extraction heuristics.  Increase it whenever the regexes
+# or heuristics below or the fields returned by :func:`receipt_fields`
+# change; receipts stored with a lower ``Receipt.parser_version`` are
+# re-parsed by ``python -m app.backfill``.
+# 2: ``tax_rate`` is stored
+PARSER_VERSION = 2
+
+
+def normalize_text(text: str) -> str:
+    """Normalize extracted PDF text for storage and indexing.
+
+    Applies Unicode NFKC normalization (ligatures, full-width forms),
+    drops unmapped glyph markers and collapses all whitespace to single
+    spaces.  The result is truncated to :data:`MAX_TEXT_LENGTH`.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = CID_RE.sub("", text)
+    return WHITESPACE_RE.sub(" ", text).strip()[:MAX_TEXT_LENGTH]
 
 
 def _parse_amount(value: str) -> Optional[Decimal]:
@@ -95,7 +127,7 @@ def parse_receipt_pdf(file_path: str) -> Dict[str, Any]:
         ``tax_amount``, ``gross_amount``, ``supplier``) for backward
         compatibility as well as the extended keys (``invoice_date``,
         ``vendor``, ``netto``, ``umsatzsteuer``, ``brutto``,
-        ``steuersatz``).
+        ``steuersatz``) and the normalized document ``text``.
     """
     path = Path(file_path)
     if not path.exists():
@@ -160,12 +192,7 @@ def parse_receipt_pdf(file_path: str) -> Dict[str, Any]:
             # round to nearest integer percentage
             rounded = int(ratio.quantize(Decimal("1")))
             # classify typical German VAT rates (19 % or 7 %)
-            if 18 <= rounded <= 20:
-                tax_rate = 19
-            elif 6 <= rounded <= 8:
-                tax_rate = 7
-            else:
-                tax_rate = rounded
+            tax_rate = next((rate for low, high, rate in TAX_RATE_BANDS if low <= rounded <= high), rounded)
         except Exception:
             tax_rate = None
 
@@ -183,10 +210,36 @@ def parse_receipt_pdf(file_path: str) -> Dict[str, Any]:
         "umsatzsteuer": tax,
         "brutto": gross,
         "steuersatz": tax_rate,
+        "text": normalize_text(full_text),
     }
 
     # Log if extraction failed for any critical field
     for key in ["invoice_date", "netto", "umsatzsteuer", "brutto"]:
         if result[key] is None:
             logging.warning("OCR parsing could not extract %s from %s", key, file_path)
-    return result
\ No newline at end of file
+    return result
+
+
+def receipt_fields(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    """Map the result of :func:`parse_receipt_pdf` onto ``Receipt`` columns.
+
+    Used by the upload endpoint and by the re-OCR backfill so that both
+    store exactly the same fields, stamped with :data:`PARSER_VERSION`.
+    """
+    receipt_date = None
+    if parsed["date"]:
+        try:
+            receipt_date = datetime.strptime(parsed["date"], "%d.%m.%Y").date()
+        except ValueError:
+            # matches the pattern but is no calendar date (e.g. 31.02.2024)
+            logging.warning("OCR parsing found invalid date %s", parsed["date"])
+    return {
+        "date": receipt_date,
+        "net_amount": parsed["net_amount"],
+        "tax_amount": parsed["tax_amount"],
+        "gross_amount": parsed["gross_amount"],
+        "supplier": parsed["supplier"],
+        "tax_rate": parsed["steuersatz"],
+        "text_content": parsed["text"],
+        "parser_version": PARSER_VERSION,
+    }
@@ -0,0 +1,323 @@
+"""Customer offboarding: delete a customer with all data and files.
+
+Loading a long-standing customer through the ORM cascade would pull
+every receipt, UStVA and open item into memory and hold one long
+transaction over the whole delete.  :func:`offboard_customer` instead
+works in short chunked transactions::
+
+    python -m app.offboarding delete 42
+    python -m app.offboarding drain
+
+1. The customer is marked (``offboarding_started_at``); uploads for it
+   are rejected from then on.
+2. Receipts are deleted ``batch_size`` ids at a time, taken from the
+   ``(customer_id, id)`` index.  In the same transaction as each chunk
+   their storage URIs are written to the ``file_cleanup`` table, so a
+   crash can neither lose a file nor delete one of a surviving receipt.
+3. UStVA rows and open items follow in chunks of the same size.
+4. The customer row itself is deleted last, in one transaction that
+   locks it and first removes anything still left (e.g. a row inserted
+   concurrently), queueing its files like above.  Nothing relies on
+   ``ON DELETE CASCADE``, which databases created before the cascade
+   was added may lack (see :mod:`app.migrations`).
+
+An interrupted run is resumed by calling it again.
+
+Files are removed afterwards by :class:`FileCleanupWorker`, a background
+thread that drains the queue in batches.  Receipt files are
+content-addressed and may be shared with receipts of other customers,
+so a URI is only deleted when no receipt refers to it any more (looked
+up through the ``content_hash`` index).  The references are checked
+again immediately before each delete, and a file written within the
+last ``FILE_CLEANUP_DELAY_SECONDS`` (default 60) is not deleted but
+re-queued: an upload of the same content rewrites the file before it
+commits its receipt, so its fresh modification time protects it.  Only
+an upload writing the file in the moment between this check and the
+delete itself can still lose it.
+Files in the cold archive (``archive://``) cannot be removed from a
+pack individually; their entries are dropped from the queue and the
+pack keeps them until it is retired as a whole.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import delete, insert, or_, select
+from sqlalchemy.orm import Session
+
+from .aging import invalidate_aging
+from .database import SessionLocal
+from .events import broker
+from .models import Customer, FileCleanup, OpenItem, Receipt, Ustva
+from .storage import blob_mtime, delete_blob
+
+BATCH_SIZE = int(os.getenv("OFFBOARDING_BATCH_SIZE", "1000"))
+CLEANUP_BATCH_SIZE = int(os.getenv("FILE_CLEANUP_BATCH_SIZE", "500"))
+CLEANUP_DELAY_SECONDS = float(os.getenv("FILE_CLEANUP_DELAY_SECONDS", "60"))
+CLEANUP_INTERVAL_SECONDS = float(os.getenv("FILE_CLEANUP_INTERVAL_SECONDS", "30"))
+# entries that keep failing (storage unreachable, permissions) are given up
+MAX_ATTEMPTS = 5
+
+
+@dataclass
+class OffboardingReport:
+    customer_id: int
+    receipts: int = 0
+    ustva: int = 0
+    open_items: int = 0
+    files_queued: int = 0
+    transactions: int = 0
+    seconds: float = 0.0
+
+    def as_dict(self) -> Dict[str, object]:
+        return dict(self.__dict__)
+
+
+def _delete_chunked(session: Session, model, customer_id: int, batch_size: int) -> tuple[int, int]:
+    """Delete all rows of ``model`` for a customer; returns (rows, transactions)."""
+    deleted = transactions = 0
+    while True:
+        ids = session.scalars(
+            select(model.id).where(model.customer_id == customer_id).order_by(model.id).limit(batch_size)
+        ).all()
+        if not ids:
+            return deleted, transactions
+        session.execute(delete(model).where(model.id.in_(ids)))
+        session.commit()
+        deleted += len(ids)
+        transactions += 1
+
+
+def _delete_receipts(session: Session, rows) -> int:
+    """Queue the files of ``rows`` and delete the receipts; returns the queued count."""
+    queued: Dict[str, Optional[str]] = {row.file_path: row.content_hash for row in rows}
+    session.execute(
+        insert(FileCleanup),
+        [{"file_path": uri, "content_hash": content_hash} for uri, content_hash in queued.items()],
+    )
+    session.execute(delete(Receipt).where(Receipt.id.in_([row.id for row in rows])))
+    return len(queued)
+
+
+def _receipt_rows(session: Session, customer_id: int, limit: Optional[int] = None):
+    query = (
+        select(Receipt.id, Receipt.file_path, Receipt.content_hash)
+        .where(Receipt.customer_id == customer_id)
+        .order_by(Receipt.id)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return session.execute(query).all()
+
+
+def offboard_customer(customer_id: int, batch_size: int = BATCH_SIZE) -> Optional[OffboardingReport]:
+    """Delete a customer and all of its data in chunked transactions.
+
+    Returns ``None`` if the customer does not exist.  Stored files are
+    only queued; :class:`FileCleanupWorker` removes them.
+    """
+    started = time.monotonic()
+    report = OffboardingReport(customer_id)
+    session = SessionLocal()
+    try:
+        customer = session.get(Customer, customer_id)
+        if customer is None:
+            return None
+        if customer.offboarding_started_at is None:
+            customer.offboarding_started_at = datetime.utcnow()
+            session.commit()
+        while True:
+            rows = _receipt_rows(session, customer_id, batch_size)
+            if not rows:
+                break
+            report.files_queued += _delete_receipts(session, rows)
+            session.commit()
+            report.receipts += len(rows)
+            report.transactions += 1
+        for model, attr in ((Ustva, "ustva"), (OpenItem, "open_items")):
+            deleted, transactions = _delete_chunked(session, model, customer_id, batch_size)
+            setattr(report, attr, deleted)
+            report.transactions += transactions
+        # the row lock makes concurrent inserts of child rows wait and then fail
+        session.execute(select(Customer.id).where(Customer.id == customer_id).with_for_update())
+        rows = _receipt_rows(session, customer_id)
+        if rows:
+            report.files_queued += _delete_receipts(session, rows)
+            report.receipts += len(rows)
+        for model, attr in ((Ustva, "ustva"), (OpenItem, "open_items")):
+            left = session.execute(delete(model).where(model.customer_id == customer_id)).rowcount
+            setattr(report, attr, getattr(report, attr) + left)
+        session.execute(delete(Customer).where(Customer.id == customer_id))
+        session.commit()
+        report.transactions += 1
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    invalidate_aging(customer_id)
+    broker.publish(customer_id, "customer.deleted", {"receipts": report.receipts})
+    cleanup_worker.wake()
+    report.seconds = round(time.monotonic() - started, 3)
+    logging.info(
+        "Kunde %s gelöscht: %d Belege, %d Dateien zur Bereinigung vorgemerkt",
+        customer_id,
+        report.receipts,
+        report.files_queued,
+    )
+    return report
+
+
+# -- file cleanup queue ----------------------------------------------------
+def _still_referenced(session: Session, entries: List[FileCleanup]) -> Set[str]:
+    hashes = {e.content_hash for e in entries if e.content_hash}
+    legacy = {e.file_path for e in entries if not e.content_hash}
+    clauses = []
+    if hashes:
+        clauses.append(Receipt.content_hash.in_(hashes))
+    if legacy:
+        clauses.append(Receipt.file_path.in_(legacy))
+    if not clauses:
+        return set()
+    return set(session.scalars(select(Receipt.file_path).where(or_(*clauses)).distinct()))
+
+
+def _recently_written(uri: str, delay: float) -> bool:
+    try:
+        return time.time() - blob_mtime(uri) < delay
+    except FileNotFoundError:
+        return False
+
+
+def drain_file_cleanup(batch_size: int = CLEANUP_BATCH_SIZE, delay: float = CLEANUP_DELAY_SECONDS) -> Dict[str, int]:
+    """Process queued files until the queue holds no due entries."""
+    stats = {"deleted": 0, "referenced": 0, "archived": 0, "recent": 0, "failed": 0}
+    cutoff = datetime.utcnow() - timedelta(seconds=delay)
+    session = SessionLocal()
+    try:
+        while True:
+            entries = session.scalars(
+                select(FileCleanup)
+                .where(FileCleanup.enqueued_at <= cutoff, FileCleanup.attempts < MAX_ATTEMPTS)
+                .order_by(FileCleanup.id)
+                .limit(batch_size)
+                # several workers share the queue on PostgreSQL; ignored by SQLite
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not entries:
+                break
+            referenced = _still_referenced(session, entries)
+            done: List[int] = []
+            requeued = 0
+            handled: Set[str] = set()
+            for entry in entries:
+                uri = entry.file_path
+                if uri in referenced:
+                    stats["referenced"] += 1
+                elif uri.startswith("archive://"):
+                    stats["archived"] += 1
+                elif uri not in handled:
+                    try:
+                        if _recently_written(uri, delay):
+                            # try again once the grace period has passed
+                            entry.enqueued_at = datetime.utcnow()
+                            stats["recent"] += 1
+                            requeued += 1
+                            continue
+                        if uri in _still_referenced(session, [entry]):
+                            stats["referenced"] += 1
+                        else:
+                            delete_blob(uri)
+                            stats["deleted"] += 1
+                    except Exception as exc:
+                        entry.attempts += 1
+                        stats["failed"] += 1
+                        logging.warning("Datei %s konnte nicht gelöscht werden: %s", uri, exc)
+                        continue
+                handled.add(uri)
+                done.append(entry.id)
+            if done:
+                session.execute(delete(FileCleanup).where(FileCleanup.id.in_(done)))
+            session.commit()
+            if not done and not requeued:
+                # only failing entries left in this batch
+                break
+    finally:
+        session.close()
+    if any(stats.values()):
+        logging.info("Dateibereinigung: %s", stats)
+    return stats
+
+
+class FileCleanupWorker:
+    """Background thread draining the ``file_cleanup`` queue."""
+
+    def __init__(self, interval: float = CLEANUP_INTERVAL_SECONDS) -> None:
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="file-cleanup", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                drain_file_cleanup()
+            except Exception:
+                logging.exception("Dateibereinigung fehlgeschlagen")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+
+cleanup_worker = FileCleanupWorker()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Customer offboarding and file cleanup.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    remove = commands.add_parser("delete", help="delete a customer with all data")
+    remove.add_argument("customer_id", type=int)
+    remove.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    drain = commands.add_parser("drain", help="remove queued files now")
+    drain.add_argument("--no-delay", action="store_true", help="also process entries queued just now")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.command == "delete":
+        report = offboard_customer(args.customer_id, args.batch_size)
+        if report is None:
+            raise SystemExit(f"Kunde {args.customer_id} nicht gefunden")
+        for name, value in report.as_dict().items():
+            print(f"{name:<14} {value}")
+        return
+    stats = drain_file_cleanup(delay=0 if args.no_delay else CLEANUP_DELAY_SECONDS)
+    for name, value in stats.items():
+        print(f"{name:<11} {value}")
+
+
+if __name__ == "__main__":
+    main()
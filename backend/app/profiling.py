@@ -0,0 +1,401 @@
+"""Opt-in sampling profiler for single requests and scheduler jobs.
+
+Profiling is disabled unless ``PROFILING_TOKEN`` is set.  Without the
+token neither the middleware nor the SQL hooks are installed and
+:func:`profile_job` returns the job unchanged, so a disabled profiler
+costs nothing.
+
+With the token set, a request is profiled when
+
+* it carries the header ``X-Profile: <PROFILING_TOKEN>``, or
+* it is picked by the sampling rate configured at runtime through
+  ``PUT /profiling/config`` (optionally restricted to a path prefix,
+  e.g. ``/ustva/calc/42/`` for one customer).
+
+Scheduler jobs decorated with :func:`profile_job` are profiled with the
+configured ``job_sample_rate``.
+
+While at least one profile is active, a daemon thread takes a snapshot
+of all thread stacks every ``PROFILING_INTERVAL_MS`` milliseconds
+(default 5) and attributes each stack to the profile it belongs to:
+
+* on the event loop by the frame of the middleware coroutine of the
+  request, which is part of the stack whenever the request runs;
+* in threadpool workers by the :class:`contextvars.Context` the worker
+  is running, which carries the active profile;
+* in scheduler threads by the thread id.
+
+SQL statements executed on behalf of a profile are recorded with their
+duration and show up as an extra ``SQL: …`` frame on top of the stacks
+sampled while they run.  Finished profiles are kept in a bounded ring
+buffer (``PROFILING_BUFFER``, default 50) and can be exported in the
+speedscope format (https://www.speedscope.app), which also renders
+them as a flame graph.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import functools
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from types import FrameType
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+ENABLED = bool(PROFILING_TOKEN)
+INTERVAL = float(os.getenv("PROFILING_INTERVAL_MS", "5")) / 1000
+BUFFER_SIZE = int(os.getenv("PROFILING_BUFFER", "50"))
+MAX_STACK_DEPTH = 200
+MAX_SQL_STATEMENTS = 1000
+PROFILE_HEADER = b"x-profile"
+
+Frame = Tuple[str, str, int]  # (function, file, first line)
+
+
+@dataclass
+class ProfilingConfig:
+    sample_rate: float = 0.0
+    path_prefix: Optional[str] = None
+    job_sample_rate: float = 0.0
+
+
+@dataclass
+class Profile:
+    id: int
+    name: str
+    started_at: float  # Unix-Zeit
+    start: float = field(default_factory=time.perf_counter)
+    duration: float = 0.0
+    root_frame: Optional[FrameType] = None
+    thread_ids: Set[int] = field(default_factory=set)
+    samples: Counter = field(default_factory=Counter)
+    sql: List[Dict[str, Any]] = field(default_factory=list)
+    sql_dropped: int = 0
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            "sampled_ms": round(sum(self.samples.values()), 3),
+            "sql_statements": len(self.sql) + self.sql_dropped,
+            "sql_ms": round(sum(s["duration_ms"] for s in self.sql), 3),
+            **self.meta,
+        }
+
+    def details(self) -> Dict[str, Any]:
+        hot = Counter()
+        for stack, weight in self.samples.items():
+            hot[stack[-1][0]] += weight
+        return {
+            **self.summary(),
+            "top_frames": [{"frame": name, "ms": round(ms, 3)} for name, ms in hot.most_common(20)],
+            "sql": self.sql,
+        }
+
+    def to_speedscope(self) -> Dict[str, Any]:
+        """Export as a speedscope file: one sampled profile plus one
+        evented ``SQL`` profile per thread that executed statements."""
+        frames: List[Dict[str, Any]] = []
+        index: Dict[Frame, int] = {}
+
+        def frame_index(frame: Frame) -> int:
+            i = index.get(frame)
+            if i is None:
+                i = index[frame] = len(frames)
+                entry: Dict[str, Any] = {"name": frame[0]}
+                if frame[1]:
+                    entry.update(file=frame[1], line=frame[2])
+                frames.append(entry)
+            return i
+
+        samples, weights = [], []
+        for stack, weight in self.samples.items():
+            samples.append([frame_index(frame) for frame in stack])
+            weights.append(round(weight, 3))
+        profiles: List[Dict[str, Any]] = [
+            {
+                "type": "sampled",
+                "name": self.name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights,
+            }
+        ]
+        by_thread: Dict[int, List[Dict[str, Any]]] = {}
+        for stmt in self.sql:
+            by_thread.setdefault(stmt["thread"], []).append(stmt)
+        duration_ms = round(self.duration * 1000, 3)
+        for thread, statements in sorted(by_thread.items()):
+            events = []
+            for stmt in statements:
+                i = frame_index((_sql_label(stmt["statement"]), "", 0))
+                end = stmt["offset_ms"] + stmt["duration_ms"]
+                events.append({"type": "O", "frame": i, "at": stmt["offset_ms"]})
+                events.append({"type": "C", "frame": i, "at": end})
+            profiles.append(
+                {
+                    "type": "evented",
+                    "name": f"SQL (Thread {thread})",
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": max(duration_ms, events[-1]["at"]),
+                    "events": events,
+                }
+            )
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "accounting-saas",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+def _sql_label(statement: str) -> str:
+    return "SQL: " + " ".join(statement.split())[:200]
+
+
+_current: contextvars.ContextVar[Optional[Profile]] = contextvars.ContextVar("profile", default=None)
+
+
+class Profiler:
+    """Registry of active profiles, the sampling thread and the ring buffer."""
+
+    def __init__(self, interval: float = INTERVAL, buffer_size: int = BUFFER_SIZE) -> None:
+        self.interval = interval
+        self.config = ProfilingConfig()
+        self.finished: Deque[Profile] = deque(maxlen=buffer_size)
+        self._active: Dict[int, Profile] = {}
+        self._active_sql: Dict[int, Tuple[Profile, str]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -- decisions -------------------------------------------------------
+    def should_profile_request(self, path: str, header: Optional[bytes]) -> bool:
+        if header is not None and hmac.compare_digest(header, PROFILING_TOKEN.encode()):
+            return True
+        config = self.config
+        if config.sample_rate <= 0:
+            return False
+        if config.path_prefix and not path.startswith(config.path_prefix):
+            return False
+        return random.random() < config.sample_rate
+
+    # -- lifecycle -------------------------------------------------------
+    def start(self, name: str, root_frame: Optional[FrameType] = None, thread_id: Optional[int] = None) -> Profile:
+        profile = Profile(id=next(self._ids), name=name, started_at=time.time(), root_frame=root_frame)
+        if thread_id is not None:
+            profile.thread_ids.add(thread_id)
+        with self._lock:
+            self._active[profile.id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return profile
+
+    def stop(self, profile: Profile) -> None:
+        profile.duration = time.perf_counter() - profile.start
+        profile.root_frame = None
+        with self._lock:
+            self._active.pop(profile.id, None)
+            self.finished.append(profile)
+
+    def get(self, profile_id: int) -> Optional[Profile]:
+        for profile in list(self.finished):
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    # -- sampling --------------------------------------------------------
+    def _run(self) -> None:
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while True:
+            if not self._active:
+                self._wakeup.clear()
+                if not self._active:
+                    self._wakeup.wait()
+                last = time.perf_counter()
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            weight_ms, last = (now - last) * 1000, now
+            with self._lock:
+                active = list(self._active.values())
+            if active:
+                self._sample(active, weight_ms, own)
+
+    def _sample(self, active: List[Profile], weight_ms: float, own: int) -> None:
+        roots = {id(p.root_frame): p for p in active if p.root_frame is not None}
+        by_thread = {tid: p for p in active for tid in p.thread_ids}
+        for thread_id, top in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            owner = by_thread.get(thread_id)
+            stack: List[Frame] = []
+            frame: Optional[FrameType] = top
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                if owner is None:
+                    owner = roots.get(id(frame))
+                    if owner is None and "context" in code.co_varnames:
+                        # threadpool worker: the task runs inside this Context
+                        context = frame.f_locals.get("context")
+                        if isinstance(context, contextvars.Context):
+                            owner = context.get(_current)
+                            if owner is not None and owner.id not in self._active:
+                                owner = None
+                frame = frame.f_back
+            if owner is None:
+                continue
+            stack.reverse()
+            sql = self._active_sql.get(thread_id)
+            if sql is not None and sql[0] is owner:
+                stack.append((_sql_label(sql[1]), "", 0))
+            owner.samples[tuple(stack)] += weight_ms
+
+    # -- SQL -------------------------------------------------------------
+    def instrument(self, engine: Engine) -> None:
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            profile = _current.get()
+            if profile is not None:
+                conn.info.setdefault("profile_sql_start", []).append(time.perf_counter())
+                self._active_sql[threading.get_ident()] = (profile, statement)
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            profile = _current.get()
+            starts = conn.info.get("profile_sql_start")
+            if profile is None or not starts:
+                return
+            started = starts.pop()
+            thread_id = threading.get_ident()
+            self._active_sql.pop(thread_id, None)
+            if len(profile.sql) >= MAX_SQL_STATEMENTS:
+                profile.sql_dropped += 1
+                return
+            profile.sql.append(
+                {
+                    "thread": thread_id,
+                    "offset_ms": round((started - profile.start) * 1000, 3),
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                    "statement": statement,
+                    "executemany": executemany,
+                }
+            )
+
+        @event.listens_for(engine, "handle_error")
+        def _error(exception_context):
+            self._active_sql.pop(threading.get_ident(), None)
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles selected requests.
+
+    The profile id is returned in the ``X-Profile-Id`` response header.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = next((value for key, value in scope["headers"] if key == PROFILE_HEADER), None)
+        if not profiler.should_profile_request(scope["path"], header):
+            await self.app(scope, receive, send)
+            return
+        profile = profiler.start(
+            f"{scope['method']} {scope['path']}", root_frame=sys._getframe()
+        )
+        profile.meta.update(method=scope["method"], path=scope["path"], query=scope.get("query_string", b"").decode())
+        token = _current.set(profile)
+
+        async def send_with_id(message) -> None:
+            if message["type"] == "http.response.start":
+                profile.meta["status"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", str(profile.id).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current.reset(token)
+            profiler.stop(profile)
+
+
+def profile_job(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator for scheduler jobs; a no-op when profiling is disabled."""
+
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            rate = profiler.config.job_sample_rate
+            if rate <= 0 or random.random() >= rate:
+                return fn(*args, **kwargs)
+            profile = profiler.start(f"job {name}", thread_id=threading.get_ident())
+            profile.meta["job"] = name
+            token = _current.set(profile)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _current.reset(token)
+                profiler.stop(profile)
+
+        return wrapper
+
+    return decorator
+
+
+def setup_profiling(app, engine: Engine) -> None:
+    """Install middleware and SQL hooks if ``PROFILING_TOKEN`` is set."""
+    if ENABLED:
+        app.add_middleware(ProfilingMiddleware)
+        profiler.instrument(engine)
+
+
+def check_token(token: Optional[str]) -> bool:
+    return ENABLED and token is not None and hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode())
+
+
+__all__ = [
+    "ENABLED",
+    "Profile",
+    "Profiler",
+    "ProfilingConfig",
+    "ProfilingMiddleware",
+    "check_token",
+    "profile_job",
+    "profiler",
+    "setup_profiling",
+]
@@ -10,17 +10,17 @@ reminder e‑mail via Mailjet.  The scheduler runs in the European
 timezone (``Europe/Berlin``) to match the user's locale.
 """
 
-import calendar
 import logging
 from datetime import datetime, date
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from decimal import Decimal
 from typing import List
 
 from .database import SessionLocal
-from .models import Customer, Ustva, Receipt
-from .ustva_engine import calculate_ustva
+from .events import broker
+from .profiling import profile_job
+from .models import Customer, Ustva
+from .ustva_engine import calculate_ustva, ustva_sums
 import os
 import requests
 
@@ -34,6 +34,7 @@ scheduler = BackgroundScheduler(timezone="Europe/Berlin")
 # -------------------------------------------------
 # Job 1: Missing receipts reminder
 # -------------------------------------------------
+@profile_job("MissingReceiptsReminder")
 def missing_receipts_reminder() -> None:
     logging.info("📧 MissingReceiptsReminder ausgeführt um %s", datetime.now())
 
@@ -48,6 +49,7 @@ scheduler.add_job(
 # -------------------------------------------------
 # Job 2: Payment reminder
 # -------------------------------------------------
+@profile_job("PaymentReminder")
 def payment_reminder() -> None:
     logging.info("📧 PaymentReminder ausgeführt um %s", datetime.now())
 
@@ -104,14 +106,15 @@ def _send_mailjet_email(to_email: str, subject: str, html: str) -> None:
 # -------------------------------------------------
 # Job 3: UStVA reminder
 # -------------------------------------------------
+@profile_job("UstvaReminder")
 def send_ustva_reminder() -> None:
     """Compute and dispatch UStVA summaries for all customers.
 
     For the current month, the job checks whether a UStVA record
     already exists for each customer.  If not, it calculates the sums
     using :func:`app.ustva_engine.calculate_ustva`, writes a new
-    :class:`app.models.Ustva` entry with net, tax and gross totals and
-    sends an HTML e‑mail with the aggregated figures.  Any error
+    :class:`app.models.Ustva` entry with net, tax and gross totals plus
+    Umsatzsteuer, Vorsteuer and Zahllast and sends an HTML e‑mail with the aggregated figures.  Any error
     encountered for a single customer is logged and does not stop
     processing the remaining customers.
     """
@@ -130,34 +133,22 @@ def send_ustva_reminder() -> None:
                 )
                 if existing:
                     continue
-                # Compute summary (sales VAT, input VAT and liability)
+                # Compute summary (sales VAT, input VAT and liability); the
+                # stored sums come from the same result as /ustva/calc
                 summary = calculate_ustva(customer.id, today.year, today.month, session)
-                # Aggregate raw sums for Ustva table
-                # Compute date range for the month
-                first_day = date(today.year, today.month, 1)
-                last_day = date(today.year, today.month, calendar.monthrange(today.year, today.month)[1])
-                receipts = (
-                    session.query(Receipt)
-                    .filter(
-                        Receipt.customer_id == customer.id,
-                        Receipt.date >= first_day,
-                        Receipt.date <= last_day,
-                    )
-                    .all()
-                )
-                net_sum: Decimal = sum((r.net_amount or Decimal("0.00")) for r in receipts)
-                tax_sum: Decimal = sum((r.tax_amount or Decimal("0.00")) for r in receipts)
-                gross_sum: Decimal = sum((r.gross_amount or Decimal("0.00")) for r in receipts)
-                # Create and persist new Ustva entry
-                new_entry = Ustva(
-                    customer_id=customer.id,
-                    period=period_str,
-                    net_sum=net_sum,
-                    tax_sum=tax_sum,
-                    gross_sum=gross_sum,
-                )
+                new_entry = Ustva(customer_id=customer.id, period=period_str, **ustva_sums(summary))
                 session.add(new_entry)
                 session.commit()
+                broker.publish(
+                    customer.id,
+                    "ustva.generated",
+                    {
+                        "id": new_entry.id,
+                        "period": period_str,
+                        "tax_sum": new_entry.tax_sum,
+                        "zahllast": new_entry.zahllast,
+                    },
+                )
                 # Prepare email content
                 subject = f"UStVA {period_str} für {customer.name}"
                 html = (
@@ -8,8 +8,12 @@ SQLAlchemy‑Objekte automatisch in Pydantic‑Modelle zu konvertieren.
 
 from datetime import date, datetime
 from decimal import Decimal
-from typing import Optional, List
-from pydantic import BaseModel, EmailStr
+from typing import Dict, Optional, List
+from pydantic import BaseModel, EmailStr, Field
+
+# Das Feld ``ReceiptBase.date`` überdeckt im Klassenrumpf den Typ ``date``;
+# Pydantic 2 würde den Typ sonst als ``None`` auflösen.
+DateType = date
 
 
 class CustomerBase(BaseModel):
@@ -30,11 +34,13 @@ class CustomerRead(CustomerBase):
 
 
 class ReceiptBase(BaseModel):
-    date: Optional[date] = None
+    date: Optional[DateType] = None
     net_amount: Optional[Decimal] = None
     tax_amount: Optional[Decimal] = None
     gross_amount: Optional[Decimal] = None
     supplier: Optional[str] = None
+    tax_rate: Optional[int] = None
+    direction: str = "outgoing"
 
 
 class ReceiptCreate(ReceiptBase):
@@ -45,18 +51,30 @@ class ReceiptCreate(ReceiptBase):
 class ReceiptRead(ReceiptBase):
     id: int
     file_path: str
+    content_hash: Optional[str] = None
     uploaded_at: datetime
     customer_id: int
+    duplicate_of_id: Optional[int] = None
+    duplicate_score: Optional[Decimal] = None
+    duplicate_resolved_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True
 
 
+class ReceiptSearchHit(ReceiptRead):
+    rank: float  # Relevanz, größer ist besser
+
+
 class UstvaBase(BaseModel):
     period: str  # YYYY-MM
-    net_sum: Decimal
+    net_sum: Decimal  # alle Belege des Monats
     tax_sum: Decimal
     gross_sum: Decimal
+    # wie /ustva/calc; None bei Einträgen aus älteren Versionen
+    umsatzsteuer: Optional[Decimal] = None
+    vorsteuer: Optional[Decimal] = None
+    zahllast: Optional[Decimal] = None
 
 
 class UstvaCreate(UstvaBase):
@@ -88,4 +106,116 @@ class OpenItemRead(OpenItemBase):
     customer_id: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class DirectionTotals(BaseModel):
+    count: int
+    net_sum: Decimal
+    tax_sum: Decimal
+    gross_sum: Decimal
+
+
+class PeriodTotals(BaseModel):
+    period: str  # YYYY-MM
+    outgoing: DirectionTotals  # Ausgangsrechnungen: Umsatz und Umsatzsteuer
+    incoming: DirectionTotals  # Eingangsrechnungen: Kosten und Vorsteuer
+    zahllast: Decimal  # Umsatzsteuer - Vorsteuer
+
+
+class UstvaPeriodStatus(BaseModel):
+    period: str  # YYYY-MM
+    generated: bool
+    generated_at: Optional[datetime] = None
+    tax_sum: Optional[Decimal] = None
+    zahllast: Optional[Decimal] = None  # None, wenn nicht oder vor Einführung erzeugt
+
+
+class OpenItemStatusSummary(BaseModel):
+    count: int
+    amount: Decimal
+
+
+class DashboardRead(BaseModel):
+    customer_id: int
+    latest_receipts: List[ReceiptRead]
+    totals: Dict[str, PeriodTotals]  # "current" und "previous"
+    ustva: List[UstvaPeriodStatus]  # neuester Monat zuerst
+    open_items: Dict[str, OpenItemStatusSummary]  # "open", "overdue", "paid"
+
+
+class AgingReport(BaseModel):
+    customer_id: Optional[int] = None  # None = gesamtes Portfolio
+    as_of: date
+    buckets: Dict[str, OpenItemStatusSummary]  # "current", "1-30", "31-60", "61-90", "90+"
+    total: OpenItemStatusSummary
+
+
+class PortfolioAgingReport(AgingReport):
+    customers: Optional[List[AgingReport]] = None
+
+
+class BankTransactionRead(BaseModel):
+    booking_date: Optional[date] = None
+    amount_cents: int  # positiv = Gutschrift, negativ = Lastschrift
+    reference: str
+    counterparty: str
+    line: int  # Position im Kontoauszug
+
+
+class BankMatchRead(BankTransactionRead):
+    open_item_id: int
+    customer_id: int
+    method: str  # "exact", "amount" oder "reference"
+
+
+class BankImportReport(BaseModel):
+    format: str
+    dry_run: bool
+    transactions: int
+    matched_count: int
+    review_count: int
+    unmatched_count: int
+    matched_by_method: Dict[str, int]
+    matched: List[BankMatchRead]
+    review: List[BankMatchRead]  # nur Betrag passt: prüfen, nicht automatisch bezahlt
+    unmatched: List[BankTransactionRead]
+
+
+class OffboardingReport(BaseModel):
+    customer_id: int
+    receipts: int
+    ustva: int
+    open_items: int
+    files_queued: int
+    transactions: int
+    seconds: float
+
+
+class RateSimulation(BaseModel):
+    period_from: str  # YYYY-MM
+    period_to: Optional[str] = None
+    from_rate: int = Field(..., ge=0, le=100)
+    to_rate: int = Field(..., ge=0, le=100)
+    basis: str = "net"  # "net": Nettobetrag bleibt, "gross": Bruttopreis bleibt
+    direction: Optional[str] = None  # nur "incoming" oder "outgoing"
+    customer_ids: Optional[List[int]] = None
+    receipt_ids: Optional[List[int]] = None  # nur diese Belege umstellen
+
+
+class ProfilingConfig(BaseModel):
+    sample_rate: float = Field(0.0, ge=0, le=1)  # Anteil zufällig profilierter Requests
+    path_prefix: Optional[str] = None  # nur Requests unter diesem Pfad
+    job_sample_rate: float = Field(0.0, ge=0, le=1)  # Anteil profilierter Scheduler-Läufe
+
+
+class DuplicateRead(BaseModel):
+    id: int
+    duplicate_of_id: int
+    score: float
+
+
+class DuplicateScanReport(BaseModel):
+    customer_id: int
+    scanned: int
+    applied: bool
+    duplicates: List[DuplicateRead]
@@ -0,0 +1,207 @@
+"""Full-text search over receipts.
+
+Receipts are searchable by supplier name and by the normalized text
+that :func:`app.ocr.parse_receipt_pdf` extracts (``Receipt.text_content``).
+The index lives inside the database so that it stays consistent with
+the rows without any application-side bookkeeping:
+
+* **PostgreSQL** – a GIN expression index over a weighted ``tsvector``
+  (supplier weight A, document text weight B, German configuration) and
+  a ``pg_trgm`` GIN index on ``lower(supplier)`` for fuzzy matches.
+  Without the extension (missing privileges) search falls back to the
+  full-text index alone.
+* **SQLite** – an FTS5 external-content table ``receipts_fts`` that is
+  kept in sync by triggers; ranking uses BM25 with the supplier column
+  weighted 10:1.  Supplier names that do not match any token fall back
+  to a fuzzy comparison against the customer's distinct suppliers.
+
+Every search token is matched as a prefix (``tele`` finds "Telekom"),
+and the results can be filtered by customer, date range and gross
+amount.  :func:`setup_search` is idempotent and runs at startup.
+"""
+
+from __future__ import annotations
+
+import difflib
+import logging
+import re
+from datetime import date
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import column, func, inspect, literal_column, or_, select, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .models import Receipt
+from .ocr import normalize_text
+
+MAX_TOKENS = 8
+TOKEN_RE = re.compile(r"\w+")
+
+# The query must use exactly this expression so that PostgreSQL picks the index.
+PG_SEARCH_VECTOR = (
+    "setweight(to_tsvector('german', coalesce(receipts.supplier, '')), 'A') || "
+    "setweight(to_tsvector('german', coalesce(receipts.text_content, '')), 'B')"
+)
+
+_PG_STATEMENTS = [
+    f"CREATE INDEX IF NOT EXISTS ix_receipts_search ON receipts USING GIN (({PG_SEARCH_VECTOR}))",
+]
+_PG_TRGM_STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_receipts_supplier_trgm ON receipts USING GIN (lower(supplier) gin_trgm_ops)",
+]
+
+_SQLITE_STATEMENTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS receipts_fts USING fts5(
+        supplier, text_content,
+        content='receipts', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS receipts_fts_ai AFTER INSERT ON receipts BEGIN
+        INSERT INTO receipts_fts(rowid, supplier, text_content)
+        VALUES (new.id, new.supplier, new.text_content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS receipts_fts_ad AFTER DELETE ON receipts BEGIN
+        INSERT INTO receipts_fts(receipts_fts, rowid, supplier, text_content)
+        VALUES ('delete', old.id, old.supplier, old.text_content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS receipts_fts_au AFTER UPDATE OF supplier, text_content ON receipts BEGIN
+        INSERT INTO receipts_fts(receipts_fts, rowid, supplier, text_content)
+        VALUES ('delete', old.id, old.supplier, old.text_content);
+        INSERT INTO receipts_fts(rowid, supplier, text_content)
+        VALUES (new.id, new.supplier, new.text_content);
+    END
+    """,
+]
+
+receipts_fts = table("receipts_fts", column("rowid"), column("supplier"), column("text_content"))
+
+# set by setup_search; without pg_trgm similarity() and % do not exist
+_pg_trigram = False
+
+
+def setup_search(engine: Engine) -> None:
+    """Create the search index structures for the engine's dialect."""
+    global _pg_trigram
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        with engine.begin() as conn:
+            for statement in _PG_STATEMENTS:
+                conn.execute(text(statement))
+        try:
+            with engine.begin() as conn:
+                for statement in _PG_TRGM_STATEMENTS:
+                    conn.execute(text(statement))
+            _pg_trigram = True
+        except Exception as exc:
+            # pg_trgm needs CREATE privileges; search still works without fuzzy matching
+            logging.warning("pg_trgm nicht verfügbar, unscharfe Lieferantensuche deaktiviert: %s", exc)
+    elif dialect == "sqlite":
+        new_index = not inspect(engine).has_table("receipts_fts")
+        with engine.begin() as conn:
+            for statement in _SQLITE_STATEMENTS:
+                conn.execute(text(statement))
+            if new_index:
+                # index the rows that existed before the FTS table
+                conn.execute(text("INSERT INTO receipts_fts(receipts_fts) VALUES ('rebuild')"))
+    else:
+        logging.warning("Volltextsuche wird für %s nicht unterstützt", dialect)
+
+
+def _tokens(query: str) -> list[str]:
+    return TOKEN_RE.findall(normalize_text(query).lower())[:MAX_TOKENS]
+
+
+def _apply_filters(stmt, customer_id, date_from, date_to, min_amount, max_amount):
+    if customer_id is not None:
+        stmt = stmt.where(Receipt.customer_id == customer_id)
+    if date_from is not None:
+        stmt = stmt.where(Receipt.date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Receipt.date <= date_to)
+    if min_amount is not None:
+        stmt = stmt.where(Receipt.gross_amount >= min_amount)
+    if max_amount is not None:
+        stmt = stmt.where(Receipt.gross_amount <= max_amount)
+    return stmt
+
+
+def search_receipts(
+    db: Session,
+    query: str,
+    customer_id: Optional[int] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    min_amount: Optional[Decimal] = None,
+    max_amount: Optional[Decimal] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> list[tuple[Receipt, float]]:
+    """Return ``(receipt, rank)`` pairs ordered by descending relevance.
+
+    Raises:
+        ValueError: if the query contains no searchable token.
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        raise ValueError("Suchbegriff enthält keine durchsuchbaren Wörter")
+    filters = (customer_id, date_from, date_to, min_amount, max_amount)
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "postgresql":
+        tsquery = func.to_tsquery("german", " & ".join(f"{t}:*" for t in tokens))
+        vector = literal_column(f"({PG_SEARCH_VECTOR})")
+        supplier = func.lower(Receipt.supplier)
+        needle = " ".join(tokens)
+        if _pg_trigram:
+            rank = (func.ts_rank_cd(vector, tsquery) + func.similarity(supplier, needle)).label("rank")
+            stmt = select(Receipt, rank).where(or_(vector.op("@@")(tsquery), supplier.op("%")(needle)))
+        else:
+            rank = func.ts_rank_cd(vector, tsquery).label("rank")
+            stmt = select(Receipt, rank).where(vector.op("@@")(tsquery))
+        stmt = _apply_filters(stmt, *filters).order_by(rank.desc(), Receipt.id.desc())
+        return [(r, float(score)) for r, score in db.execute(stmt.limit(limit).offset(offset))]
+
+    if dialect != "sqlite":
+        raise ValueError(f"Volltextsuche wird für {dialect} nicht unterstützt")
+
+    match = " ".join(f'"{t}"*' for t in tokens)
+    rank = (-func.bm25(literal_column("receipts_fts"), 10.0, 1.0)).label("rank")
+    stmt = (
+        select(Receipt, rank)
+        .join(receipts_fts, receipts_fts.c.rowid == Receipt.id)
+        .where(literal_column("receipts_fts").op("MATCH")(match))
+    )
+    stmt = _apply_filters(stmt, *filters).order_by(rank.desc(), Receipt.id.desc())
+    hits = [(r, float(score)) for r, score in db.execute(stmt.limit(limit).offset(offset))]
+    if hits or offset:
+        return hits
+
+    # fuzzy fallback on supplier names, e.g. "Telecom" -> "Deutsche Telekom AG"
+    suppliers_stmt = select(Receipt.supplier).where(Receipt.supplier.is_not(None)).distinct().limit(5000)
+    if customer_id is not None:
+        suppliers_stmt = suppliers_stmt.where(Receipt.customer_id == customer_id)
+    needle = " ".join(tokens)
+    scores: dict[str, float] = {}
+    for supplier in db.scalars(suppliers_stmt):
+        words = _tokens(supplier)
+        best = max(
+            [difflib.SequenceMatcher(None, needle, w).ratio() for w in words]
+            + [difflib.SequenceMatcher(None, needle, " ".join(words)).ratio()]
+        )
+        if best >= 0.75:
+            scores[supplier] = best
+    if not scores:
+        return []
+    stmt = _apply_filters(select(Receipt).where(Receipt.supplier.in_(scores)), *filters)
+    receipts = db.scalars(stmt.order_by(Receipt.date.desc(), Receipt.id.desc()).limit(limit)).all()
+    return sorted(((r, scores[r.supplier]) for r in receipts), key=lambda hit: -hit[1])
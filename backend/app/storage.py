@@ -0,0 +1,407 @@
+"""Blob storage for uploaded receipt files.
+
+Receipts are stored content-addressed: the key of a file is derived
+from its SHA-256 hash (``ab/cd/abcd….pdf``), so the files spread evenly
+over hash-prefixed subdirectories (or object-key prefixes) and identical
+uploads share one blob.  Two backends are available and selected via
+``STORAGE_BACKEND``:
+
+* ``local`` (default) – :class:`LocalShardedStorage` below
+  ``UPLOADS_DIR`` (default ``/tmp/uploads``).
+* ``s3`` – :class:`S3Storage` for any S3-compatible object store.  The
+  bucket is configured via ``S3_BUCKET``; ``S3_ENDPOINT_URL`` points the
+  client to a MinIO-style server for local tests, ``S3_PREFIX`` and
+  ``S3_REGION`` are optional.  Large files are sent as multipart uploads
+  over a pooled client.
+
+``Receipt.file_path`` holds a storage URI (``local://ab/cd/….pdf`` or
+``s3://bucket/ab/cd/….pdf``); files moved to the cold archive have
+``archive://<pack>/….pdf`` (see :mod:`app.archive`).  Plain filesystem
+paths written by older versions are still readable through the module
+level helpers
+:func:`open_blob`, :func:`blob_local_path` and :func:`delete_blob`.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import BinaryIO, Iterator, Optional
+
+from fastapi import UploadFile
+
+# boto3 is only needed for the S3 backend; import it lazily so that the
+# local backend works without the dependency (same pattern as pdfplumber
+# in :mod:`app.ocr`).
+try:
+    import boto3  # type: ignore
+    from boto3.s3.transfer import TransferConfig  # type: ignore
+    from botocore.config import Config as BotoConfig  # type: ignore
+except ImportError:  # pragma: no cover - depends on the environment
+    boto3 = None  # type: ignore
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class StagedFile:
+    """An upload that has been streamed to a temporary file."""
+
+    path: str
+    sha256: str
+    size: int
+    extension: str
+
+    @property
+    def key(self) -> str:
+        """Content-addressed storage key, e.g. ``ab/cd/abcd….pdf``."""
+        return f"{self.sha256[:2]}/{self.sha256[2:4]}/{self.sha256}{self.extension}"
+
+    def discard(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+
+async def stage_upload(upload: UploadFile) -> StagedFile:
+    """Stream an upload to a temporary file while hashing it.
+
+    The file is read in chunks of :data:`CHUNK_SIZE`, so memory usage
+    does not depend on the size of the upload.
+    """
+    extension = os.path.splitext(upload.filename or "")[1].lower()[:10]
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=extension)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await upload.read(CHUNK_SIZE):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return StagedFile(path=path, sha256=digest.hexdigest(), size=size, extension=extension)
+
+
+class BlobStorage:
+    """Interface of a storage backend.
+
+    Keys are relative, ``/``-separated names; :meth:`uri` turns a key
+    into the value stored in ``Receipt.file_path``.
+    """
+
+    scheme: str = ""
+
+    def uri(self, key: str) -> str:
+        raise NotImplementedError
+
+    def put_file(self, src_path: str, key: str, content_type: Optional[str] = None) -> str:
+        """Store ``src_path`` under ``key`` and return the URI.
+
+        The source file may be moved into the store; callers must not
+        rely on it still existing afterwards.
+        """
+        raise NotImplementedError
+
+    def open(self, key: str) -> BinaryIO:
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        """Yield a filesystem path with the content of ``key``."""
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, key: str) -> int:
+        raise NotImplementedError
+
+    def mtime(self, key: str) -> float:
+        """Unix time ``key`` was last written."""
+        raise NotImplementedError
+
+    def read_range(self, key: str, offset: int, length: int) -> bytes:
+        """Return ``length`` bytes of ``key`` starting at ``offset``."""
+        with self.open(key) as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def list_keys(self, prefix: str) -> Iterator[str]:
+        """Yield the keys starting with ``prefix`` (``/``-separated)."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class LocalShardedStorage(BlobStorage):
+    """Files below a root directory, sharded by the first key segments."""
+
+    scheme = "local"
+
+    def __init__(self, root: str) -> None:
+        self.root = os.path.abspath(root)
+
+    def uri(self, key: str) -> str:
+        return f"local://{key}"
+
+    def path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def put_file(self, src_path: str, key: str, content_type: Optional[str] = None) -> str:
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(src_path, target)
+        except OSError:
+            # staging directory on another filesystem: copy, then rename atomically
+            partial = f"{target}.{os.getpid()}.part"
+            shutil.copyfile(src_path, partial)
+            os.replace(partial, target)
+        return self.uri(key)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    @contextlib.contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        path = self.path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        yield path
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def mtime(self, key: str) -> float:
+        return os.path.getmtime(self.path(key))
+
+    def read_range(self, key: str, offset: int, length: int) -> bytes:
+        with open(self.path(key), "rb") as f:
+            return os.pread(f.fileno(), length, offset)
+
+    def list_keys(self, prefix: str) -> Iterator[str]:
+        base = os.path.join(self.root, os.path.dirname(prefix))
+        for directory, _, files in os.walk(base):
+            for name in files:
+                key = os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    yield key
+
+    def delete(self, key: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path(key))
+
+
+class S3Storage(BlobStorage):
+    """Objects in an S3-compatible bucket (AWS S3, MinIO, …)."""
+
+    scheme = "s3"
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        max_pool_connections: int = 32,
+        multipart_threshold: int = 8 * 1024 * 1024,
+    ) -> None:
+        if boto3 is None:
+            raise ImportError(
+                "boto3 is required for STORAGE_BACKEND=s3. Install it via `pip install boto3`."
+            )
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        # one client per process; botocore keeps a connection pool per client
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=BotoConfig(
+                max_pool_connections=max_pool_connections,
+                retries={"max_attempts": 5, "mode": "standard"},
+            ),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_threshold,
+            max_concurrency=4,
+        )
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def uri(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._object_key(key)}"
+
+    def put_file(self, src_path: str, key: str, content_type: Optional[str] = None) -> str:
+        extra_args = {"ContentType": content_type} if content_type else None
+        self.client.upload_file(
+            src_path,
+            self.bucket,
+            self._object_key(key),
+            ExtraArgs=extra_args,
+            Config=self.transfer_config,
+        )
+        return self.uri(key)
+
+    def open(self, key: str) -> BinaryIO:
+        response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        return response["Body"]
+
+    @contextlib.contextmanager
+    def local_path(self, key: str) -> Iterator[str]:
+        fd, path = tempfile.mkstemp(prefix="blob-", suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self.client.download_file(
+                self.bucket, self._object_key(key), path, Config=self.transfer_config
+            )
+            yield path
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def presigned_url(self, key: str, expires_in: int = 300) -> str:
+        """Return a time-limited GET URL so clients download directly from the bucket."""
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._object_key(key)},
+            ExpiresIn=expires_in,
+        )
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self.client.exceptions.ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def size(self, key: str) -> int:
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(self.uri(key))
+        return int(head["ContentLength"])
+
+    def mtime(self, key: str) -> float:
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(self.uri(key))
+        return head["LastModified"].timestamp()
+
+    def read_range(self, key: str, offset: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        response = self.client.get_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Range=f"bytes={offset}-{offset + length - 1}",
+        )
+        return response["Body"].read()
+
+    def list_keys(self, prefix: str) -> Iterator[str]:
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(prefix)):
+            for obj in page.get("Contents", ()):
+                yield obj["Key"][strip:]
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+@lru_cache(maxsize=None)
+def get_storage() -> BlobStorage:
+    """Return the configured storage backend (one instance per process)."""
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "local":
+        return LocalShardedStorage(os.getenv("UPLOADS_DIR", "/tmp/uploads"))
+    if backend == "s3":
+        bucket = os.getenv("S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("S3_BUCKET ist nicht gesetzt (STORAGE_BACKEND=s3).")
+        return S3Storage(
+            bucket=bucket,
+            prefix=os.getenv("S3_PREFIX", ""),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+            region=os.getenv("S3_REGION") or None,
+            max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32")),
+        )
+    raise RuntimeError(f"Unbekanntes STORAGE_BACKEND: {backend}")
+
+
+def resolve(uri: str) -> tuple[Optional[BlobStorage], str]:
+    """Split a ``Receipt.file_path`` into backend and key.
+
+    Returns ``(None, path)`` for plain filesystem paths written before
+    the storage abstraction existed.
+    """
+    if "://" not in uri:
+        return None, uri
+    scheme, rest = uri.split("://", 1)
+    if scheme == "archive":
+        # packed cold archive, see app/archive.py
+        from .archive import get_archive
+
+        return get_archive(), rest
+    storage = get_storage()
+    if scheme != storage.scheme:
+        raise ValueError(f"Storage URI {uri} does not match STORAGE_BACKEND={storage.scheme}")
+    if isinstance(storage, S3Storage):
+        bucket, _, object_key = rest.partition("/")
+        if bucket != storage.bucket:
+            raise ValueError(f"Storage URI {uri} does not match bucket {storage.bucket}")
+        if storage.prefix:
+            object_key = object_key[len(storage.prefix) + 1 :]
+        return storage, object_key
+    return storage, rest
+
+
+def open_blob(uri: str) -> BinaryIO:
+    storage, key = resolve(uri)
+    return open(key, "rb") if storage is None else storage.open(key)
+
+
+@contextlib.contextmanager
+def blob_local_path(uri: str) -> Iterator[str]:
+    storage, key = resolve(uri)
+    if storage is None:
+        if not os.path.exists(key):
+            raise FileNotFoundError(key)
+        yield key
+    else:
+        with storage.local_path(key) as path:
+            yield path
+
+
+def blob_mtime(uri: str) -> float:
+    storage, key = resolve(uri)
+    return os.path.getmtime(key) if storage is None else storage.mtime(key)
+
+
+def delete_blob(uri: str) -> None:
+    storage, key = resolve(uri)
+    if storage is None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(key)
+    else:
+        storage.delete(key)
@@ -0,0 +1,146 @@
+"""First-page thumbnails for receipt previews.
+
+Rendering a PDF page is expensive, so every thumbnail is rendered once
+and cached on disk under the SHA-256 of the receipt file
+(``THUMBNAIL_CACHE_DIR``, default ``/tmp/thumbnails``).  Because the key
+is the content hash, identical files share one thumbnail and a cached
+image never goes stale.  The cache is bounded by
+``THUMBNAIL_CACHE_MAX_BYTES`` (default 256 MiB); when the limit is
+exceeded the least recently served thumbnails are evicted.  Serving a
+cached thumbnail only touches its modification time and never loads
+pdfplumber.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Optional
+
+from . import ocr
+from .storage import blob_local_path
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
+DEFAULT_WIDTH = 320
+
+
+class ThumbnailCache:
+    """Disk cache of PNG thumbnails with size-bounded LRU eviction."""
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        # one lock per key so that concurrent requests render a thumbnail once
+        self._key_locks: dict[str, threading.Lock] = {}
+
+    def path(self, content_hash: str, width: int) -> str:
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}-{width}.png")
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get_or_render(self, content_hash: str, file_uri: str, width: int = DEFAULT_WIDTH) -> str:
+        """Return the path of the cached thumbnail, rendering it if needed."""
+        path = self.path(content_hash, width)
+        if self._touch(path):
+            return path
+        lock = self._key_lock(path)
+        with lock:
+            if self._touch(path):
+                return path
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+            os.close(fd)
+            try:
+                with blob_local_path(file_uri) as source:
+                    _render(source, partial, width)
+                os.replace(partial, path)
+            except BaseException:
+                os.remove(partial)
+                raise
+            finally:
+                with self._lock:
+                    self._key_locks.pop(path, None)
+        self._account(os.path.getsize(path))
+        return path
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _account(self, added: int) -> None:
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, _, size in self._entries())
+            else:
+                self._total_bytes += added
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> list[tuple[float, str, int]]:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".png"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _evict(self) -> None:
+        """Delete the least recently used thumbnails down to 90 % of the budget."""
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        self._total_bytes = total
+        logging.info("Thumbnail cache: %d Vorschaubilder verdrängt", evicted)
+
+
+def _render(source: str, target: str, width: int) -> None:
+    """Render the first page (or the image itself) of ``source`` as PNG."""
+    if os.path.splitext(source)[1].lower() in IMAGE_EXTENSIONS:
+        from PIL import Image  # Pillow is installed together with pdfplumber
+
+        with Image.open(source) as image:
+            image.thumbnail((width, width * 2))
+            image.save(target, format="PNG")
+        return
+    with ocr.pdfplumber.open(source) as pdf:
+        if not pdf.pages:
+            raise ValueError("PDF enthält keine Seiten")
+        pdf.pages[0].to_image(width=width).save(target, format="PNG")
+
+
+def content_key(content_hash: Optional[str], file_uri: str) -> str:
+    """Cache key of a receipt; falls back to the URI for rows without hash."""
+    return content_hash or hashlib.sha256(file_uri.encode("utf-8")).hexdigest()
+
+
+thumbnail_cache = ThumbnailCache(
+    os.getenv("THUMBNAIL_CACHE_DIR", "/tmp/thumbnails"),
+    int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+)
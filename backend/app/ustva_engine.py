@@ -1,39 +1,54 @@
 """UStVA calculation utilities.
 
-This module provides a single function :func:`calculate_ustva` which
-aggregates receipt data for a given customer and month.  The function
-returns a dictionary containing the sales tax (``umsatzsteuer``), the
-input tax (``vorsteuer``) and the resulting amount payable to the
-German tax authorities (``zahllast``).  It also returns the
-formatted month string (``monat``).  The calculations operate on
-SQLAlchemy models defined in :mod:`app.models` and accept either an
-existing database session or create a new one on demand.
+This module provides :func:`calculate_ustva`, which aggregates the
+receipts of a customer for a given month, and :func:`calculate_ustva_bulk`,
+which does the same for many customers and periods at once.  The result
+contains the sales tax (``umsatzsteuer``) from outgoing invoices, the
+input tax (``vorsteuer``) from incoming invoices, the resulting amount
+payable to the German tax authorities (``zahllast``), the formatted
+month string (``monat``) and the ELSTER Kennzahlen of the return.
 
 Example usage::
 
     from app.ustva_engine import calculate_ustva
     result = calculate_ustva(customer_id=1, year=2025, month=7)
-    print(result["zahllast"])
+    print(result["zahllast"], result["kennzahlen"]["81"])
 
-Note that this implementation assumes all receipts represent revenue.
-In a real system you should distinguish between outgoing (sales)
-invoices and incoming (purchase) invoices to correctly separate
-``umsatzsteuer`` from ``vorsteuer``.
+All sums are computed in the database with a single
+``GROUP BY customer_id, year, month, direction, tax_rate`` statement;
+Python only maps the grouped rows onto the Kennzahlen:
+
+    81  Bemessungsgrundlage der Umsätze zu 19 % (volle Euro)
+    86  Bemessungsgrundlage der Umsätze zu 7 % (volle Euro)
+    35  Bemessungsgrundlage der Umsätze zu anderen Steuersätzen (volle Euro)
+    36  Steuer auf die Umsätze in Kz 35
+    66  abziehbare Vorsteuer aus Eingangsrechnungen
+    83  verbleibende Umsatzsteuer‑Vorauszahlung (``zahllast``)
+
+Outgoing receipts without a recognised tax rate count towards
+``umsatzsteuer`` but cannot be assigned to a Kennzahl; they are listed
+with ``steuersatz = None`` in ``nach_steuersatz`` so they can be
+reviewed before filing.
 """
 
 from __future__ import annotations
 
 import calendar
-import logging
 from datetime import date
-from decimal import Decimal
-from typing import Dict, Optional, Iterable
+from decimal import ROUND_DOWN, Decimal
+from typing import Any, Dict, Iterable, Optional, Tuple
 
+from sqlalchemy import extract, func, select
 from sqlalchemy.orm import Session
 
 from .database import SessionLocal
 from .models import Receipt
 
+INCOMING = "incoming"
+OUTGOING = "outgoing"
+CENT = Decimal("0.01")
+ZERO = Decimal("0.00")
+
 
 def _get_date_range(year: int, month: int) -> tuple[date, date]:
     """Return the start and end date for a given month.
@@ -54,12 +69,137 @@ def _get_date_range(year: int, month: int) -> tuple[date, date]:
     return start_date, end_date
 
 
+def _cents(column):
+    # summing whole cents keeps the result exact on backends that store
+    # NUMERIC as floating point (SQLite)
+    return func.coalesce(func.sum(func.round(column * 100)), 0)
+
+
+def _euros(cents: Any) -> Decimal:
+    return (Decimal(int(cents)) / 100).quantize(CENT)
+
+
+def _empty_result(customer_id: int, year: int, month: int) -> Dict[str, Any]:
+    return {
+        "customer_id": customer_id,
+        "monat": f"{year:04d}-{month:02d}",
+        "umsatzsteuer": ZERO,
+        "vorsteuer": ZERO,
+        "zahllast": ZERO,
+        "kennzahlen": {},
+        "nach_steuersatz": [],
+    }
+
+
+def _finish(result: Dict[str, Any]) -> Dict[str, Any]:
+    bases = {"81": ZERO, "86": ZERO, "35": ZERO}
+    other_tax = ZERO
+    for group in result["nach_steuersatz"]:
+        if group["richtung"] != OUTGOING or not group["steuersatz"]:
+            continue
+        kz = {19: "81", 7: "86"}.get(group["steuersatz"], "35")
+        bases[kz] += group["netto"]
+        if kz == "35":
+            other_tax += group["steuer"]
+    zahllast = result["umsatzsteuer"] - result["vorsteuer"]
+    result["zahllast"] = zahllast.quantize(CENT)
+    # Bemessungsgrundlagen werden in ELSTER ohne Cent gemeldet
+    kennzahlen = {kz: amount.quantize(Decimal("1"), rounding=ROUND_DOWN) for kz, amount in bases.items() if amount}
+    if other_tax:
+        kennzahlen["36"] = other_tax
+    if result["vorsteuer"]:
+        kennzahlen["66"] = result["vorsteuer"]
+    kennzahlen["83"] = result["zahllast"]
+    result["kennzahlen"] = kennzahlen
+    return result
+
+
+def results_from_groups(rows: Iterable[Tuple]) -> Dict[Tuple[int, str], Dict[str, Any]]:
+    """Build UStVA results from grouped sums.
+
+    ``rows`` are ``(customer_id, year, month, direction, tax_rate, count,
+    net_cents, tax_cents, gross_cents)`` – one per group, as returned by
+    the query of :func:`calculate_ustva_bulk` or computed from columnar
+    arrays by :mod:`app.analytics`.
+    """
+    results: Dict[Tuple[int, str], Dict[str, Any]] = {}
+    for customer_id, y, m, direction, rate, count, net, tax, gross in rows:
+        y, m = int(y), int(m)
+        key = (customer_id, f"{y:04d}-{m:02d}")
+        result = results.get(key)
+        if result is None:
+            result = results[key] = _empty_result(customer_id, y, m)
+        tax = _euros(tax)
+        if direction == INCOMING:
+            result["vorsteuer"] += tax
+        else:
+            result["umsatzsteuer"] += tax
+        result["nach_steuersatz"].append(
+            {
+                "richtung": direction,
+                "steuersatz": rate,
+                "anzahl": count,
+                "netto": _euros(net),
+                "steuer": tax,
+                "brutto": _euros(gross),
+            }
+        )
+    for result in results.values():
+        result["nach_steuersatz"].sort(key=lambda g: (g["richtung"], -(g["steuersatz"] or -1)))
+        _finish(result)
+    return results
+
+
+def calculate_ustva_bulk(
+    db: Session,
+    start: Tuple[int, int],
+    end: Tuple[int, int],
+    customer_ids: Optional[Iterable[int]] = None,
+) -> Dict[Tuple[int, str], Dict[str, Any]]:
+    """Compute the UStVA of many customers and months in one query.
+
+    Args:
+        db: SQLAlchemy session.
+        start: First period as ``(year, month)``.
+        end: Last period as ``(year, month)`` (inclusive).
+        customer_ids: Restrict to these customers; all customers when omitted.
+
+    Returns:
+        A dictionary keyed by ``(customer_id, "YYYY-MM")``.  Only
+        combinations with at least one receipt are present.  Receipts
+        flagged as possible duplicates (``duplicate_of_id``) are not
+        counted until the flag is resolved.
+    """
+    start_date, _ = _get_date_range(*start)
+    _, end_date = _get_date_range(*end)
+    year = extract("year", Receipt.date)
+    month = extract("month", Receipt.date)
+    stmt = (
+        select(
+            Receipt.customer_id,
+            year,
+            month,
+            Receipt.direction,
+            Receipt.tax_rate,
+            func.count(),
+            _cents(Receipt.net_amount),
+            _cents(Receipt.tax_amount),
+            _cents(Receipt.gross_amount),
+        )
+        .where(Receipt.date >= start_date, Receipt.date <= end_date, Receipt.duplicate_of_id.is_(None))
+        .group_by(Receipt.customer_id, year, month, Receipt.direction, Receipt.tax_rate)
+    )
+    if customer_ids is not None:
+        stmt = stmt.where(Receipt.customer_id.in_(list(customer_ids)))
+    return results_from_groups(db.execute(stmt))
+
+
 def calculate_ustva(
     customer_id: int,
     year: int,
     month: int,
     db: Optional[Session] = None,
-) -> Dict[str, Decimal | str]:
+) -> Dict[str, Any]:
     """Aggregate receipts and compute UStVA sums for one customer and period.
 
     Args:
@@ -74,55 +214,43 @@ def calculate_ustva(
         A dictionary with the following keys:
 
             ``monat`` – a string formatted as YYYY-MM
-            ``umsatzsteuer`` – total VAT collected from sales (Decimal)
-            ``vorsteuer`` – total input tax from purchases (Decimal)
+            ``umsatzsteuer`` – VAT on outgoing invoices (Decimal)
+            ``vorsteuer`` – input tax on incoming invoices (Decimal)
             ``zahllast`` – tax liability (Decimal) calculated as
             ``umsatzsteuer - vorsteuer``
-
-    Note:
-        This simplified implementation treats every receipt as a sales
-        invoice and therefore sets ``vorsteuer`` to zero.  Modify the
-        logic to separate incoming and outgoing receipts in a real
-        application.
+            ``kennzahlen`` – ELSTER Kennzahlen (see module docstring)
+            ``nach_steuersatz`` – sums per direction and tax rate
     """
     own_session = False
     if db is None:
         db = SessionLocal()
         own_session = True
     try:
-        start_date, end_date = _get_date_range(year, month)
-        # Query all receipts for the given customer and period
-        receipts: Iterable[Receipt] = (
-            db.query(Receipt)
-            .filter(
-                Receipt.customer_id == customer_id,
-                Receipt.date >= start_date,
-                Receipt.date <= end_date,
-            )
-            .all()
-        )
-        # Sum up amounts using Decimal to maintain precision
-        net_sum = Decimal("0.00")
-        tax_sum = Decimal("0.00")
-        gross_sum = Decimal("0.00")
-        for rec in receipts:
-            if rec.net_amount:
-                net_sum += Decimal(rec.net_amount)
-            if rec.tax_amount:
-                tax_sum += Decimal(rec.tax_amount)
-            if rec.gross_amount:
-                gross_sum += Decimal(rec.gross_amount)
-        # For this simple example treat all tax as sales tax
-        umsatzsteuer = tax_sum
-        vorsteuer = Decimal("0.00")
-        zahllast = umsatzsteuer - vorsteuer
+        results = calculate_ustva_bulk(db, (year, month), (year, month), [customer_id])
         period_str = f"{year:04d}-{month:02d}"
-        return {
-            "monat": period_str,
-            "umsatzsteuer": umsatzsteuer.quantize(Decimal("0.01")),
-            "vorsteuer": vorsteuer.quantize(Decimal("0.01")),
-            "zahllast": zahllast.quantize(Decimal("0.01")),
-        }
+        result = results.get((customer_id, period_str)) or _finish(_empty_result(customer_id, year, month))
+        del result["customer_id"]
+        return result
     finally:
         if own_session:
-            db.close()
\ No newline at end of file
+            db.close()
+
+
+def ustva_sums(result: Dict[str, Any]) -> Dict[str, Decimal]:
+    """Values of a stored :class:`~app.models.Ustva` row for a result.
+
+    ``net_sum``, ``tax_sum`` and ``gross_sum`` keep their meaning: the
+    sums over all receipts of the period, both directions.  The figures
+    of the return itself are stored separately as ``umsatzsteuer``,
+    ``vorsteuer`` and ``zahllast`` (Kz 83), exactly as ``/ustva/calc``
+    reports them.
+    """
+    groups = result["nach_steuersatz"]
+    return {
+        "net_sum": sum((g["netto"] for g in groups), ZERO),
+        "tax_sum": sum((g["steuer"] for g in groups), ZERO),
+        "gross_sum": sum((g["brutto"] for g in groups), ZERO),
+        "umsatzsteuer": result["umsatzsteuer"],
+        "vorsteuer": result["vorsteuer"],
+        "zahllast": result["zahllast"],
+    }
@@ -0,0 +1,17 @@
+"""Load-test tooling for the accounting backend.
+
+The package contains two command line tools that are meant to be run
+from the ``backend`` directory against a local database:
+
+* :mod:`loadtest.seed` – fills the database with synthetic customers,
+  receipts, open items and UStVA history using bulk inserts.
+* :mod:`loadtest.driver` – replays a realistic endpoint mix against
+  ``app.main:app`` (in-process or via HTTP) and reports throughput,
+  latency percentiles and error rates per endpoint.
+
+Typical usage::
+
+    export DATABASE_URL=sqlite:////tmp/loadtest.db
+    python -m loadtest.seed --customers 1000
+    python -m loadtest.driver --requests 5000 --concurrency 32
+"""
@@ -0,0 +1,229 @@
+"""Scripted load driver for the accounting API.
+
+Replays a weighted mix of the hot endpoints against ``app.main:app`` –
+either in-process through an ASGI transport (no server needed) or
+against a running server via ``--base-url`` – and reports throughput,
+latency percentiles and error rates per endpoint.
+
+The default mix approximates dashboard traffic during a filing rush::
+
+    list      GET  /receipts?customer_id=…             50 %
+    calc      GET  /ustva/calc/{customer}/{year}/{month} 25 %
+    generate  POST /ustva/generate/{customer}/{period}  15 %
+    upload    POST /receipts/upload?customer_id=…       10 %
+
+Example::
+
+    DATABASE_URL=sqlite:////tmp/loadtest.db \\
+        python -m loadtest.driver --requests 5000 --concurrency 32 \\
+        --mix list=60,calc=20,generate=10,upload=10
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal
+
+import httpx
+
+from .pdf import build_receipt_pdf
+from .seed import SUPPLIERS
+
+DEFAULT_MIX = {"list": 50, "calc": 25, "generate": 15, "upload": 10}
+
+
+@dataclass
+class EndpointStats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    status_codes: dict[int, int] = field(default_factory=lambda: defaultdict(int))
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def _parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}")
+        mix[name] = int(weight)
+    return mix
+
+
+class LoadDriver:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        customer_ids: list[int],
+        mix: dict[str, int],
+        months: int = 24,
+        seed: int = 1,
+    ) -> None:
+        self.client = client
+        self.customer_ids = customer_ids
+        self.names = list(mix)
+        self.weights = [mix[n] for n in self.names]
+        self.months = months
+        self.rng = random.Random(seed)
+        self.stats: dict[str, EndpointStats] = defaultdict(EndpointStats)
+
+    def _random_period(self) -> tuple[int, int]:
+        today = date.today()
+        index = today.year * 12 + today.month - 1 - self.rng.randrange(self.months)
+        return index // 12, index % 12 + 1
+
+    def _build_request(self, name: str) -> httpx.Request:
+        customer_id = self.rng.choice(self.customer_ids)
+        if name == "list":
+            return self.client.build_request("GET", "/receipts", params={"customer_id": customer_id})
+        year, month = self._random_period()
+        if name == "calc":
+            return self.client.build_request("GET", f"/ustva/calc/{customer_id}/{year}/{month}")
+        if name == "generate":
+            return self.client.build_request(
+                "POST", f"/ustva/generate/{customer_id}/{year:04d}-{month:02d}"
+            )
+        invoice_date = date(year, month, 1) + timedelta(days=self.rng.randrange(28))
+        pdf = build_receipt_pdf(
+            self.rng.choice(SUPPLIERS),
+            invoice_date,
+            Decimal(self.rng.randrange(500, 500000)).scaleb(-2),
+            19 if self.rng.random() < 0.85 else 7,
+        )
+        return self.client.build_request(
+            "POST",
+            "/receipts/upload",
+            params={"customer_id": customer_id},
+            files={"file": (f"loadtest-{self.rng.randrange(10**9)}.pdf", pdf, "application/pdf")},
+        )
+
+    async def _worker(self, deadline: float | None, remaining: list[int]) -> None:
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if deadline is None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            name = self.rng.choices(self.names, self.weights)[0]
+            request = self._build_request(name)
+            stats = self.stats[name]
+            started = time.perf_counter()
+            try:
+                response = await self.client.send(request)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            stats.latencies.append(time.perf_counter() - started)
+            stats.status_codes[status] += 1
+            if status == 0 or status >= 400:
+                stats.errors += 1
+
+    async def run(self, concurrency: int, requests: int | None, duration: float | None) -> float:
+        deadline = time.perf_counter() + duration if duration else None
+        remaining = [requests or 0]
+        started = time.perf_counter()
+        await asyncio.gather(*(self._worker(deadline, remaining) for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        total = errors = 0
+        for name, stats in sorted(self.stats.items()):
+            latencies = sorted(stats.latencies)
+            total += len(latencies)
+            errors += stats.errors
+            endpoints[name] = {
+                "requests": len(latencies),
+                "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+                "p50_ms": _percentile(latencies, 50) * 1000,
+                "p90_ms": _percentile(latencies, 90) * 1000,
+                "p99_ms": _percentile(latencies, 99) * 1000,
+                "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+                "error_rate": stats.errors / len(latencies) if latencies else 0.0,
+                "status_codes": dict(stats.status_codes),
+            }
+        return {
+            "elapsed_s": elapsed,
+            "requests": total,
+            "throughput_rps": total / elapsed if elapsed else 0.0,
+            "error_rate": errors / total if total else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+def _print_report(report: dict) -> None:
+    header = f"{'endpoint':<10} {'req':>8} {'rps':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'err %':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, row in report["endpoints"].items():
+        print(
+            f"{name:<10} {row['requests']:>8} {row['throughput_rps']:>9.1f} {row['p50_ms']:>9.1f} "
+            f"{row['p90_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f} {row['error_rate'] * 100:>7.2f}"
+        )
+    print("-" * len(header))
+    print(
+        f"{'total':<10} {report['requests']:>8} {report['throughput_rps']:>9.1f} "
+        f"in {report['elapsed_s']:.1f}s, error rate {report['error_rate'] * 100:.2f} %"
+    )
+
+
+async def _main(args: argparse.Namespace) -> dict:
+    if args.base_url:
+        transport = None
+        base_url = args.base_url
+    else:
+        from app.main import app
+
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        base_url = "http://loadtest"
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        transport=transport, base_url=base_url, timeout=args.timeout, limits=limits
+    ) as client:
+        response = await client.get("/customers")
+        response.raise_for_status()
+        customer_ids = [c["id"] for c in response.json()]
+        if not customer_ids:
+            raise SystemExit("No customers found – run `python -m loadtest.seed` first.")
+        driver = LoadDriver(client, customer_ids, args.mix, months=args.months, seed=args.seed)
+        elapsed = await driver.run(args.concurrency, args.requests, args.duration)
+        return driver.report(elapsed)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay an endpoint mix and report latencies.")
+    parser.add_argument("--base-url", help="target a running server instead of the in-process app")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, help="run for this many seconds instead")
+    parser.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX, help="e.g. list=50,calc=25,generate=15,upload=10")
+    parser.add_argument("--months", type=int, default=24, help="months of history to pick periods from")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(_main(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
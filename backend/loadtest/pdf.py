@@ -0,0 +1,77 @@
+"""Minimal PDF writer for synthetic receipts.
+
+The load driver needs real PDF uploads so that ``upload_receipt`` runs
+the full OCR path.  Instead of pulling in a PDF library this module
+writes a single-page document with one text line per row, which is all
+:func:`app.ocr.parse_receipt_pdf` needs to find supplier, date and
+amounts.
+"""
+
+from __future__ import annotations
+
+from datetime import date
+from decimal import Decimal
+from typing import Iterable
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _format_amount(value: Decimal) -> str:
+    """Format an amount the German way, e.g. ``1.234,56``."""
+    whole, frac = f"{value:.2f}".split(".")
+    groups = []
+    while len(whole) > 3:
+        groups.insert(0, whole[-3:])
+        whole = whole[:-3]
+    groups.insert(0, whole)
+    return ".".join(groups) + "," + frac
+
+
+def build_pdf(lines: Iterable[str]) -> bytes:
+    """Return the bytes of a one-page PDF showing ``lines`` as text."""
+    content_ops = ["BT", "/F1 11 Tf", "14 TL", "50 780 Td"]
+    for line in lines:
+        content_ops.append(f"({_escape(line)}) Tj T*")
+    content_ops.append("ET")
+    stream = "\n".join(content_ops).encode("latin-1", "replace")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref_offset,
+    )
+    return bytes(out)
+
+
+def build_receipt_pdf(supplier: str, invoice_date: date, net: Decimal, rate: int) -> bytes:
+    """Return a synthetic invoice with net, VAT and gross amounts."""
+    tax = (net * rate / 100).quantize(Decimal("0.01"))
+    gross = net + tax
+    return build_pdf(
+        [
+            supplier,
+            "Rechnung",
+            f"Rechnungsdatum: {invoice_date:%d.%m.%Y}",
+            f"Nettobetrag: {_format_amount(net)} EUR",
+            f"Umsatzsteuer {rate} %: {_format_amount(tax)} EUR",
+            f"Gesamtbetrag: {_format_amount(gross)} EUR",
+        ]
+    )
@@ -0,0 +1,246 @@
+"""Synthetic data seeder for load tests.
+
+Generates customers with realistic distributions of receipts, open items
+and UStVA history and writes them with chunked bulk inserts, so that
+10k customers with millions of receipts can be created in minutes on a
+single machine.  Reads the target database from ``DATABASE_URL`` like
+the application itself.
+
+Distributions (all reproducible via ``--seed``):
+
+* receipts per customer are log-normal around ``--receipts-mean`` – a
+  few large clients with thousands of receipts, many small ones;
+* receipt dates are spread over ``--months`` of history with a spike in
+  the last days of each month;
+* net amounts are log-normal (median ≈ 120 €), 85 % at 19 % VAT and
+  15 % at 7 % VAT;
+* roughly one open item per ten receipts, ~70 % of them paid and the
+  unpaid ones spread from 120 days overdue to 60 days in the future;
+* one UStVA record per closed month with receipts (about 10 % missing
+  to simulate late filers); the current month is never pre-generated.
+
+Example::
+
+    DATABASE_URL=sqlite:////tmp/loadtest.db python -m loadtest.seed --customers 10000
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import insert
+
+from app.database import Base, SessionLocal, engine
+from app.models import Customer, OpenItem, Receipt, Ustva
+
+SUPPLIERS = [
+    "Deutsche Telekom AG",
+    "Vodafone GmbH",
+    "Amazon EU S.à r.l.",
+    "Deutsche Bahn AG",
+    "Stadtwerke München GmbH",
+    "Büromarkt Böttcher AG",
+    "Lufthansa AG",
+    "Shell Deutschland GmbH",
+    "IKEA Deutschland GmbH",
+    "Hetzner Online GmbH",
+    "Google Ireland Ltd.",
+    "Adobe Systems Software Ireland",
+    "Bäckerei Müller",
+    "Steuerkanzlei Schmidt",
+    "Elektro Weber KG",
+]
+
+DESCRIPTIONS = ["Rechnung", "Wartungsvertrag", "Beratung", "Lieferung", "Miete", "Lizenz"]
+
+
+def _cents_to_decimal(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def _month_start(day: date, months_back: int) -> date:
+    index = day.year * 12 + day.month - 1 - months_back
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _random_receipt_date(rng: random.Random, today: date, months: int) -> date:
+    first = _month_start(today, rng.randrange(months))
+    next_month = _month_start(first, -1)
+    days_in_month = (next_month - first).days
+    if rng.random() < 0.3:
+        # month-end rush: last five days of the month
+        offset = days_in_month - 1 - rng.randrange(5)
+    else:
+        offset = rng.randrange(days_in_month)
+    day = first + timedelta(days=offset)
+    return min(day, today)
+
+
+class _Buffer:
+    """Collects rows per model and flushes them in bulk inserts."""
+
+    def __init__(self, session, chunk_size: int) -> None:
+        self.session = session
+        self.chunk_size = chunk_size
+        self.rows: dict[type, list[dict]] = defaultdict(list)
+        self.counts: dict[str, int] = defaultdict(int)
+
+    def add(self, model, row: dict) -> None:
+        rows = self.rows[model]
+        rows.append(row)
+        if len(rows) >= self.chunk_size:
+            self.flush(model)
+
+    def flush(self, model=None) -> None:
+        models = [model] if model is not None else list(self.rows)
+        for m in models:
+            rows = self.rows[m]
+            if rows:
+                self.session.execute(insert(m), rows)
+                self.counts[m.__tablename__] += len(rows)
+                rows.clear()
+        self.session.commit()
+
+
+def seed(
+    customers: int,
+    receipts_mean: float = 120.0,
+    months: int = 24,
+    chunk_size: int = 5000,
+    seed_value: int = 42,
+    today: date | None = None,
+) -> dict[str, int]:
+    """Insert synthetic data and return the number of rows per table."""
+    rng = random.Random(seed_value)
+    today = today or date.today()
+    now = datetime.utcnow()
+    run_tag = f"{int(time.time())}-{seed_value}"
+    # log-normal parameters so that the mean equals ``receipts_mean``
+    sigma = 1.0
+    mu = math.log(max(receipts_mean, 1.0)) - sigma**2 / 2
+    current_period = f"{today.year:04d}-{today.month:02d}"
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    buffer = _Buffer(session, chunk_size)
+    try:
+        for start in range(0, customers, chunk_size):
+            batch = [
+                {
+                    "name": f"Loadtest Mandant {i}",
+                    "email": f"loadtest-{run_tag}-{i}@example.com",
+                    "vat_id": f"DE{rng.randrange(10**8, 10**9)}",
+                }
+                for i in range(start, min(start + chunk_size, customers))
+            ]
+            customer_ids = session.scalars(
+                insert(Customer).returning(Customer.id, sort_by_parameter_order=True),
+                batch,
+            ).all()
+            session.commit()
+            buffer.counts["customers"] += len(customer_ids)
+
+            for customer_id in customer_ids:
+                n_receipts = max(1, int(rng.lognormvariate(mu, sigma)))
+                # net, tax, gross over all receipts, Umsatzsteuer, Vorsteuer
+                monthly: dict[str, list[int]] = defaultdict(lambda: [0, 0, 0, 0, 0])
+                for n in range(n_receipts):
+                    receipt_date = _random_receipt_date(rng, today, months)
+                    net = max(100, int(rng.lognormvariate(math.log(12000), 1.2)))
+                    rate = 19 if rng.random() < 0.85 else 7
+                    tax = (net * rate + 50) // 100
+                    gross = net + tax
+                    direction = "incoming" if rng.random() < 0.3 else "outgoing"
+                    buffer.add(
+                        Receipt,
+                        {
+                            "customer_id": customer_id,
+                            "file_path": f"seed/{customer_id}/{n}.pdf",
+                            "date": receipt_date,
+                            "net_amount": _cents_to_decimal(net),
+                            "tax_amount": _cents_to_decimal(tax),
+                            "gross_amount": _cents_to_decimal(gross),
+                            "supplier": rng.choice(SUPPLIERS),
+                            "tax_rate": rate,
+                            "direction": direction,
+                            "uploaded_at": now,
+                        },
+                    )
+                    sums = monthly[f"{receipt_date.year:04d}-{receipt_date.month:02d}"]
+                    sums[0] += net
+                    sums[1] += tax
+                    sums[2] += gross
+                    sums[4 if direction == "incoming" else 3] += tax
+
+                for period, (net, tax, gross, output_tax, input_tax) in monthly.items():
+                    if period == current_period or rng.random() < 0.1:
+                        continue
+                    buffer.add(
+                        Ustva,
+                        {
+                            "customer_id": customer_id,
+                            "period": period,
+                            "net_sum": _cents_to_decimal(net),
+                            "tax_sum": _cents_to_decimal(tax),
+                            "gross_sum": _cents_to_decimal(gross),
+                            "umsatzsteuer": _cents_to_decimal(output_tax),
+                            "vorsteuer": _cents_to_decimal(input_tax),
+                            "zahllast": _cents_to_decimal(output_tax - input_tax),
+                            "generated_at": now,
+                        },
+                    )
+
+                for _ in range(max(0, int(rng.gauss(n_receipts / 10, 2)))):
+                    buffer.add(
+                        OpenItem,
+                        {
+                            "customer_id": customer_id,
+                            "description": f"{rng.choice(DESCRIPTIONS)} {rng.randrange(10000, 99999)}",
+                            "amount": _cents_to_decimal(
+                                max(100, int(rng.lognormvariate(math.log(50000), 1.0)))
+                            ),
+                            "due_date": today + timedelta(days=rng.randint(-120, 60)),
+                            "paid": rng.random() < 0.7,
+                        },
+                    )
+            logging.info("Seeded %d/%d customers", min(start + chunk_size, customers), customers)
+        buffer.flush()
+    finally:
+        session.close()
+    return dict(buffer.counts)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Seed the database with synthetic load-test data.")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--receipts-mean", type=float, default=120.0, help="mean receipts per customer")
+    parser.add_argument("--months", type=int, default=24, help="months of history")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows per bulk insert")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    started = time.perf_counter()
+    counts = seed(
+        customers=args.customers,
+        receipts_mean=args.receipts_mean,
+        months=args.months,
+        chunk_size=args.chunk_size,
+        seed_value=args.seed,
+    )
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    for table, count in sorted(counts.items()):
+        print(f"{table:<12} {count:>12,}")
+    print(f"{'total':<12} {total:>12,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()